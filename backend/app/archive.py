@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+import time
+
+from app.cache import has_canonical_id
+
+# Ids per query when diffing a listing against the archive
+CHUNK = 500
+
+
+def entry_key(entry):
+    """Archive key of a listed or extracted item: (extractor, id), or the URL when it has no canonical id"""
+    if has_canonical_id(entry):
+        extractor = entry.get('extractor') or entry.get('ie_key') or entry.get('extractor_key')
+        return (extractor.lower(), str(entry['id']))
+    return ('url', entry.get('webpage_url') or entry.get('url'))
+
+
+class DownloadArchive:
+    """Persistent record of (extractor, id, quality) tuples already fetched.
+
+    Like yt-dlp's --download-archive, but in SQLite so listings with
+    thousands of items are diffed in a few indexed queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS archive (
+                extractor TEXT NOT NULL,
+                media_id TEXT NOT NULL,
+                quality TEXT NOT NULL,
+                task_id TEXT,
+                added_at REAL NOT NULL,
+                PRIMARY KEY (extractor, media_id, quality)
+            );
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, key, quality, task_id=None):
+        extractor, media_id = key
+        self._conn().execute(
+            'INSERT OR REPLACE INTO archive (extractor, media_id, quality, task_id, added_at) VALUES (?, ?, ?, ?, ?)',
+            (extractor, media_id, quality, task_id, time.time()),
+        )
+
+    def remove(self, key, quality):
+        extractor, media_id = key
+        self._conn().execute(
+            'DELETE FROM archive WHERE extractor = ? AND media_id = ? AND quality = ?', (extractor, media_id, quality))
+
+    def known(self, keys, quality):
+        """Return the subset of `keys` already archived for `quality`"""
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), CHUNK):
+            chunk = keys[i:i + CHUNK]
+            marks = ','.join('?' * len(chunk))
+            rows = self._conn().execute(
+                f'SELECT extractor, media_id FROM archive WHERE quality = ? AND media_id IN ({marks})',
+                (quality, *[media_id for _, media_id in chunk]),
+            ).fetchall()
+            found.update(rows)
+        return found.intersection(keys)
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM archive').fetchone()[0]
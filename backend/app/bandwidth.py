@@ -0,0 +1,137 @@
+import threading
+import time
+
+PRIORITIES = ('interactive', 'batch')
+# A class counts as competing for bandwidth this long after its last read
+ACTIVE_WINDOW = 1.0
+# Tasks idle this long drop out of stats()
+TASK_IDLE = 10.0
+
+
+def parse_weights(text):
+    """'interactive=8,batch=1' -> {'interactive': 8.0, 'batch': 1.0}"""
+    weights = dict.fromkeys(PRIORITIES, 1.0)
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        name, _, value = part.partition('=')
+        weights[name.strip()] = float(value)
+    return weights
+
+
+class BandwidthGovernor:
+    """Token bucket over the download bandwidth of the whole process.
+
+    `rate` bytes/s (0: unlimited, only measured) is split between the
+    priority classes that are reading right now, in proportion to their
+    weights, so batch jobs get the whole pipe when nobody interactive is
+    waiting and a small share when someone is. Readers pay for what they
+    read and sleep off any debt, which throttles the TCP stream itself.
+    """
+
+    def __init__(self, rate, weights, burst=0.25):
+        self.rate = rate
+        self.weights = weights
+        self.burst = burst
+        self._tokens = dict.fromkeys(weights, 0.0)
+        self._seen = dict.fromkeys(weights, 0.0)
+        self._bytes = dict.fromkeys(weights, 0)
+        self._tasks = {}
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _shares(self, now):
+        active = [c for c in self.weights if now - self._seen[c] < ACTIVE_WINDOW]
+        total = sum(self.weights[c] for c in active)
+        return {c: self.rate * self.weights[c] / total for c in active} if total else {}
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        for cls, share in self._shares(now).items():
+            self._tokens[cls] = min(self._tokens[cls] + share * elapsed, share * self.burst)
+
+    def consume(self, nbytes, priority, task_id=None):
+        """Account `nbytes` read for `task_id` and wait until the class can afford them"""
+        priority = priority if priority in self.weights else PRIORITIES[0]
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._seen[priority] = now
+            self._bytes[priority] += nbytes
+            if task_id is not None:
+                task = self._tasks.setdefault(
+                    task_id, {'priority': priority, 'bytes': 0, 'rate': 0.0, 'window_start': now, 'window_bytes': 0})
+                task['bytes'] += nbytes
+                task['window_bytes'] += nbytes
+                task['last'] = now
+                # Rate over the last second or so, for "who is using the pipe"
+                if now - task['window_start'] >= 1.0:
+                    task['rate'] = task['window_bytes'] / (now - task['window_start'])
+                    task['window_start'] = now
+                    task['window_bytes'] = 0
+            if not self.rate:
+                return
+            self._tokens[priority] -= nbytes
+            debt = -self._tokens[priority]
+            share = self._shares(now)[priority]
+        if debt > 0:
+            time.sleep(debt / share)
+
+    def meter(self, task_id, priority):
+        """Callable that charges reads of one task"""
+        return lambda nbytes: self.consume(nbytes, priority, task_id)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            for task_id in [t for t, s in self._tasks.items() if now - s['last'] > TASK_IDLE]:
+                del self._tasks[task_id]
+            shares = self._shares(now)
+            return {
+                'limit_bytes_per_sec': self.rate,
+                'classes': {
+                    cls: {
+                        'weight': self.weights[cls],
+                        'active': cls in shares,
+                        'share_bytes_per_sec': round(shares[cls]) if cls in shares and self.rate else None,
+                        'bytes': self._bytes[cls],
+                    } for cls in self.weights
+                },
+                'tasks': {
+                    task_id: {
+                        'priority': s['priority'],
+                        'bytes': s['bytes'],
+                        'bytes_per_sec': round(s['rate']),
+                    } for task_id, s in sorted(self._tasks.items(), key=lambda kv: -kv[1]['bytes'])
+                },
+            }
+
+
+class MeteredResponse:
+    """Proxy for a yt-dlp response that reports every read to `meter(nbytes)`.
+
+    A meter may raise to abort the download; the response is closed first
+    so its connection (and host slot) is not held until garbage collection.
+    """
+
+    def __init__(self, response, meter):
+        self._response = response
+        self._meter = meter
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        data = self._response.read(amt) if amt is not None else self._response.read()
+        if data:
+            try:
+                self._meter(len(data))
+            except BaseException:
+                self._response.close()
+                raise
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._response.close()
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+
+from app.scheduler import QueueFull
+
+
+class GroupScheduler:
+    """Feeds groups of tasks into a DownloadScheduler, at most `limit` per group at a time.
+
+    Waiting tasks of a group stay here rather than in the scheduler queue,
+    so a large batch neither fills the shared queue nor takes every worker.
+    `job(task_id)` returns the (fn, args) to submit for a task; call
+    `done(task_id)` when any task finishes to start the next ones.
+    """
+
+    def __init__(self, scheduler, job, on_group_done=None):
+        self.scheduler = scheduler
+        self.job = job
+        self.on_group_done = on_group_done
+        self._groups = {}
+        self._group_of = {}
+        self._lock = threading.Lock()
+
+    def add(self, group_id, task_ids, limit, client=None, weight=1.0):
+        """Register a group and start its first tasks; return how many were started"""
+        with self._lock:
+            self._groups[group_id] = {'waiting': deque(task_ids), 'running': set(), 'limit': max(1, limit),
+                                      'client': client, 'weight': weight}
+            for task_id in task_ids:
+                self._group_of[task_id] = group_id
+        return self._pump(group_id)
+
+    def remove(self, group_id):
+        with self._lock:
+            group = self._groups.pop(group_id, None)
+            for task_id in list(group['waiting']) + list(group['running']) if group else []:
+                self._group_of.pop(task_id, None)
+
+    def waiting(self, group_id):
+        with self._lock:
+            group = self._groups.get(group_id)
+            return len(group['waiting']) if group else 0
+
+    def cancel(self, task_id):
+        """Drop a task that hasn't been started yet; return False if it has (or is unknown).
+
+        Call `done(task_id)` afterwards, as for a finished task.
+        """
+        with self._lock:
+            group = self._groups.get(self._group_of.get(task_id))
+            if group is None or task_id not in group['waiting']:
+                return False
+            group['waiting'].remove(task_id)
+            return True
+
+    def done(self, task_id):
+        """Note that `task_id` finished and start whatever can run now"""
+        finished = None
+        with self._lock:
+            group_id = self._group_of.pop(task_id, None)
+            group = self._groups.get(group_id)
+            if group is not None:
+                group['running'].discard(task_id)
+                if not group['waiting'] and not group['running']:
+                    del self._groups[group_id]
+                    finished = group_id
+            group_ids = list(self._groups)
+        if finished and self.on_group_done:
+            self.on_group_done(finished)
+        # A finished task also frees room in the shared queue for other groups
+        for gid in group_ids:
+            self._pump(gid)
+
+    def _pump(self, group_id):
+        started = 0
+        while True:
+            with self._lock:
+                group = self._groups.get(group_id)
+                if group is None or not group['waiting'] or len(group['running']) >= group['limit']:
+                    return started
+                task_id = group['waiting'].popleft()
+                group['running'].add(task_id)
+            fn, args = self.job(task_id)
+            try:
+                self.scheduler.submit(task_id, fn, *args, client=group['client'], weight=group['weight'])
+            except QueueFull:
+                # Shared queue (or the client's part of it) is full; retry
+                # when some task finishes
+                with self._lock:
+                    group['running'].discard(task_id)
+                    group['waiting'].appendleft(task_id)
+                return started
+            started += 1
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """Tracks running jobs by key so identical requests can attach to them"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, task_id):
+        """Register `task_id` for `key`; return the leader's task id if one is already running"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = [task_id]
+                return None
+            flight.append(task_id)
+            return flight[0]
+
+    def members(self, key):
+        """Task ids currently sharing the flight for `key`, leader first"""
+        with self._lock:
+            return list(self._flights.get(key, ()))
+
+    def members_of(self, task_id):
+        """Task ids sharing a flight with `task_id` (just `task_id` when it has none)"""
+        with self._lock:
+            for flight in self._flights.values():
+                if task_id in flight:
+                    return list(flight)
+        return [task_id]
+
+    def finish(self, key):
+        """Close the flight for `key` and return the task ids that were attached to it"""
+        with self._lock:
+            flight = self._flights.pop(key, [])
+        return flight[1:]
+
+
+# Extractors whose ids are made up from the URL's basename, so they are not
+# unique across pages: /a/watch.html and /b/watch.html both become 'watch'
+URL_DERIVED_ID_EXTRACTORS = ('generic', 'html5mediaembed')
+
+
+def has_canonical_id(info):
+    """True if `info` carries an id that identifies the media on its own"""
+    extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+    return bool(extractor and info.get('id')) and extractor.lower() not in URL_DERIVED_ID_EXTRACTORS
+
+
+def media_key(info, media_type, quality):
+    """Cache key for an extracted item, or None if it has no canonical id.
+
+    Uses the extractor's canonical id rather than the submitted URL, so
+    different links to the same media (e.g. youtu.be vs youtube.com/watch)
+    share an entry. Items of generic/embed extractors get None: they are
+    neither coalesced nor cached.
+    """
+    if not info or info.get('_type', 'video') != 'video' or not has_canonical_id(info):
+        return None
+    extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+    return (f"{extractor}:{info['id']}", media_type, quality)
@@ -0,0 +1,76 @@
+import os
+import signal
+import threading
+
+
+class TaskCancelled(Exception):
+    """Raised inside a job (from its yt-dlp hooks) once everyone waiting for it has cancelled"""
+
+
+class CancelRegistry:
+    """Task ids whose requesters asked to cancel and haven't been cleaned up yet"""
+
+    def __init__(self):
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def cancel(self, task_id):
+        with self._lock:
+            self._cancelled.add(task_id)
+
+    def is_cancelled(self, task_id):
+        return task_id in self._cancelled
+
+    def all_cancelled(self, task_ids):
+        task_ids = list(task_ids)
+        return bool(task_ids) and all(t in self._cancelled for t in task_ids)
+
+    def discard(self, task_id):
+        with self._lock:
+            self._cancelled.discard(task_id)
+
+
+def _children(pid):
+    """Direct children of `pid`, from /proc (empty where /proc isn't available)"""
+    # /proc/<pid>/task/<tid>/children would miss processes whose starting
+    # thread has exited, so match on the parent pid instead
+    children = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Fields after the parenthesised command name: state, ppid, ...
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def kill_processes(path):
+    """Kill child processes of this server whose command line mentions `path`.
+
+    ffmpeg and aria2c are started by yt-dlp from whichever worker thread runs
+    the job, so they are found by the task's work directory in their
+    arguments. Returns the number of processes signalled.
+    """
+    killed = 0
+    for pid in _children(os.getpid()):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+        except OSError:
+            continue
+        if path in cmdline:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                killed += 1
+            except OSError:
+                pass
+    return killed
@@ -0,0 +1,58 @@
+import threading
+
+# Process-wide storage clients. Each is created on first use (after any
+# fork, so Celery's prefork children get their own) and then shared by all
+# worker threads, keeping its connection pool and credentials warm.
+_clients = {}
+_lock = threading.Lock()
+
+
+def shared(name, factory):
+    """Return the client registered as `name`, creating it with `factory()` once"""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def gcs_client(pool_size=32):
+    """google-cloud-storage client with room for `pool_size` concurrent connections"""
+
+    def create():
+        from google.cloud import storage
+        from requests.adapters import HTTPAdapter
+        client = storage.Client()
+        # requests keeps 10 connections per host by default; parallel part
+        # uploads from several workers need more to actually reuse them
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        client._http.mount('https://', adapter)
+        client._http.mount('http://', adapter)
+        return client
+
+    return shared('gcs', create)
+
+
+def s3_client(endpoint_url, access_key, secret_key, pool_size=32):
+    """boto3 S3 client; boto3 clients are safe to share between threads"""
+
+    def create():
+        import boto3
+        from botocore.client import Config
+        return boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(signature_version='s3v4', max_pool_connections=pool_size),
+            region_name=None,
+        )
+
+    return shared('s3', create)
+
+
+def once(name, fn):
+    """Run `fn()` the first time `name` is requested in this process; later calls return its result"""
+    return shared(f'once:{name}', lambda: fn() or True)
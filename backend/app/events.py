@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+
+class Subscription:
+    """Queue of events for a set of tasks, consumed on one event loop"""
+
+    def __init__(self, task_ids, loop, maxsize=256):
+        self.task_ids = set(task_ids)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def _offer(self, event):
+        # Runs on the subscriber's loop. A slow client only loses
+        # intermediate progress: the oldest event makes room for the newest.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class EventBus:
+    """Fans task events out from worker threads to async subscribers"""
+
+    def __init__(self):
+        self._subs = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_ids):
+        """Create a subscription; must be called from the consuming event loop"""
+        sub = Subscription(task_ids, asyncio.get_running_loop())
+        with self._lock:
+            for task_id in sub.task_ids:
+                self._subs.setdefault(task_id, []).append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for task_id in sub.task_ids:
+                subs = self._subs.get(task_id)
+                if subs and sub in subs:
+                    subs.remove(sub)
+                    if not subs:
+                        del self._subs[task_id]
+
+    def publish(self, task_id, event):
+        """Deliver `event` to every subscriber of `task_id`; safe from any thread"""
+        with self._lock:
+            subs = list(self._subs.get(task_id, ()))
+        event = dict(event, task_id=task_id)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+            except RuntimeError:
+                # Subscriber's loop has shut down
+                self.unsubscribe(sub)
+
+
+class ProgressReporter:
+    """yt-dlp progress and postprocessor hook that publishes task events.
+
+    Download progress is rate limited to one event per `interval` seconds;
+    stage changes are always published. `targets` returns the task ids that
+    should receive the events (the running task plus any attached ones) and
+    `on_snapshot(task_id, event)` can persist the latest event for polling.
+    """
+
+    def __init__(self, bus, targets, on_snapshot=None, interval=0.5):
+        self.bus = bus
+        self.targets = targets
+        self.on_snapshot = on_snapshot
+        self.interval = interval
+        self._last = 0.0
+        self._stage = None
+        self._pp = None
+
+    def emit(self, stage, **fields):
+        event = dict(fields, state='DOWNLOADING', stage=stage)
+        self._stage = stage
+        for task_id in self.targets():
+            self.bus.publish(task_id, event)
+            if self.on_snapshot:
+                self.on_snapshot(task_id, event)
+
+    def progress_hook(self, d):
+        status = d.get('status')
+        now = time.monotonic()
+        if status == 'downloading' and self._stage == 'downloading' and now - self._last < self.interval:
+            return
+        self._last = now
+        self.emit(
+            'downloading' if status == 'downloading' else f'download_{status}',
+            downloaded_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            speed=d.get('speed'),
+            eta=d.get('eta'),
+            fragment_index=d.get('fragment_index'),
+            fragment_count=d.get('fragment_count'),
+        )
+
+    def postprocessor_hook(self, d):
+        name = d.get('postprocessor')
+        # yt-dlp may report the same start more than once
+        if d.get('status') == 'started' and (self._stage, self._pp) != ('postprocessing', name):
+            self._pp = name
+            self.emit('postprocessing', postprocessor=name)
@@ -0,0 +1,247 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Responses that mean the host wants fewer requests from us
+THROTTLE_STATUSES = (429, 503)
+# Longest Retry-After honoured before trying the host again
+MAX_PAUSE = 60
+
+
+class HostLimiter:
+    """Connection limit for one host, adjusted AIMD-style.
+
+    Every `window` seconds the limit grows while requests are queueing for
+    it and the measured throughput has not dropped: doubling until the first
+    sign of congestion (slow start), by one after that. A 429/503 or a
+    timeout halves it (once per window) and a Retry-After pauses the host.
+    """
+
+    def __init__(self, host, initial, minimum, maximum, window):
+        self.host = host
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.active = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.last_used = time.monotonic()
+        self.throughput = 0.0
+        self.totals = {'requests': 0, 'errors': 0, 'throttled': 0, 'bytes': 0}
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._slow_start = True
+        self._new_window(time.monotonic())
+
+    def _new_window(self, now):
+        self._window_started = now
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._window_peak = self.active
+        self._window_queued = self.waiting > 0
+
+    def acquire(self, check=None):
+        """Wait for a connection slot; `check()` runs while waiting and may raise to give up"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    if check:
+                        check()
+                    now = time.monotonic()
+                    pause = self.paused_until - now
+                    if pause <= 0 and self.active < int(self.limit):
+                        break
+                    self._window_queued = True
+                    # Re-check periodically: the limit can also grow on a timer
+                    self._cond.wait(min(pause, self.window) if pause > 0 else self.window)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.totals['requests'] += 1
+            self._window_peak = max(self._window_peak, self.active)
+            self.last_used = now
+
+    def wake(self):
+        """Make waiting acquire() calls run their check again"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self.last_used = time.monotonic()
+            self._adapt(self.last_used)
+            self._cond.notify_all()
+
+    def add_bytes(self, nbytes):
+        with self._cond:
+            self._window_bytes += nbytes
+            self.totals['bytes'] += nbytes
+            self._adapt(time.monotonic())
+
+    def failed(self, throttled, retry_after=None):
+        """Record a failed request; `throttled` marks a congestion signal"""
+        with self._cond:
+            now = time.monotonic()
+            self.totals['errors'] += 1
+            self._window_errors += 1
+            if not throttled:
+                return
+            self.totals['throttled'] += 1
+            self._slow_start = False
+            if now - self._last_decrease >= self.window:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = now
+                self._new_window(now)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + min(retry_after, MAX_PAUSE))
+
+    def _adapt(self, now):
+        elapsed = now - self._window_started
+        if elapsed < self.window:
+            return
+        throughput = self._window_bytes / elapsed
+        saturated = self._window_queued and self._window_peak >= int(self.limit)
+        if not self._window_errors and saturated and now - self._last_decrease >= self.window:
+            if throughput >= self.throughput * 0.95:
+                self.limit = min(self.maximum, self.limit * 2 if self._slow_start else self.limit + 1)
+            else:
+                # More connections made the host slower: step back
+                self._slow_start = False
+                self.limit = max(self.minimum, self.limit - 1)
+        self.throughput = throughput
+        self._new_window(now)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self.totals,
+                limit=int(self.limit),
+                active=self.active,
+                waiting=self.waiting,
+                bytes_per_sec=round(self.throughput),
+                paused_for=round(max(0.0, self.paused_until - time.monotonic()), 1),
+            )
+
+
+class HostBudget:
+    """Per-host connection limits shared by every download in the process.
+
+    `open(url, send, check=...)` waits for a slot on the URL's host (giving
+    up if `check()` raises, see wake()), calls `send()` and returns its
+    response wrapped so the slot is released at EOF or close.
+    Throttled requests are sent again once the host's pause is over.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=32, window=2.0, idle_ttl=600):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.idle_ttl = idle_ttl
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                self._prune()
+                limiter = self._hosts[host] = HostLimiter(host, self.initial, self.minimum, self.maximum, self.window)
+            return limiter
+
+    def _prune(self):
+        now = time.monotonic()
+        for host, limiter in list(self._hosts.items()):
+            if not limiter.active and not limiter.waiting and now - limiter.last_used > self.idle_ttl:
+                del self._hosts[host]
+
+    def open(self, url, send, retries=2, check=None):
+        limiter = self.limiter(url)
+        for attempt in range(retries + 1):
+            limiter.acquire(check)
+            try:
+                response = send()
+            except Exception as e:
+                status = getattr(getattr(e, 'response', None), 'status', None) or getattr(e, 'status', None)
+                throttled = status in THROTTLE_STATUSES
+                limiter.failed(throttled or is_timeout(e), retry_after(e))
+                limiter.release()
+                # Extraction requests have no retries of their own; the next
+                # acquire() waits out the host's Retry-After
+                if throttled and attempt < retries:
+                    continue
+                raise
+            return TrackedResponse(response, limiter)
+
+    def wake(self):
+        """Wake every waiting request, e.g. after a cancellation, so it checks again"""
+        with self._lock:
+            limiters = list(self._hosts.values())
+        for limiter in limiters:
+            limiter.wake()
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._hosts.values())
+        return {limiter.host: limiter.stats() for limiter in limiters}
+
+
+def is_timeout(error):
+    name = type(error).__name__.lower()
+    return 'timeout' in name or 'timed out' in str(error).lower()
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TrackedResponse:
+    """Proxy for a yt-dlp response that counts bytes and frees the host slot once"""
+
+    def __init__(self, response, limiter):
+        self._response = response
+        self._limiter = limiter
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def read(self, amt=None):
+        try:
+            data = self._response.read(amt) if amt is not None else self._response.read()
+        except Exception as e:
+            self._limiter.failed(is_timeout(e))
+            self._release()
+            raise
+        self._limiter.add_bytes(len(data))
+        if amt is None or not data:
+            self._release()
+        return data
+
+    def close(self):
+        try:
+            return self._response.close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    def __del__(self):
+        self._release()
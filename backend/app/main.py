@@ -1,13 +1,39 @@
 import os
+import json
+import time
 import uuid
-import threading
-import subprocess
+import asyncio
+import anyio
 import shutil
-from fastapi import FastAPI, HTTPException
+import hashlib
+import ipaddress
+import threading
+from datetime import timedelta
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import ValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from app.schemas import DownloadRequest
+from app.schemas import BatchDownloadRequest, DownloadRequest, ProbeRequest, SyncRequest
+from app.scheduler import ClientQueueFull, DownloadScheduler, QueueFull
+from app.output import OutputCollector, remove_workdir, task_workdir
+from app.cache import SingleFlight, TTLCache, media_key
+from app.probe import InfoProbe, list_entries, summarize
+from app.batch import GroupScheduler
+from app.archive import DownloadArchive, entry_key
+from app.store import FINISHED_STATES, open_store
+from app.quota import DiskQuota, tree_size
+from app.upload import GCSTarget, ParallelUploader, PipelinedUpload
+from app.clients import gcs_client
+from app.hosts import HostBudget
+from app.bandwidth import BandwidthGovernor, parse_weights
+from app.cancel import CancelRegistry, TaskCancelled, kill_processes
+from app.metrics import REQUEST_BUCKETS, Registry, RequestTimer
+from app.timeline import Timeline, span_exporter
+from app.events import EventBus, ProgressReporter
+from app.serving import RangeFileResponse, accel_redirect_response
+from app.streaming import StreamTracker, follow_file
+from app.postprocess import AUDIO_BITRATES, deferred_ydl, make_audio_pp, plan_audio, postprocess_stage
 # yt_dlp is imported lazily inside the worker so the API can start
 # without yt-dlp installed (useful for quick checks and CI).
 from urllib.parse import urlparse
@@ -26,9 +52,240 @@ os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 STORAGE_TYPE = os.getenv('STORAGE_TYPE', 'local').lower()
 GCS_BUCKET = os.getenv('GCS_BUCKET')
 
-# In-memory task storage
-tasks = {}
-tasks_lock = threading.Lock()
+# Uploads are sent as UPLOAD_PART_SIZE parts, UPLOAD_CONCURRENCY at a time.
+# With UPLOAD_PIPELINE, single-file downloads that no postprocessor rewrites
+# are uploaded while they are still downloading.
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(16 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '8'))
+UPLOAD_PIPELINE = os.getenv('UPLOAD_PIPELINE', 'false').lower() in ('1', 'true', 'yes')
+
+# Signed GCS URLs are valid for SIGNED_URL_TTL seconds and reused by /file
+# until SIGNED_URL_MARGIN seconds before they expire.
+SIGNED_URL_TTL = int(os.getenv('SIGNED_URL_TTL', '3600'))
+SIGNED_URL_MARGIN = int(os.getenv('SIGNED_URL_MARGIN', '300'))
+
+# When set (e.g. '/protected-downloads'), /file responds with X-Accel-Redirect
+# to this internal nginx location instead of streaming the file itself.
+ACCEL_REDIRECT_PREFIX = os.getenv('ACCEL_REDIRECT_PREFIX')
+
+# How long /stream waits for a download to start producing bytes
+STREAM_WAIT_TIMEOUT = int(os.getenv('STREAM_WAIT_TIMEOUT', '3600'))
+
+# Concurrency limits: at most MAX_WORKERS downloads run at once and up to
+# MAX_QUEUE more wait in line; anything beyond that is rejected with 429.
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
+MAX_QUEUE = int(os.getenv('MAX_QUEUE', '100'))
+
+# Merging, fixups and audio transcodes run in a separate pool sized to the
+# CPU count, so ffmpeg neither holds a download slot nor oversubscribes the
+# cores. When POSTPROCESS_QUEUE jobs are waiting, finished downloads wait
+# for room before taking their next job.
+POSTPROCESS_WORKERS = int(os.getenv('POSTPROCESS_WORKERS', str(os.cpu_count() or 2)))
+POSTPROCESS_QUEUE = int(os.getenv('POSTPROCESS_QUEUE', '16'))
+
+# Object storage uploads run in their own pool, so a large upload holds
+# neither a download nor an ffmpeg slot; as above, postprocess jobs wait
+# for room when UPLOAD_QUEUE uploads are waiting.
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+UPLOAD_QUEUE = int(os.getenv('UPLOAD_QUEUE', '16'))
+
+# Connections per host, shared by all downloads: start at HOST_CONNECTIONS,
+# grow while throughput does, halve on 429/503/timeouts, never above
+# HOST_MAX_CONNECTIONS. FRAGMENT_CONCURRENCY is only the per-download ceiling.
+ADAPTIVE_CONNECTIONS = os.getenv('ADAPTIVE_CONNECTIONS', 'true').lower() in ('1', 'true', 'yes')
+HOST_CONNECTIONS = int(os.getenv('HOST_CONNECTIONS', '8'))
+HOST_MAX_CONNECTIONS = int(os.getenv('HOST_MAX_CONNECTIONS', '32'))
+HOST_ADAPT_WINDOW = float(os.getenv('HOST_ADAPT_WINDOW', '2'))
+FRAGMENT_CONCURRENCY = int(os.getenv('FRAGMENT_CONCURRENCY', '32' if ADAPTIVE_CONNECTIONS else '16'))
+hosts = HostBudget(HOST_CONNECTIONS, 1, HOST_MAX_CONNECTIONS, HOST_ADAPT_WINDOW) if ADAPTIVE_CONNECTIONS else None
+
+# Download bandwidth of this process (bytes/s, 0: unlimited), split between
+# the 'interactive' and 'batch' priority classes by PRIORITY_WEIGHTS
+BANDWIDTH_LIMIT = int(os.getenv('BANDWIDTH_LIMIT', '0'))
+PRIORITY_WEIGHTS = parse_weights(os.getenv('PRIORITY_WEIGHTS', 'interactive=8,batch=1'))
+bandwidth = BandwidthGovernor(BANDWIDTH_LIMIT, PRIORITY_WEIGHTS)
+
+# Task storage: 'sqlite' (default, survives restarts) or 'memory'. Finished
+# tasks are removed TASK_TTL seconds after their last update.
+TASK_STORE = os.getenv('TASK_STORE', 'sqlite').lower()
+TASK_DB = os.getenv('TASK_DB', os.path.join(DOWNLOAD_DIR, '.tasks.db'))
+TASK_TTL = int(os.getenv('TASK_TTL', str(24 * 3600)))
+TASK_SWEEP_INTERVAL = int(os.getenv('TASK_SWEEP_INTERVAL', '300'))
+
+store = open_store(TASK_STORE, TASK_DB)
+store.start_sweeper(TASK_TTL, TASK_SWEEP_INTERVAL)
+
+# Jobs unfinished when the process stopped are re-queued at startup and
+# resume from their partial files (see recover_jobs); one interrupted more
+# than RECOVER_MAX_ATTEMPTS times, e.g. because it crashes the server, fails
+RECOVER_JOBS = os.getenv('RECOVER_JOBS', 'true').lower() == 'true'
+RECOVER_MAX_ATTEMPTS = int(os.getenv('RECOVER_MAX_ATTEMPTS', '3'))
+
+# Disk usage of DOWNLOAD_DIR: above DISK_HIGH_WATERMARK * DISK_QUOTA_BYTES the
+# least recently fetched artifacts are evicted down to DISK_LOW_WATERMARK;
+# artifacts not fetched for ARTIFACT_TTL seconds are evicted regardless, and
+# leftovers of failed or abandoned tasks are reclaimed. 0 disables the quota.
+DISK_QUOTA_BYTES = int(os.getenv('DISK_QUOTA_BYTES', '0'))
+DISK_HIGH_WATERMARK = float(os.getenv('DISK_HIGH_WATERMARK', '0.9'))
+DISK_LOW_WATERMARK = float(os.getenv('DISK_LOW_WATERMARK', '0.75'))
+ARTIFACT_TTL = int(os.getenv('ARTIFACT_TTL', str(24 * 3600)))
+DISK_SWEEP_INTERVAL = int(os.getenv('DISK_SWEEP_INTERVAL', '60'))
+disk_quota = DiskQuota(DOWNLOAD_DIR, store, DISK_QUOTA_BYTES, DISK_HIGH_WATERMARK, DISK_LOW_WATERMARK, ARTIFACT_TTL)
+disk_quota.start(DISK_SWEEP_INTERVAL)
+disk_quota.request_sweep()
+
+# Live progress for /events subscribers
+events = EventBus()
+
+# Per-client share of the download queue and workers; clients are told
+# apart by X-API-Key or, without one, by IP. CLIENT_WEIGHTS gives some API
+# keys a larger share ('key1=4,key2=2'; everyone else has weight 1).
+CLIENT_MAX_QUEUED = int(os.getenv('CLIENT_MAX_QUEUED', str(max(1, MAX_QUEUE // 4))))
+CLIENT_MAX_ACTIVE = int(os.getenv('CLIENT_MAX_ACTIVE', '0'))
+CLIENT_WEIGHTS = {k.strip(): float(v) for k, _, v in (p.partition('=') for p in os.getenv('CLIENT_WEIGHTS', '').split(',') if '=' in p)}
+# Reverse proxies (IPs or CIDRs, comma-separated) whose X-Forwarded-For is
+# believed; without this every caller behind a proxy shares its IP and
+# with it one CLIENT_MAX_QUEUED share
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False) for p in os.getenv('TRUSTED_PROXIES', '').split(',') if p.strip()]
+
+scheduler = DownloadScheduler(MAX_WORKERS, MAX_QUEUE, client_max_queued=CLIENT_MAX_QUEUED,
+                              client_max_active=CLIENT_MAX_ACTIVE)
+postprocess_pool = DownloadScheduler(POSTPROCESS_WORKERS, POSTPROCESS_QUEUE, name='postprocess')
+upload_pool = DownloadScheduler(UPLOAD_WORKERS, UPLOAD_QUEUE, name='upload')
+
+# Finished results keyed by (canonical media id, media_type, quality), and
+# the jobs currently producing them so duplicate requests can attach.
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '1800'))
+result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+inflight = SingleFlight()
+# Tasks cancelled through DELETE /task/{id}; a job stops once all its requesters have
+cancels = CancelRegistry()
+signed_urls = TTLCache(1024, max(1, SIGNED_URL_TTL - SIGNED_URL_MARGIN))
+
+# Extraction results per URL, shared by /probe and download_worker so a
+# download right after a probe skips the second extraction round-trip.
+INFO_CACHE_SIZE = int(os.getenv('INFO_CACHE_SIZE', '128'))
+INFO_CACHE_TTL = int(os.getenv('INFO_CACHE_TTL', '600'))
+info_probe = InfoProbe(INFO_CACHE_SIZE, INFO_CACHE_TTL, {
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 30,
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+})
+
+# Batches: items per request and how many of a batch download at once
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '2'))
+
+def batch_job(task_id):
+    task = store.get(task_id) or {}
+    return download_worker, (task_id, task.get('url'), task.get('media_type'), task.get('quality'),
+                             task.get('priority', 'batch'))
+
+def finish_batch(batch_id):
+    """Mark a batch finished once every item has; it succeeds if any item did"""
+    batch = store.get(batch_id)
+    if batch is None:
+        return
+    states = [(store.get(tid) or {}).get('state') for tid in batch.get('items', [])]
+    if 'SUCCESS' in states:
+        state = 'SUCCESS'
+    else:
+        state = 'CANCELLED' if states and all(s == 'CANCELLED' for s in states) else 'FAILURE'
+    store.update(batch_id, state=state, finished_at=time.time())
+    print(f"[{batch_id}] Batch finished: {states.count('SUCCESS')}/{len(states)} items succeeded")
+
+batches = GroupScheduler(scheduler, batch_job, on_group_done=finish_batch)
+
+# Items fetched by /sync, so the next pass over a channel skips them
+ARCHIVE_DB = os.getenv('ARCHIVE_DB', os.path.join(DOWNLOAD_DIR, '.archive.db'))
+archive = DownloadArchive(ARCHIVE_DB)
+
+# Prometheus metrics served at /metrics. Queue and bandwidth gauges are read
+# from the existing stats at scrape time; the rest are counters/histograms
+metrics = Registry()
+stage_seconds = metrics.histogram('downloader_stage_seconds', 'Duration of job stages', ['stage'])
+failures = metrics.counter('downloader_failures_total', 'Failed downloads by error category', ['reason'])
+tasks_finished = metrics.counter('downloader_tasks_finished_total', 'Finished tasks by final state', ['state'])
+request_seconds = metrics.histogram('downloader_http_request_seconds', 'API latency up to the response headers',
+                                    ['route', 'method', 'status'], REQUEST_BUCKETS)
+
+def pool_metric(field):
+    return lambda: [((name,), pool.stats()[field]) for name, pool in (('download', scheduler), ('postprocess', postprocess_pool),
+                                                                   ('upload', upload_pool))]
+
+metrics.collected('downloader_queue_depth', 'Jobs waiting for a worker', 'gauge', ['pool'], pool_metric('queued'))
+metrics.collected('downloader_active_workers', 'Workers running a job', 'gauge', ['pool'], pool_metric('active'))
+metrics.collected('downloader_workers', 'Worker threads', 'gauge', ['pool'], pool_metric('workers'))
+metrics.collected('downloader_downloaded_bytes_total', 'Bytes read from sources', 'counter', ['priority'],
+                  lambda: [((cls,), c['bytes']) for cls, c in bandwidth.stats()['classes'].items()])
+metrics.collected('downloader_download_bytes_per_second', 'Download rate of running jobs over the last second', 'gauge', [],
+                  lambda: [((), sum(t['bytes_per_sec'] for t in bandwidth.stats()['tasks'].values()))])
+app.add_middleware(RequestTimer, histogram=request_seconds)
+
+# Each task's stages (queue waits, extract, fetch, ffmpeg steps, upload) are
+# kept in its record as `timeline`; with TRACING=otel finished tasks are
+# also exported as OpenTelemetry spans. Off by default.
+TRACING = os.getenv('TRACING', '').lower()
+tracer = span_exporter(TRACING)
+
+def task_timeline(task_id, stages=None):
+    """Timeline for a job: each stage is saved to its record and observed in stage_seconds"""
+    def on_stage(stage):
+        stage_seconds.observe(stage['secs'], stage=stage['name'])
+        store.update(task_id, timeline=timeline.as_list())
+    timeline = Timeline(on_stage, stages)
+    return timeline
+
+def export_trace(task_id, record):
+    """Hand a finished task's timeline to the tracing exporter, if any"""
+    if tracer is None or not record.get('timeline'):
+        return
+    attributes = {'task.state': record['state']}
+    for field in ('media_type', 'quality', 'priority', 'batch_id', 'coalesced_with'):
+        if record.get(field):
+            attributes['task.' + field] = record[field]
+    try:
+        tracer.export(task_id, attributes, record['timeline'])
+    except Exception as e:
+        print(f"[{task_id}] Trace export failed: {type(e).__name__}: {e}")
+
+def is_trusted_proxy(host):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request):
+    """The caller's IP: the peer's, or behind TRUSTED_PROXIES the nearest untrusted X-Forwarded-For hop"""
+    host = request.client.host if request.client else 'unknown'
+    if not is_trusted_proxy(host):
+        return host
+    # Walk back from the nearest hop; entries left of an untrusted one may be forged
+    for hop in reversed(request.headers.get('x-forwarded-for', '').split(',')):
+        hop = hop.strip()
+        if hop:
+            host = hop
+            if not is_trusted_proxy(hop):
+                break
+    return host
+
+def client_identity(request: Request):
+    """(client id, weight) for fair queuing: the API key if sent, else the caller's IP"""
+    api_key = request.headers.get('x-api-key')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:12], CLIENT_WEIGHTS.get(api_key, 1.0)
+    return 'ip:' + client_address(request), 1.0
+
+def queue_full_error(e):
+    detail = ('Too many of your downloads are queued, please retry later' if isinstance(e, ClientQueueFull)
+              else 'Too many downloads in progress, please retry later')
+    return HTTPException(status_code=429, detail=detail, headers={'Retry-After': str(e.retry_after)})
 
 def validate_url(url: str) -> bool:
     """Validate URL is properly formed"""
@@ -38,17 +295,207 @@ def validate_url(url: str) -> bool:
     except:
         return False
 
-def download_worker(task_id, url, media_type, quality):
-    """Download video/audio with correct format selection"""
+def error_category(error_msg):
+    """Classify a yt-dlp error: not_available, cloudflare, copyright, not_found, unsupported or other"""
+    lowered = error_msg.lower()
+    if 'available' in lowered:
+        return 'not_available'
+    elif 'cloudflare' in lowered:
+        return 'cloudflare'
+    elif 'copyright' in lowered:
+        return 'copyright'
+    elif 'http error 404' in lowered:
+        return 'not_found'
+    elif 'unsupported url' in lowered:
+        return 'unsupported'
+    return 'other'
+
+def describe_error(error_msg, quality=None):
+    """Map a yt-dlp error to a message that is useful to the end user"""
+    category = error_category(error_msg)
+    if category == 'not_available':
+        return f"Content not available: {quality} quality may not be available for this source" if quality else "Content not available from this source"
+    elif category == 'cloudflare':
+        return "Source is protected by Cloudflare. Try a different URL."
+    elif category == 'copyright':
+        return "This content is copyright protected and cannot be downloaded."
+    elif category == 'not_found':
+        return "Video URL not found (404). Try a different URL."
+    elif category == 'unsupported':
+        return "URL format not supported by this service."
+    return error_msg
+
+def cached_result(key):
+    """Return a cached result whose artifact is still available"""
+    result = result_cache.get(key)
+    if result is None:
+        return None
+    # Evicted artifacts are deleted, so a missing file covers those too
+    if result.get('gcs_url') or os.path.exists(result.get('file_path') or ''):
+        return result
+    result_cache.pop(key)
+    return None
+
+def complete_task(task_id, record, key=None):
+    """Store the final record for a task and for any requests attached to it"""
+    followers = inflight.finish(key) if key else []
+    # Starting point for the disk quota's LRU order
+    record = dict(record, finished_at=time.time())
+    if record['state'] == 'CANCELLED':
+        # Requests that attached after everyone else cancelled still wanted the file
+        followers_record = {'state': 'FAILURE', 'error': 'Download was cancelled, please retry', 'finished_at': record['finished_at']}
+    else:
+        followers_record = dict(record)
+        if 'result' in followers_record:
+            followers_record['result'] = dict(record['result'], coalesced=True)
+    finals = [(task_id, record)] + [(follower, followers_record) for follower in followers]
+    for tid, final in finals:
+        # Read before the final record replaces the pending one
+        pending = store.get(tid) or {}
+        if cancels.is_cancelled(tid):
+            # Keeps what DELETE recorded, whatever the job got to
+            final = dict(pending, state='CANCELLED', finished_at=record['finished_at'])
+            cancels.discard(tid)
+        else:
+            if final['state'] == 'SUCCESS' and pending.get('archive_key'):
+                archive.add(tuple(pending['archive_key']), pending['quality'], tid)
+            # Kept from the job's record: its stages and restarts
+            final = dict(final, **{f: pending[f] for f in ('timeline', 'recoveries') if pending.get(f)})
+        store.put(tid, final)
+        events.publish(tid, dict(final, stage='done'))
+        tasks_finished.inc(state=final['state'])
+        export_trace(tid, dict(pending, **final))
+    disk_quota.request_sweep()
+    # Lets the next items of any batch these tasks belong to start
+    for tid, _ in finals:
+        batches.done(tid)
+
+def job_cancelled(task_id, key=None):
+    """True once every request waiting on this task's job has been cancelled"""
+    return cancels.all_cancelled(inflight.members(key) if key else [task_id])
+
+def cancel_job(task_id, key, workdir, pipelined=()):
+    """Clean up after a cancelled job: stop its processes, delete partial files"""
+    print(f"[{task_id}] Cancelled")
+    kill_processes(workdir)
+    for upload in pipelined:
+        upload.finish(False)
+    remove_workdir(workdir)
+    complete_task(task_id, {'state': 'CANCELLED'}, key)
+
+def gcs_bucket():
+    """GCS_BUCKET on the shared, pooled client"""
+    pool_size = UPLOAD_CONCURRENCY * (MAX_WORKERS + UPLOAD_WORKERS)
+    return gcs_client(pool_size).bucket(GCS_BUCKET)
+
+def gcs_uploader():
+    """Part uploader for GCS_BUCKET"""
+    return ParallelUploader(GCSTarget(gcs_bucket()), UPLOAD_PART_SIZE, UPLOAD_CONCURRENCY)
+
+def signed_gcs_url(name):
+    """Signed URL for an uploaded object, reused until shortly before it expires"""
+    url = signed_urls.get(name)
+    if url is None:
+        try:
+            # An int would be read as an absolute epoch time; a timedelta is relative
+            url = gcs_bucket().blob(name).generate_signed_url(expiration=timedelta(seconds=SIGNED_URL_TTL))
+        except Exception:
+            # No signing credentials (e.g. plain user credentials): hand out the object path
+            url = f'gs://{GCS_BUCKET}/{name}'
+        signed_urls.set(name, url)
+    return url
+
+def pipelined_stats(pipelined, dest_name, size):
+    """Wait for background uploads; return stats of the one that stored all of `dest_name`"""
+    found = None
+    for upload in pipelined:
+        upload.finish(True)
+        try:
+            stats = upload.result()
+        except Exception as e:
+            print(f"Pipelined upload of {upload.key} failed: {type(e).__name__}: {e}")
+            continue
+        # A download that restarted from scratch leaves a stale object behind
+        if upload.key == dest_name and stats['bytes'] == size:
+            found = dict(stats, pipelined=True)
+    return found
+
+def fail_task(task_id, e, quality, key=None):
+    """Log an exception from a worker and record it as a friendly error"""
+    import traceback
+    error_msg = str(e)
+    print(f"[{task_id}] EXCEPTION: {type(e).__name__}: {error_msg}")
+    print(f"[{task_id}] Traceback:")
+    print(traceback.format_exc())
+
+    failures.inc(reason=error_category(error_msg))
+    # Provide helpful error messages
+    error_msg = describe_error(error_msg, quality)
+
+    complete_task(task_id, {'state': 'FAILURE', 'error': error_msg}, key)
+
+
+def download_worker(task_id, url, media_type, quality, priority='interactive'):
+    """Fetch stage: download video/audio with correct format selection"""
+    key = None
+    pipelined = []
+    # Each task writes into its own directory, so the artifact can be
+    # identified without scanning DOWNLOAD_DIR or racing other tasks
+    workdir = task_workdir(DOWNLOAD_DIR, task_id)
+    task = store.get(task_id) or {}
+    timeline = task_timeline(task_id, task.get('timeline'))
+    if task.get('queued_at'):
+        timeline.add('queued', task['queued_at'], time.time())
     try:
-        # Lazy import to avoid failing server startup if yt-dlp isn't installed.
-        from yt_dlp import YoutubeDL
-        with tasks_lock:
-            tasks[task_id]['state'] = 'DOWNLOADING'
-        
-        # Prefix output filenames with the `task_id` so files are unique per request
+        if cancels.is_cancelled(task_id):
+            # Cancelled between leaving the queue and starting
+            raise TaskCancelled()
+        store.update(task_id, state='DOWNLOADING')
+
+        def check_cancelled(*_):
+            # Runs before every request and read, fragments included, and
+            # between postprocessors
+            if job_cancelled(task_id, key):
+                raise TaskCancelled()
+
+        bandwidth_meter = bandwidth.meter(task_id, priority)
+        fetched = {'bytes': 0}
+        def meter(nbytes):
+            check_cancelled()
+            fetched['bytes'] += nbytes
+            bandwidth_meter(nbytes)
+
+        reporter = ProgressReporter(
+            events,
+            targets=lambda: [t for t in (inflight.members(key) if key else [task_id]) if not cancels.is_cancelled(t)],
+            on_snapshot=lambda tid, event: store.update(tid, progress=event),
+        )
+        reporter.emit('extracting')
+        target_kbps = AUDIO_BITRATES.get(quality, 192)
+        audio_report = {}
+        # Audio can be streamed only when the source MP3 is kept as is
+        def on_stream_ready(stream):
+            for tid in reporter.targets():
+                store.update(tid, stream=stream)
+            if UPLOAD_PIPELINE and STORAGE_TYPE == 'gcs' and GCS_BUCKET:
+                # Written front to back and kept as is: upload while downloading
+                final_name = os.path.basename(stream['path']).removesuffix('.part')
+                try:
+                    pipelined.append(PipelinedUpload(gcs_uploader(), stream['path'], f"{task_id}_{final_name}"))
+                except Exception as e:
+                    print(f"[{task_id}] Pipelined upload not started: {type(e).__name__}: {e}")
+
+        tracker = StreamTracker(
+            on_ready=on_stream_ready,
+            rewrites_output=(lambda fmt: plan_audio(fmt, target_kbps) != 'passthrough') if media_type == 'audio' else False,
+        )
+
+        collector = OutputCollector()
         ydl_opts = {
-            'outtmpl': os.path.join(DOWNLOAD_DIR, f"{task_id}_%(id)s_%(height)sp.%(ext)s") if media_type == 'video' else os.path.join(DOWNLOAD_DIR, f"{task_id}_%(id)s.%(ext)s"),
+            'outtmpl': os.path.join(workdir, "%(id)s_%(height)sp.%(ext)s") if media_type == 'video' else os.path.join(workdir, "%(id)s.%(ext)s"),
+            'post_hooks': [collector],
+            'progress_hooks': [reporter.progress_hook, tracker.progress_hook],
+            'postprocessor_hooks': [check_cancelled, reporter.postprocessor_hook, timeline.postprocessor_hook(postprocess_stage)],
             'noplaylist': True,
             'quiet': False,
             'no_warnings': False,
@@ -65,9 +512,9 @@ def download_worker(task_id, url, media_type, quality):
         ydl_opts.update({
             'noprogress': True,
             'continuedl': True,
-            # Increased concurrent fragment downloads for higher throughput
-            # (keep reasonable to avoid fragment storm)
-            'concurrent_fragment_downloads': 16,
+            # Fragment threads per download; with ADAPTIVE_CONNECTIONS the
+            # per-host budget decides how many of them actually connect
+            'concurrent_fragment_downloads': FRAGMENT_CONCURRENCY,
             # Allow more retries for fragments
             'fragment_retries': 8,
         })
@@ -87,47 +534,97 @@ def download_worker(task_id, url, media_type, quality):
             # Ensure merged output format is MP4 (more predictable and fast merging)
             ydl_opts['merge_output_format'] = 'mp4'
         else:
-            # Audio format selection - extract and convert to MP3 with specific bitrate
-            bitrate_map = {'excellent': '320', 'good': '192', 'ok': '128'}
-            target_bitrate = bitrate_map.get(quality, '192')
-            
+            # Audio format selection - the MP3 is produced by a single
+            # postprocessor pass registered below (see app.postprocess)
             ydl_opts['format'] = 'bestaudio/best'
-            ydl_opts['postprocessors'] = [
-                {
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': target_bitrate,  # Use bitrate without 'k' suffix
-                }
-            ]
         
-        # Use aria2c for faster segmented downloads when available
-        if shutil.which('aria2c'):
+        # Use aria2c for faster segmented downloads when available; its
+        # connections bypass the per-host budget, so not with adaptive limits
+        if hosts is None and shutil.which('aria2c'):
             ydl_opts['external_downloader'] = 'aria2c'
             ydl_opts['external_downloader_args'] = ['-x', '16', '-s', '16', '-k', '1M']
 
-        # Download with yt-dlp
+        # Download with yt-dlp; postprocessing is deferred to postprocess_pool
         print(f"[{task_id}] Starting download: {url}")
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            downloaded_file = ydl.prepare_filename(info)
-            print(f"[{task_id}] Downloaded file: {downloaded_file}")
-        
-        # Find the most recently created file (the actual output)
-        files = [os.path.join(DOWNLOAD_DIR, f) for f in os.listdir(DOWNLOAD_DIR)
-                 if os.path.isfile(os.path.join(DOWNLOAD_DIR, f)) and not f.startswith('.')]
+        ydl = deferred_ydl(ydl_opts, hosts, meter, check_cancelled)
+        handed_off = False
+        try:
+            ydl.add_post_processor(tracker.plan_pp(), when='before_dl')
+            if media_type == 'audio':
+                ydl.add_post_processor(make_audio_pp(target_kbps, audio_report), when='post_process')
+            # Reuse a recent /probe (or earlier download) of the same URL, or
+            # wait for one already extracting it
+            def extract():
+                with timeline.stage('extract'):
+                    return ydl.extract_info(url, download=False, process=False)
+            info = info_probe.get(url, extract)
 
-        print(f"[{task_id}] Files in download dir: {len(files)}")
-        if not files:
-            print(f"[{task_id}] ERROR: No files found after download")
-            with tasks_lock:
-                tasks[task_id] = {'state': 'FAILURE', 'error': 'Download completed but file not found'}
+            # Reuse a finished result or attach to an identical running job
+            candidate = media_key(info, media_type, quality)
+            if candidate:
+                cached = cached_result(candidate)
+                if cached is None:
+                    leader = inflight.join(candidate, task_id)
+                    if leader:
+                        print(f"[{task_id}] Attached to running task {leader}")
+                        store.update(task_id, coalesced_with=leader)
+                        remove_workdir(workdir)
+                        return
+                    key = candidate
+                    # The previous leader may have finished since the first check
+                    cached = cached_result(key)
+                if cached is not None:
+                    print(f"[{task_id}] Serving cached result for {candidate[0]}")
+                    complete_task(task_id, {'state': 'SUCCESS', 'result': dict(cached, cached=True)}, key)
+                    remove_workdir(workdir)
+                    return
+
+            with timeline.stage('fetch', cpu='external_downloader' in ydl_opts) as stage:
+                info = ydl.process_ie_result(info, download=True)
+                # aria2c reads the source itself, past the meter
+                stage['bytes'] = tree_size(workdir) if 'external_downloader' in ydl_opts else fetched['bytes']
+
+            # Release this download slot; ffmpeg work waits for a CPU slot
+            reporter.emit('queued_postprocess')
+            timeline.start('queued_postprocess')
+            postprocess_pool.submit(task_id, finish_download, task_id, ydl, info, collector, reporter,
+                                    key, media_type, quality, audio_report, pipelined, workdir, timeline, block=True)
+            handed_off = True
+        finally:
+            if not handed_off:
+                ydl.close()
+    except Exception as e:
+        timeline.close(e)
+        if isinstance(e, TaskCancelled) or job_cancelled(task_id, key):
+            # Killed processes and aborted requests surface as other errors
+            cancel_job(task_id, key, workdir, pipelined)
             return
+        for upload in pipelined:
+            upload.finish(False)
+        fail_task(task_id, e, quality, key)
+
 
-        newest = max(files, key=os.path.getmtime)
-        print(f"[{task_id}] Most recent file: {newest}")
-        # File is already prefixed with task_id from ydl_opts template,
-        # so no need to rename it again
-        basename = os.path.basename(newest)
+def finish_download(task_id, ydl, info, collector, reporter, key, media_type, quality, audio_report, pipelined, workdir,
+                    timeline):
+    """Postprocess stage: merge/transcode, then publish the result or hand it to the upload stage"""
+    timeline.finish('queued_postprocess')
+    handed_off = False
+    try:
+        try:
+            if job_cancelled(task_id, key):
+                raise TaskCancelled()
+            ydl.run_deferred()
+        finally:
+            ydl.close()
+
+        # Final path as reported by yt-dlp after merging/postprocessing
+        newest = collector.resolve(info)
+        if not newest:
+            print(f"[{task_id}] ERROR: No files found after download")
+            failures.inc(reason='other')
+            complete_task(task_id, {'state': 'FAILURE', 'error': 'Download completed but file not found'}, key)
+            return
+        print(f"[{task_id}] Downloaded file: {newest}")
 
         file_size = os.path.getsize(newest)
 
@@ -139,99 +636,153 @@ def download_worker(task_id, url, media_type, quality):
             'type': media_type
         }
 
-        # If audio was requested at a higher bitrate than the source, re-encode
         if media_type == 'audio':
-            try:
-                # Probe input bitrate (kbps)
-                probe_cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=bit_rate', '-of', 'default=noprint_wrappers=1:nokey=1', newest]
-                p = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=10)
-                if p.returncode == 0 and p.stdout.strip():
-                    src_bps = int(p.stdout.strip())
-                    src_kbps = src_bps // 1000
-                else:
-                    src_kbps = None
-            except Exception:
-                src_kbps = None
-
-            bitrate_map = {'excellent': 320, 'good': 192, 'ok': 128}
-            target_kbps = bitrate_map.get(quality, None)
-
-            if target_kbps and src_kbps and src_kbps < target_kbps:
-                # Re-encode to requested bitrate (will increase file size but not quality)
-                base, ext = os.path.splitext(newest)
-                reenc_path = f"{base}_{target_kbps}kbps.mp3"
-                ff_cmd = ['ffmpeg', '-y', '-i', newest, '-b:a', f'{target_kbps}k', reenc_path]
-                try:
-                    subprocess.run(ff_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
-                    # Replace result with re-encoded file
-                    try:
-                        os.remove(newest)
-                    except Exception:
-                        pass
-                    newest = reenc_path
-                    file_size = os.path.getsize(newest)
-                    result['file_path'] = newest
-                    result['filename'] = os.path.basename(newest)
-                    result['size'] = file_size
-                except Exception:
-                    # If re-encode fails, continue with original file
-                    pass
+            # Plan, source bitrate and number of encode passes for this job
+            result['audio'] = audio_report
 
         # If configured, upload to Google Cloud Storage and return a signed URL
         if STORAGE_TYPE == 'gcs' and GCS_BUCKET:
-            try:
-                from google.cloud import storage
-                client = storage.Client()
-                bucket = client.bucket(GCS_BUCKET)
-                dest_name = os.path.basename(newest)
-                blob = bucket.blob(dest_name)
-                blob.upload_from_filename(newest)
-                # Try to generate a signed URL for 1 hour; fallback to gs:// path
-                try:
-                    signed = blob.generate_signed_url(expiration=3600)
-                except Exception:
-                    signed = f'gs://{GCS_BUCKET}/{dest_name}'
+            # Release this ffmpeg slot; the upload waits for an upload slot
+            reporter.emit('queued_upload')
+            timeline.start('queued_upload')
+            upload_pool.submit(task_id, upload_result, task_id, newest, result, reporter, key, quality, pipelined,
+                               workdir, timeline, block=True)
+            handed_off = True
+            return
 
-                result['gcs_url'] = signed
+        if key:
+            result_cache.set(key, result)
+        complete_task(task_id, {'state': 'SUCCESS', 'result': result}, key)
+
+    except Exception as e:
+        timeline.close(e)
+        if isinstance(e, TaskCancelled) or job_cancelled(task_id, key):
+            cancel_job(task_id, key, workdir, pipelined)
+            return
+        fail_task(task_id, e, quality, key)
+    finally:
+        if not handed_off:
+            # Abort background uploads that weren't collected above
+            for upload in pipelined:
+                upload.finish(False)
+
+def upload_result(task_id, path, result, reporter, key, quality, pipelined, workdir, timeline):
+    """Upload stage: store the file in GCS, then publish the result"""
+    timeline.finish('queued_upload')
+    try:
+        if job_cancelled(task_id, key):
+            raise TaskCancelled()
+        reporter.emit('uploading')
+        with timeline.stage('upload', bytes=result['size']):
+            try:
+                dest_name = f"{task_id}_{os.path.basename(path)}"
+                stats = pipelined_stats(pipelined, dest_name, result['size'])
+                if stats is None:
+                    stats = gcs_uploader().upload(path, dest_name)
+                result['upload'] = stats
+                # /file signs the object again once this URL is close to expiring
+                result['gcs_object'] = dest_name
+                result['gcs_url'] = signed_gcs_url(dest_name)
                 # Optionally remove local file to keep container stateless
                 try:
-                    os.remove(newest)
+                    os.remove(path)
                 except Exception:
                     pass
             except Exception as e:
                 # On failure, include the error but still mark as success with local file
                 result['gcs_error'] = str(e)
 
-        with tasks_lock:
-            tasks[task_id] = {'state': 'SUCCESS', 'result': result}
-                
+        if key:
+            result_cache.set(key, result)
+        complete_task(task_id, {'state': 'SUCCESS', 'result': result}, key)
+
     except Exception as e:
-        import traceback
-        error_msg = str(e)
-        print(f"[{task_id}] EXCEPTION: {type(e).__name__}: {error_msg}")
-        print(f"[{task_id}] Traceback:")
-        print(traceback.format_exc())
-        
-        # Provide helpful error messages
-        if 'available' in error_msg.lower():
-            error_msg = f"Content not available: {quality} quality may not be available for this source"
-        elif 'cloudflare' in error_msg.lower():
-            error_msg = "Source is protected by Cloudflare. Try a different URL."
-        elif 'copyright' in error_msg.lower():
-            error_msg = "This content is copyright protected and cannot be downloaded."
-        elif 'http error 404' in error_msg.lower():
-            error_msg = "Video URL not found (404). Try a different URL."
-        elif 'unsupported url' in error_msg.lower():
-            error_msg = "URL format not supported by this service."
-        
-        with tasks_lock:
-            tasks[task_id] = {'state': 'FAILURE', 'error': error_msg}
+        timeline.close(e)
+        if isinstance(e, TaskCancelled) or job_cancelled(task_id, key):
+            cancel_job(task_id, key, workdir, pipelined)
+            return
+        fail_task(task_id, e, quality, key)
+    finally:
+        # Abort background uploads that weren't collected above
+        for upload in pipelined:
+            upload.finish(False)
 
-# API Routes (before static mount)
-@app.post("/download")
-def create_download(req: DownloadRequest):
-    """Create a download task for a video or audio URL"""
-    # Validate input
+@app.on_event("startup")
+def check_bucket():
+    """Set up the storage client and check the bucket once, not per upload"""
+    if STORAGE_TYPE == 'gcs' and GCS_BUCKET:
+        try:
+            if not gcs_bucket().exists():
+                print(f"WARNING: GCS bucket {GCS_BUCKET} does not exist; uploads will fail")
+        except Exception as e:
+            print(f"WARNING: GCS bucket {GCS_BUCKET} check failed: {type(e).__name__}: {e}")
+
+@app.on_event("startup")
+def recover_jobs():
+    """Re-queue the jobs that were unfinished when the server last stopped.
+
+    A task downloads into DOWNLOAD_DIR/<task_id> with continuedl, so running
+    it again under the same id picks up its .part files and fragments
+    instead of starting over. Jobs that were postprocessing find their
+    download complete and only redo the postprocessing.
+    """
+    interrupted = 'Interrupted by a server restart. Please submit it again.'
+    for task_id in store.list_ids(('CANCELLED',)):
+        if not (store.get(task_id) or {}).get('finished_at'):
+            # Its job died with the process before cleaning up
+            remove_workdir(os.path.join(DOWNLOAD_DIR, task_id))
+            store.update(task_id, finished_at=time.time())
+
+    singles = []
+    batch_items = {}
+    batch_ids = []
+    for task_id in store.list_ids(('PENDING', 'DOWNLOADING')):
+        task = store.get(task_id)
+        if task is None:
+            continue
+        if task.get('kind') == 'batch':
+            batch_ids.append(task_id)
+            continue
+        attempts = task.get('recoveries', 0) + 1
+        if not RECOVER_JOBS or not task.get('url') or attempts > RECOVER_MAX_ATTEMPTS:
+            complete_task(task_id, {'state': 'FAILURE', 'error': interrupted})
+            continue
+        # Followers resume on their own and attach to their leader again
+        store.update(task_id, state='PENDING', recoveries=attempts, progress=None, stream=None, coalesced_with=None,
+                     queued_at=time.time())
+        if task.get('batch_id'):
+            batch_items.setdefault(task['batch_id'], []).append(task_id)
+        else:
+            singles.append((task_id, task))
+
+    for batch_id in batch_ids:
+        batch = store.get(batch_id)
+        items = batch_items.pop(batch_id, [])
+        if not items:
+            finish_batch(batch_id)
+            continue
+        client, weight = batch.get('client') or (None, 1.0)
+        batches.add(batch_id, items, batch.get('limit') or BATCH_CONCURRENCY, client, weight)
+    for items in batch_items.values():
+        # Items whose batch record is gone
+        singles.extend((task_id, store.get(task_id)) for task_id in items)
+
+    if singles or batch_ids:
+        print(f"Recovering {len(singles)} interrupted downloads and {len(batch_ids)} batches")
+    if not singles:
+        return
+
+    def requeue():
+        # Blocks while the queue is full rather than failing jobs at startup
+        for task_id, task in singles:
+            scheduler.submit(task_id, download_worker, task_id, task['url'], task['media_type'], task['quality'],
+                             task.get('priority', 'interactive'), block=True,
+                             client=task.get('client'), weight=task.get('weight', 1.0))
+
+    threading.Thread(target=requeue, name='recovery', daemon=True).start()
+
+def check_download_request(req: DownloadRequest):
+    """Reject requests with a bad URL, media type or quality (400) or when storage is full (507)"""
     if not validate_url(str(req.url)):
         raise HTTPException(status_code=400, detail='Invalid URL format')
     
@@ -246,58 +797,361 @@ def create_download(req: DownloadRequest):
     if req.quality not in valid_qualities.get(req.media_type, []):
         raise HTTPException(status_code=400, detail=f'Invalid quality for {req.media_type}')
     
+    if disk_quota.full():
+        disk_quota.request_sweep()
+        raise HTTPException(
+            status_code=507,
+            detail='Server storage is full, please retry later',
+            headers={'Retry-After': str(DISK_SWEEP_INTERVAL)}
+        )
+
+def enqueue_download(req, client, weight):
+    """Record a task for `req` and queue it; return (task_id, queue position)"""
     task_id = str(uuid.uuid4())
-    with tasks_lock:
-        tasks[task_id] = {
-            'state': 'PENDING',
-            'url': str(req.url),
-            'media_type': req.media_type,
-            'quality': req.quality
-        }
+    store.put(task_id, {
+        'state': 'PENDING',
+        'url': str(req.url),
+        'media_type': req.media_type,
+        'quality': req.quality,
+        'priority': req.priority,
+        # For recover_jobs() after a restart
+        'client': client,
+        'weight': weight,
+        # Start of the task's 'queued' stage
+        'queued_at': time.time(),
+    })
     
-    thread = threading.Thread(
-        target=download_worker,
-        args=(task_id, str(req.url), req.media_type, req.quality),
-        daemon=True
-    )
-    thread.start()
-    
-    return {"task_id": task_id, "status": "queued"}
+    try:
+        position = scheduler.submit(task_id, download_worker, task_id, str(req.url), req.media_type, req.quality,
+                                    req.priority, client=client, weight=weight)
+    except QueueFull as e:
+        store.delete(task_id)
+        raise queue_full_error(e)
+    return task_id, position
+
+# API Routes (before static mount). Routes that only read task state or
+# queues are async and run on the event loop: store reads don't wait on
+# writers (SQLite WAL, copy-on-write memory store) and scheduler calls take
+# a short lock. Store writes, filesystem calls, URL signing, reads of many
+# records (batches) and anything that probes or lists URLs go to the
+# threadpool.
+@app.post("/download")
+async def create_download(req: DownloadRequest, request: Request):
+    """Create a download task for a video or audio URL"""
+    check_download_request(req)
+    client, weight = client_identity(request)
+    # A store write may wait on SQLite's write lock
+    task_id, position = await anyio.to_thread.run_sync(enqueue_download, req, client, weight)
+    return {"task_id": task_id, "status": "queued", "queue_position": position}
+
+@app.post("/downloads/batch")
+def create_batch(req: BatchDownloadRequest, request: Request):
+    """Download a list of URLs and/or every item of a playlist as one batch"""
+    entries = [{'url': str(url), 'title': None} for url in req.urls]
+    title = None
+    if req.playlist_url:
+        if not validate_url(str(req.playlist_url)):
+            raise HTTPException(status_code=400, detail='Invalid URL format')
+        limit = min(req.max_items or BATCH_MAX_ITEMS, BATCH_MAX_ITEMS)
+        try:
+            listed, title = list_entries(str(req.playlist_url), info_probe.ydl_opts, limit=limit + 1)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=describe_error(str(e)))
+        if len(listed) > limit and not req.max_items:
+            raise HTTPException(status_code=400, detail=f'Playlist has more than {BATCH_MAX_ITEMS} items, set max_items')
+        entries.extend(listed[:limit])
+    if not entries:
+        raise HTTPException(status_code=400, detail='No URLs to download')
+    if len(entries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f'At most {BATCH_MAX_ITEMS} items per batch')
+
+    entries, invalid = check_entries(req, entries)
+    if not entries:
+        raise HTTPException(status_code=400, detail=f"No valid URLs to download ({invalid[0]['url']}: {invalid[0]['error']})")
+    batch_id, task_ids = start_batch(req, entries, title, client=client_identity(request), invalid=invalid)
+    return {
+        "batch_id": batch_id,
+        "status": "queued",
+        "count": len(task_ids),
+        "items": [{"task_id": tid, "title": e.get('title')} for tid, e in zip(task_ids, entries)],
+        "invalid": invalid,
+    }
+
+def check_entries(req, entries):
+    """Split listed entries into those that can be downloaded and the invalid ones.
+
+    One bad URL in a listing shouldn't fail the whole batch (or every
+    /sync of that channel), so it is left out and reported as
+    {url, title, error}.
+    """
+    valid, invalid = [], []
+    for entry, item in zip(entries, req.items([e['url'] for e in entries])):
+        if isinstance(item, ValidationError):
+            error = item.errors()[0]['msg']
+        elif not validate_url(str(item.url)):
+            error = 'Invalid URL format'
+        else:
+            valid.append(entry)
+            continue
+        invalid.append({'url': entry['url'], 'title': entry.get('title'), 'error': error})
+    return valid, invalid
+
+def start_batch(req, entries, title=None, client=(None, 1.0), **extra):
+    """Create a task per entry and a batch record over them, and start the first ones.
+
+    `req` supplies media_type, quality and max_concurrency; entries (checked
+    with check_entries()) may carry an 'archive_key' to record in the
+    download archive once fetched. `client` is the (id, weight) from
+    client_identity().
+    """
+    items = req.items([e['url'] for e in entries])
+    for item in items:
+        check_download_request(item)
+
+    batch_id = str(uuid.uuid4())
+    task_ids = [str(uuid.uuid4()) for _ in items]
+    for task_id, item, entry in zip(task_ids, items, entries):
+        store.put(task_id, {
+            'state': 'PENDING',
+            'url': str(item.url),
+            'media_type': item.media_type,
+            'quality': item.quality,
+            'priority': item.priority,
+            'client': client[0],
+            'batch_id': batch_id,
+            'queued_at': time.time(),
+            **({'archive_key': entry['archive_key']} if entry.get('archive_key') else {}),
+        })
+    limit = min(req.max_concurrency or BATCH_CONCURRENCY, MAX_WORKERS)
+    store.put(batch_id, {
+        'kind': 'batch',
+        'state': 'DOWNLOADING',
+        'title': title,
+        'media_type': req.media_type,
+        'quality': req.quality,
+        'items': task_ids,
+        # Final task records replace the pending ones, so listed titles live here
+        'titles': [e.get('title') for e in entries],
+        # For recover_jobs() after a restart
+        'limit': limit,
+        'client': list(client),
+        **extra,
+    })
+
+    if not batches.add(batch_id, task_ids, limit, *client):
+        # Nothing could be queued; don't keep a batch that would never start
+        batches.remove(batch_id)
+        for task_id in task_ids + [batch_id]:
+            store.delete(task_id)
+        raise queue_full_error(QueueFull(scheduler.retry_after()))
+    print(f"[{batch_id}] Batch of {len(task_ids)} items, {limit} at a time")
+    return batch_id, task_ids
+
+@app.post("/sync")
+def sync(req: SyncRequest, request: Request):
+    """Mirror channels/playlists: download only the entries not fetched before at this quality"""
+    sources = []
+    new = []
+    seen = set()
+    for url in req.urls:
+        if not validate_url(str(url)):
+            raise HTTPException(status_code=400, detail='Invalid URL format')
+        started = time.monotonic()
+        try:
+            listed, title = list_entries(str(url), info_probe.ydl_opts, limit=req.max_items)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"{url}: {describe_error(str(e))}")
+        keys = [entry_key(e) for e in listed]
+        known = archive.known(keys, req.quality)
+        fresh = 0
+        for entry, key in zip(listed, keys):
+            if key in known or key in seen:
+                continue
+            seen.add(key)
+            new.append(dict(entry, archive_key=list(key)))
+            fresh += 1
+        sources.append({
+            'url': str(url),
+            'title': title,
+            'listed': len(listed),
+            'skipped': len(listed) - fresh,
+            'new': fresh,
+            'list_secs': round(time.monotonic() - started, 3),
+        })
+
+    listed = sum(s['listed'] for s in sources)
+    fresh = len(new)
+    new, invalid = check_entries(req, new)
+    # Anything past the batch limit is picked up by the next sync
+    queued = new[:BATCH_MAX_ITEMS]
+    batch_id = None
+    if queued:
+        batch_id, _ = start_batch(req, queued, sources[0]['title'] if len(sources) == 1 else None,
+                                  client=client_identity(request), sync=sources, invalid=invalid)
+    print(f"[sync] {listed} listed, {listed - fresh} already fetched, {len(invalid)} invalid, {len(queued)} queued")
+    return {
+        "batch_id": batch_id,
+        "status": "queued" if queued else "up_to_date",
+        "listed": listed,
+        "skipped": listed - fresh,
+        "fetched": len(queued),
+        "deferred": len(new) - len(queued),
+        "invalid": invalid,
+        "sources": sources,
+    }
+
+@app.get("/downloads/batch/{batch_id}")
+def get_batch(batch_id: str):
+    """Aggregated progress of a batch and the status of each item"""
+    batch = store.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        raise HTTPException(status_code=404, detail='Batch not found')
+    counts = {}
+    downloaded = total = 0
+    items = []
+    titles = batch.get('titles') or [None] * len(batch['items'])
+    for task_id, title in zip(batch['items'], titles):
+        task = store.get(task_id) or {'state': 'EXPIRED'}
+        counts[task['state']] = counts.get(task['state'], 0) + 1
+        progress = task.get('progress') or {}
+        size = (task.get('result') or {}).get('size')
+        downloaded += size or progress.get('downloaded_bytes') or 0
+        total += size or progress.get('total_bytes') or 0
+        items.append(dict(task_view(task_id, task), task_id=task_id, title=title))
+    done = sum(n for state, n in counts.items() if state in FINISHED_STATES)
+    return {
+        "batch_id": batch_id,
+        "state": batch['state'],
+        "title": batch.get('title'),
+        "count": len(items),
+        "done": done,
+        "counts": counts,
+        "waiting": batches.waiting(batch_id),
+        **({"sync": batch['sync']} if batch.get('sync') else {}),
+        "invalid": batch.get('invalid', []),
+        "downloaded_bytes": downloaded,
+        "total_bytes": total,
+        "items": items,
+    }
+
+# Record fields kept from API responses and events: the source URL for
+# security, the caller's identity and share, the server-side partial file
+PRIVATE_FIELDS = ('url', 'client', 'weight', 'stream')
+
+def task_view(task_id, task):
+    """Public view of a task record"""
+    for field in PRIVATE_FIELDS:
+        task.pop(field, None)
+    if task.get('state') == 'PENDING':
+        position = scheduler.position(task_id)
+        if position is not None:
+            task['queue_position'] = position
+            # Place among the same client's jobs, which fair queuing serves in order
+            task['client_queue_position'] = scheduler.client_position(task_id)
+    return task
 
 @app.get("/status/{task_id}")
-def get_status(task_id: str):
+async def get_status(task_id: str):
     """Get the status of a download task"""
-    with tasks_lock:
-        if task_id not in tasks:
-            raise HTTPException(status_code=404, detail='Task not found')
-        task = tasks[task_id].copy()
-    
-    # Don't expose URL in response for security
-    task.pop('url', None)
-    return task
+    task = store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    return task_view(task_id, task)
 
-@app.get("/file/{task_id}")
-def get_file(task_id: str):
-    """Download the completed file"""
-    with tasks_lock:
-        if task_id not in tasks:
-            raise HTTPException(status_code=404, detail='Task not found')
-        
-        if tasks[task_id].get('state') != 'SUCCESS':
-            raise HTTPException(status_code=404, detail='File not ready or download failed')
-        
-        data = tasks[task_id].get('result', {})
-    
-    # If object was uploaded to GCS, return the signed URL
-    gcs_url = data.get('gcs_url')
-    if gcs_url:
-        return { 'gcs_url': gcs_url }
+def request_cancel(task_id):
+    """Cancel one task; return False if it had already finished"""
+    task = store.get(task_id)
+    if task is None or task.get('state') in FINISHED_STATES:
+        return False
+    cancels.cancel(task_id)
+    if hosts:
+        # Jobs waiting for a host connection slot notice right away
+        hosts.wake()
+    # finished_at is set once the job has let go of the task's directory
+    store.update(task_id, state='CANCELLED')
+    events.publish(task_id, dict(store.get(task_id) or {}, stage='done'))
+    if scheduler.cancel(task_id) or batches.cancel(task_id):
+        # Never started, so no worker will clean up after it
+        print(f"[{task_id}] Cancelled while queued")
+        store.update(task_id, finished_at=time.time())
+        cancels.discard(task_id)
+        batches.done(task_id)
+        return True
+    # Running: the job stops at its next hook or request. Kill ffmpeg now,
+    # unless another request still waits for the same job
+    flight = inflight.members_of(task.get('coalesced_with') or task_id)
+    if cancels.all_cancelled(flight):
+        kill_processes(os.path.join(DOWNLOAD_DIR, flight[0]))
+    return True
 
-    path = data.get('file_path')
-    if not path or not os.path.exists(path):
-        raise HTTPException(status_code=404, detail='File missing')
+@app.delete("/task/{task_id}")
+def cancel_task(task_id: str):
+    """Cancel a queued or running download (or every unfinished item of a batch)"""
+    task = store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    if task.get('kind') == 'batch':
+        cancelled = [tid for tid in task.get('items', []) if request_cancel(tid)]
+        return {"task_id": task_id, "cancelled_items": len(cancelled)}
+    if not request_cancel(task_id):
+        raise HTTPException(status_code=409, detail=f"Task already finished ({task.get('state')})")
+    return {"task_id": task_id, "state": "CANCELLED"}
+
+def sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+async def task_event_stream(task_ids):
+    """Server-Sent Events for `task_ids` until every one of them has finished"""
+    sub = events.subscribe(task_ids)
+    try:
+        # Subscribe before taking snapshots so no event falls in between
+        pending = set()
+        for task_id in task_ids:
+            task = store.get(task_id)
+            if task is None:
+                yield sse({'task_id': task_id, 'state': 'UNKNOWN', 'error': 'Task not found'})
+                continue
+            yield sse(dict(task_view(task_id, task), task_id=task_id, stage='snapshot'))
+            if task.get('state') not in FINISHED_STATES:
+                pending.add(task_id)
+        while pending:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            for field in PRIVATE_FIELDS:
+                event.pop(field, None)
+            yield sse(event)
+            if event.get('state') in FINISHED_STATES:
+                pending.discard(event['task_id'])
+    finally:
+        events.unsubscribe(sub)
+
+def event_response(task_ids):
+    return StreamingResponse(
+        task_event_stream(task_ids),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.get("/events/{task_id}")
+async def get_events(task_id: str):
+    """Stream progress events for one task"""
+    if store.get(task_id) is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    return event_response([task_id])
+
+@app.get("/events")
+async def get_events_multi(ids: str):
+    """Stream progress events for several tasks (comma-separated ids)"""
+    task_ids = list(dict.fromkeys(i.strip() for i in ids.split(',') if i.strip()))
+    if not task_ids or len(task_ids) > 100:
+        raise HTTPException(status_code=400, detail='Provide between 1 and 100 task ids')
+    return event_response(task_ids)
 
-    # Determine correct media type based on file extension
+def guess_media_type(path):
+    """Determine correct media type based on file extension"""
     media_type = 'application/octet-stream'
     if path.endswith('.mp4'):
         media_type = 'video/mp4'
@@ -313,16 +1167,142 @@ def get_file(task_id: str):
         media_type = 'audio/wav'
     elif path.endswith('.flac'):
         media_type = 'audio/flac'
+    return media_type
+
+def stat_or_none(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+@app.get("/file/{task_id}")
+async def get_file(task_id: str, request: Request):
+    """Download the completed file"""
+    task = store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail='Task not found')
+    
+    if task.get('state') != 'SUCCESS':
+        raise HTTPException(status_code=404, detail='File not ready or download failed')
+    
+    data = task.get('result', {})
+    
+    # If object was uploaded to GCS, return the signed URL
+    if data.get('gcs_object'):
+        # May create the client and call IAM to sign
+        return { 'gcs_url': await anyio.to_thread.run_sync(signed_gcs_url, data['gcs_object']) }
+    gcs_url = data.get('gcs_url')
+    if gcs_url:
+        return { 'gcs_url': gcs_url }
 
-    return FileResponse(
+    if task.get('evicted'):
+        raise HTTPException(status_code=410, detail='File expired, please download it again')
+
+    path = data.get('file_path')
+    disk_quota.touch(task_id)
+    stat_result = await anyio.to_thread.run_sync(stat_or_none, path) if path else None
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail='File missing')
+
+    media_type = guess_media_type(path)
+
+    if ACCEL_REDIRECT_PREFIX:
+        return accel_redirect_response(path, DOWNLOAD_DIR, ACCEL_REDIRECT_PREFIX, data.get('filename'), media_type)
+
+    return RangeFileResponse(
         path,
+        request.headers,
+        stat_result,
         filename=data.get('filename'),
-        media_type=media_type
+        media_type=media_type,
+        method=request.method
     )
 
 
+@app.get("/stream/{task_id}")
+async def stream_file(task_id: str, request: Request, cancel_on_disconnect: bool = False):
+    """Stream the output while it is still downloading.
+
+    Progressive single-file downloads are tail-followed from the partial
+    file; anything that needs a merge or re-encode is served once ready.
+    With `cancel_on_disconnect` the download is cancelled if the client
+    goes away before it has everything.
+    """
+    deadline = time.monotonic() + STREAM_WAIT_TIMEOUT
+    while True:
+        task = store.get(task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail='Task not found')
+        if task.get('state') == 'SUCCESS':
+            return await get_file(task_id, request)
+        if task.get('state') == 'FAILURE':
+            raise HTTPException(status_code=404, detail=task.get('error') or 'Download failed')
+        if task.get('state') == 'CANCELLED':
+            raise HTTPException(status_code=410, detail='Download was cancelled')
+        stream = task.get('stream')
+        if not stream and task.get('coalesced_with'):
+            stream = (store.get(task['coalesced_with']) or {}).get('stream')
+        if stream:
+            try:
+                file = await anyio.open_file(stream['path'], mode='rb')
+                break
+            except FileNotFoundError:
+                # Already renamed to its final name; completion is imminent
+                pass
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=504, detail='Timed out waiting for the download to start')
+        await asyncio.sleep(0.5)
+
+    def is_done():
+        state = (store.get(task_id) or {}).get('state')
+        if state in ('PENDING', 'DOWNLOADING'):
+            return None
+        return state == 'SUCCESS'
+
+    headers = {'Cache-Control': 'no-store'}
+    if stream.get('size'):
+        headers['Content-Length'] = str(stream['size'])
+    path = stream['path']
+    if path.endswith('.part'):
+        path = path[:-len('.part')]
+    body = follow_file(file, is_done)
+    if cancel_on_disconnect:
+        body = cancel_unless_finished(body, task_id)
+    return StreamingResponse(body, media_type=guess_media_type(path), headers=headers)
+
+async def cancel_unless_finished(chunks, task_id):
+    """Pass `chunks` through; cancel the task if the response stops before the end"""
+    finished = False
+    try:
+        async for chunk in chunks:
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            # Store writes and a process scan: not on the event loop. Shielded,
+            # as the response's task is usually being cancelled right now
+            with anyio.CancelScope(shield=True):
+                cancelled = await anyio.to_thread.run_sync(request_cancel, task_id)
+            if cancelled:
+                print(f"[{task_id}] Stream client disconnected; download cancelled")
+
+
+@app.post("/probe")
+def probe(req: ProbeRequest):
+    """Describe the formats a URL offers without downloading it"""
+    url = str(req.url)
+    if not validate_url(url):
+        raise HTTPException(status_code=400, detail='Invalid URL format')
+    try:
+        info = info_probe.get(url)
+    except Exception as e:
+        print(f"[probe] EXCEPTION: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=400, detail=describe_error(str(e)))
+    return summarize(info)
+
+
 @app.get("/api/formats")
-def get_formats():
+async def get_formats():
     """Get available format options"""
     return {
         "video": {
@@ -343,6 +1323,23 @@ def get_formats():
         }
     }
 
+@app.get("/api/stats")
+async def get_stats():
+    """Load of each pipeline stage: workers, queue depth and recent timings"""
+    return {
+        "download": scheduler.stats(),
+        "postprocess": postprocess_pool.stats(),
+        "upload": upload_pool.stats(),
+        "disk": disk_quota.stats(),
+        "hosts": hosts.stats() if hosts else {},
+        "bandwidth": bandwidth.stats(),
+    }
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.render(), media_type=metrics.content_type)
+
 # Serve frontend static files (last)
 frontend_path = os.path.join(os.path.dirname(__file__), '..', '..', 'frontend')
 if os.path.exists(frontend_path):
@@ -0,0 +1,41 @@
+import os
+import shutil
+
+
+def task_workdir(base_dir, task_id):
+    """Create and return the private output directory for a task"""
+    path = os.path.join(base_dir, task_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def remove_workdir(path):
+    """Delete a task's output directory and everything in it"""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class OutputCollector:
+    """yt-dlp post hook that records the final path of every finished file.
+
+    yt-dlp calls post hooks once per downloaded item after all postprocessors
+    (merge, audio extraction, moves) have run, so the reported path is the
+    actual artifact rather than an intermediate file.
+    """
+
+    def __init__(self):
+        self.paths = []
+
+    def __call__(self, filepath):
+        self.paths.append(filepath)
+
+    def resolve(self, info):
+        """Return the final artifact path for `info`, or None if nothing was produced"""
+        candidates = list(reversed(self.paths))
+        # Fall back to what yt-dlp recorded on the info dict itself
+        for fmt in reversed((info or {}).get('requested_downloads') or []):
+            candidates.append(fmt.get('filepath'))
+        candidates.append((info or {}).get('filepath'))
+        for path in candidates:
+            if path and os.path.isfile(path):
+                return path
+        return None
@@ -0,0 +1,152 @@
+import os
+import re
+
+from app.bandwidth import MeteredResponse
+
+# Target MP3 bitrate (kbps) for each audio quality
+AUDIO_BITRATES = {'excellent': 320, 'good': 192, 'ok': 128}
+# Postprocessors (by yt-dlp pp_key) timed as their own stage; other ffmpeg
+# steps count as 'fixup'
+POSTPROCESS_STAGES = {'Merger': 'merge', 'AudioTranscode': 'transcode', 'ExtractAudio': 'transcode'}
+
+
+def postprocess_stage(name):
+    """Timeline/metrics stage of a postprocessor, None for ones that aren't timed"""
+    if name in POSTPROCESS_STAGES:
+        return POSTPROCESS_STAGES[name]
+    return 'fixup' if name.startswith(('FFmpeg', 'Fixup')) else None
+
+
+def plan_audio(info, target_kbps):
+    """Decide how to turn the selected audio format into an MP3.
+
+    Uses the bitrate and codec yt-dlp reported for the selected format, so
+    no probing of the downloaded file is needed:
+      - 'passthrough': already an .mp3 at or above the target, keep it as is
+      - 'copy':        MP3 audio in another container, remux without encoding
+      - 'encode':      a single encode to MP3 at the target bitrate
+    """
+    acodec = (info.get('acodec') or '').lower()
+    source_kbps = info.get('abr') or info.get('tbr')
+    if acodec.startswith('mp3') and (source_kbps is None or source_kbps >= target_kbps * 0.95):
+        return 'passthrough' if info.get('ext') == 'mp3' else 'copy'
+    return 'encode'
+
+
+def make_audio_pp(target_kbps, report):
+    """Build the postprocessor that produces the final MP3 in one pass.
+
+    `report` is a dict that receives the plan, source codec/bitrate and the
+    number of lossy encode passes that were run.
+    """
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+
+    class AudioTranscodePP(FFmpegPostProcessor):
+        def run(self, info):
+            path = info['filepath']
+            plan = plan_audio(info, target_kbps)
+            report.update({
+                'plan': plan,
+                'source_codec': info.get('acodec'),
+                'source_kbps': info.get('abr') or info.get('tbr'),
+                'target_kbps': target_kbps,
+                'transcode_passes': 0,
+            })
+            if plan == 'passthrough':
+                return [], info
+
+            base = os.path.splitext(path)[0]
+            out_path = f'{base}.mp3' if not path.endswith('.mp3') else f'{base}.{target_kbps}k.mp3'
+            if plan == 'copy':
+                opts = ['-vn', '-acodec', 'copy']
+            else:
+                opts = ['-vn', '-acodec', 'libmp3lame', '-b:a', f'{target_kbps}k']
+            self.to_screen(f'{plan.capitalize()} audio to "{out_path}"')
+            self.run_ffmpeg(path, out_path, opts)
+            if plan == 'encode':
+                report['transcode_passes'] += 1
+            info['filepath'] = out_path
+            info['ext'] = 'mp3'
+            return [path], info
+
+    return AudioTranscodePP()
+
+
+def fix_fragment_resume():
+    """Make yt-dlp's .ytdl resume files record the last fragment actually written.
+
+    After appending fragment N to the .part file yt-dlp saves N as the point
+    to resume from, but with concurrent fragment downloads the progress hooks
+    of other threads overwrite that index with the number of fragments
+    *downloaded* in the meantime. Resuming from such a file skips fragments
+    that never reached the .part file. The appended fragment's own file name
+    (<tmpfile>-Frag<N>) still carries the right index, so save that one.
+    """
+    from yt_dlp.downloader.fragment import FragmentFD
+
+    if getattr(FragmentFD, '_resume_index_fixed', False):
+        return
+    write_ytdl_file = FragmentFD._write_ytdl_file
+
+    def _write_ytdl_file(self, ctx):
+        appended = re.search(r'-Frag(\d+)$', ctx.get('fragment_filename_sanitized') or '')
+        if appended:
+            ctx = dict(ctx, fragment_index=int(appended.group(1)))
+        return write_ytdl_file(self, ctx)
+
+    FragmentFD._write_ytdl_file = _write_ytdl_file
+    FragmentFD._resume_index_fixed = True
+
+
+def deferred_ydl(params, hosts=None, meter=None, check=None):
+    """Build a YoutubeDL that downloads now and postprocesses later.
+
+    yt-dlp runs merging, fixups and every 'post_process' postprocessor from
+    YoutubeDL.post_process() right after the download, in the thread that
+    fetched the data. The returned instance records those calls instead, so
+    the fetch worker can hand them to a CPU-sized pool; `run_deferred()`
+    replays them there. Call `close()` when done, not before.
+
+    With `hosts` (an app.hosts.HostBudget) every HTTP request, fragments
+    included, first waits for a connection slot on its host; with `meter`
+    every byte read is reported to it (see app.bandwidth). `check()` runs
+    before every request, and while one waits for a host slot, and may
+    raise to abort the download (app.cancel).
+    """
+    from yt_dlp import YoutubeDL
+
+    # Tasks are resumed after a restart (see recover_jobs in main)
+    fix_fragment_resume()
+
+    class DeferredPostprocessYDL(YoutubeDL):
+        def __init__(self, params):
+            super().__init__(params)
+            self.deferred = []
+
+        def post_process(self, filename, info, files_to_move=None):
+            # yt-dlp strips keys shared with the parent from this dict once
+            # process_info returns, so postprocess a snapshot and only copy
+            # the final path back into the requested_downloads entry
+            self.deferred.append((filename, dict(info), files_to_move, info))
+            info['filepath'] = filename
+            return info
+
+        def urlopen(self, req):
+            if check:
+                check()
+            if hosts is None:
+                response = super().urlopen(req)
+            else:
+                url = req if isinstance(req, str) else getattr(req, 'url', None) or req.get_full_url()
+                response = hosts.open(url, lambda: YoutubeDL.urlopen(self, req), check=check)
+            return MeteredResponse(response, meter) if meter else response
+
+        def run_deferred(self):
+            for filename, snapshot, files_to_move, target in self.deferred:
+                processed = YoutubeDL.post_process(self, filename, snapshot, files_to_move)
+                target['filepath'] = processed['filepath']
+                for hook in self._post_hooks:
+                    hook(processed['filepath'])
+            self.deferred = []
+
+    return DeferredPostprocessYDL(params)
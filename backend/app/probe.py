@@ -0,0 +1,129 @@
+import copy
+import threading
+
+from app.cache import TTLCache
+
+# Fields that can be large and are never needed to pick or download a format
+HEAVY_FIELDS = ('thumbnails', 'subtitles', 'automatic_captions', 'heatmap', 'description', 'comments')
+
+
+class InfoProbe:
+    """Caches yt-dlp extraction results (`process=False`) per URL.
+
+    Entries are bounded by count and age; format URLs handed out by sites
+    expire, so the TTL should stay well below their lifetime. Playlists are
+    not cached.
+    """
+
+    def __init__(self, maxsize, ttl, ydl_opts):
+        self.cache = TTLCache(maxsize, ttl)
+        self.ydl_opts = ydl_opts
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def peek(self, url):
+        """Return a private copy of the cached info for `url`, or None"""
+        info = self.cache.get(url)
+        return copy.deepcopy(info) if info is not None else None
+
+    def put(self, url, info):
+        if info.get('_type') == 'playlist':
+            # Unprocessed playlists list their entries as a generator, which
+            # can be neither copied nor replayed
+            return
+        slim = {k: v for k, v in info.items() if k not in HEAVY_FIELDS}
+        self.cache.set(url, copy.deepcopy(slim))
+
+    def get(self, url, extract=None):
+        """Return the info for `url`, extracting it at most once at a time.
+
+        `extract()` does the extraction instead of a YoutubeDL with this
+        probe's options, e.g. a download job's own instance.
+        """
+        info = self.peek(url)
+        if info is not None:
+            return info
+        with self._locks_lock:
+            lock = self._locks.setdefault(url, threading.Lock())
+        try:
+            with lock:
+                # Another caller may have filled the cache while we waited
+                info = self.peek(url)
+                if info is None:
+                    if extract is not None:
+                        info = extract()
+                    else:
+                        from yt_dlp import YoutubeDL
+                        with YoutubeDL(self.ydl_opts) as ydl:
+                            info = ydl.extract_info(url, download=False, process=False)
+                    self.put(url, info)
+                return info
+        finally:
+            with self._locks_lock:
+                self._locks.pop(url, None)
+
+
+def summarize(info):
+    """Trim an info dict down to what a client needs to choose a quality"""
+    duration = info.get('duration')
+    formats = []
+    for f in info.get('formats') or []:
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = int(f['tbr'] * 1000 / 8 * duration)
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'abr': f.get('abr'),
+            'tbr': f.get('tbr'),
+            'filesize_approx': size,
+        })
+    if not formats and info.get('url'):
+        # Direct media links expose a single implicit format
+        formats.append({'format_id': info.get('format_id'), 'ext': info.get('ext'),
+                        'height': info.get('height'), 'filesize_approx': info.get('filesize')})
+    heights = sorted({f['height'] for f in formats if f.get('height')}, reverse=True)
+    return {
+        'id': info.get('id'),
+        'extractor': info.get('extractor_key') or info.get('extractor'),
+        'title': info.get('title'),
+        'duration': duration,
+        'heights': heights,
+        'formats': formats,
+    }
+
+
+def list_entries(url, ydl_opts, limit=None):
+    """List the items of a playlist or channel URL without extracting each one.
+
+    Uses flat extraction, so a listing costs the playlist page requests
+    only; a URL that isn't a playlist yields itself as the single item.
+    Returns [{'url', 'id', 'title', 'extractor'}] and the playlist title.
+    """
+    from yt_dlp import YoutubeDL
+    opts = dict(ydl_opts, noplaylist=False, extract_flat='in_playlist', lazy_playlist=True)
+    if limit:
+        opts['playlistend'] = limit
+    with YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        entries = [info]
+    else:
+        entries = [e for e in info.get('entries') or [] if e]
+    items = []
+    for entry in entries:
+        # Flat entries carry the page URL in 'url'; resolved ones in 'webpage_url'
+        entry_url = entry.get('webpage_url') or entry.get('url')
+        if not entry_url or not entry_url.startswith(('http://', 'https://')):
+            continue
+        items.append({
+            'url': entry_url,
+            'id': entry.get('id'),
+            'title': entry.get('title'),
+            'extractor': entry.get('ie_key') or entry.get('extractor_key'),
+        })
+    return items[:limit] if limit else items, info.get('title')
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+from app.output import remove_workdir
+from app.store import FINISHED_STATES
+
+# Leftovers of interrupted yt-dlp downloads (fragments are `*.part-Frag<n>`)
+PARTIAL_MARKERS = ('.part', '.ytdl', '.temp.')
+
+ACTIVE_STATES = ('PENDING', 'DOWNLOADING')
+
+
+def is_partial(name):
+    return any(marker in name for marker in PARTIAL_MARKERS)
+
+
+def tree_size(path):
+    """Bytes used by the regular files below `path`"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def changed_at(path):
+    """Last time `path` itself changed; unlike mtime, yt-dlp can't backdate ctime"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    return max(st.st_mtime, st.st_ctime)
+
+
+class DiskQuota:
+    """Keeps DOWNLOAD_DIR under a byte quota and reclaims abandoned files.
+
+    Works on the per-task directories (DOWNLOAD_DIR/<task_id>). Each sweep:
+      - removes directories that no finished task serves files from (failed
+        tasks, results moved to object storage, and after `grace` idle
+        seconds also those of expired tasks or dead processes),
+      - evicts finished artifacts not fetched through /file for `ttl` seconds,
+      - above `high` * `quota_bytes`, evicts finished artifacts least recently
+        fetched first until usage is back under `low` * `quota_bytes`.
+    Every task serving an artifact is marked `evicted` in the store before
+    its files are deleted, so /file reports it as gone instead of pointing
+    at a missing path. A quota of 0 disables the size limit.
+    """
+
+    def __init__(self, root, store, quota_bytes=0, high=0.9, low=0.75, ttl=0, grace=600):
+        self.root = root
+        self.store = store
+        self.quota_bytes = max(0, quota_bytes)
+        self.high = high
+        self.low = min(low, high)
+        self.ttl = ttl
+        self.grace = grace
+        self.usage = 0
+        self.evictions = 0
+        self.reclaimed_bytes = 0
+        self._access = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def touch(self, task_id):
+        """Record a /file access for LRU ordering"""
+        self._access[task_id] = time.time()
+
+    def request_sweep(self):
+        """Run the next sweep now instead of at the next interval"""
+        self._wake.set()
+
+    def full(self):
+        """True when the last sweep could not bring usage under the quota"""
+        return bool(self.quota_bytes) and self.usage >= self.quota_bytes
+
+    def stats(self):
+        return {
+            'usage_bytes': self.usage,
+            'quota_bytes': self.quota_bytes,
+            'evictions': self.evictions,
+            'reclaimed_bytes': self.reclaimed_bytes,
+        }
+
+    def start(self, interval):
+        def loop():
+            while True:
+                self._wake.wait(interval)
+                self._wake.clear()
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Disk quota sweep failed: {type(e).__name__}: {e}")
+
+        t = threading.Thread(target=loop, name='disk-quota', daemon=True)
+        t.start()
+        return t
+
+    def sweep(self):
+        with self._lock:
+            return self._sweep()
+
+    def _owners(self):
+        """Map each directory holding a served artifact to the finished tasks serving it"""
+        owners = {}
+        for task_id in self.store.list_ids(('SUCCESS',)):
+            record = self.store.get(task_id) or {}
+            result = record.get('result') or {}
+            path = result.get('file_path')
+            if not path or record.get('evicted') or result.get('gcs_url'):
+                continue
+            owners.setdefault(os.path.dirname(os.path.abspath(path)), []).append((task_id, record))
+        return owners
+
+    def _sweep(self):
+        now = time.time()
+        owners = self._owners()
+        usage = 0
+        candidates = []
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.'):
+                # Task database and other bookkeeping
+                usage += tree_size(entry.path) if entry.is_dir(follow_symlinks=False) else _size(entry)
+                continue
+            if not entry.is_dir(follow_symlinks=False):
+                # Loose files from the flat layout used before per-task directories
+                if is_partial(entry.name) and now - changed_at(entry.path) > self.grace:
+                    self._reclaim(entry.path, _size(entry))
+                else:
+                    usage += _size(entry)
+                continue
+
+            size = tree_size(entry.path)
+            record = self.store.get(entry.name)
+            if record and (record.get('state') in ACTIVE_STATES or
+                           (record.get('state') == 'CANCELLED' and not record.get('finished_at'))):
+                # A cancelled task's job may still be writing here until it stops
+                usage += size
+                continue
+            serving = owners.get(entry.path)
+            if (not serving and record and record.get('state') == 'SUCCESS' and not record.get('evicted')
+                    and not (record.get('result') or {}).get('gcs_url')):
+                # Finished after the owner scan; look again next sweep. Results
+                # moved to object storage serve nothing from here and fall through
+                usage += size
+                continue
+            if not serving:
+                # A finished task's leftovers can go at once; unknown ones get a grace period
+                if (record and record.get('state') in FINISHED_STATES) or now - changed_at(entry.path) > self.grace:
+                    self._reclaim(entry.path, size)
+                else:
+                    usage += size
+                continue
+            last_used = max(
+                max(self._access.get(task_id, 0), rec.get('finished_at') or 0) for task_id, rec in serving
+            ) or changed_at(entry.path)
+            if self.ttl and now - last_used > self.ttl:
+                self._evict(entry.path, size, serving, 'ttl')
+                continue
+            usage += size
+            candidates.append((last_used, entry.path, size, serving))
+
+        # Forget accesses of tasks that no longer serve anything
+        live = {task_id for serving in owners.values() for task_id, _ in serving}
+        for task_id in [t for t in list(self._access) if t not in live]:
+            self._access.pop(task_id, None)
+
+        if self.quota_bytes and usage > self.quota_bytes * self.high:
+            target = self.quota_bytes * self.low
+            for _, path, size, serving in sorted(candidates, key=lambda c: c[0]):
+                if usage <= target:
+                    break
+                self._evict(path, size, serving, 'quota')
+                usage -= size
+        self.usage = usage
+
+    def _evict(self, path, size, serving, reason):
+        evicted_at = time.time()
+        for task_id, _ in serving:
+            self.store.update(task_id, evicted=evicted_at)
+            self._access.pop(task_id, None)
+        print(f"Evicting {path} ({size} bytes, {reason})")
+        remove_workdir(path)
+        self.evictions += 1
+        self.reclaimed_bytes += size
+
+    def _reclaim(self, path, size):
+        print(f"Reclaiming abandoned {path} ({size} bytes)")
+        if os.path.isdir(path):
+            remove_workdir(path)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                return
+        self.reclaimed_bytes += size
+
+
+def _size(entry):
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return 0
@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 3) if values else None
+
+
+class QueueFull(Exception):
+    """Raised when the admission queue is at capacity"""
+
+    def __init__(self, retry_after, message='Download queue is full'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ClientQueueFull(QueueFull):
+    """Raised when one client already has its maximum of queued jobs"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after, 'Client download queue is full')
+
+
+class DownloadScheduler:
+    """Bounded worker pool fed from per-client queues of download jobs.
+
+    A fixed number of worker threads pull jobs off the queue, so a burst of
+    submissions waits in line instead of starting one yt-dlp session each.
+    Jobs are tagged with the client that submitted them and served by
+    weighted fair queuing (self-clocked: each job gets a virtual finish
+    time `max(V, client's last finish) + 1/weight` and the smallest goes
+    next), so a client with 1,000 queued jobs delays another client's job
+    by at most about one job per worker. `client_max_queued` and
+    `client_max_active` bound what one client can hold (0: no limit).
+    Without client tags it is a plain FIFO; the postprocess stage uses the
+    same pool type under another `name`.
+    """
+
+    def __init__(self, workers, max_queue, name='download', client_max_queued=0, client_max_active=0):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.client_max_queued = client_max_queued
+        self.client_max_active = client_max_active
+        # client -> deque of (finish_tag, task_id, fn, args, queued_at)
+        self._queues = {}
+        self._queued = 0
+        self._vtime = 0.0
+        self._last_finish = {}
+        self._clients = {}
+        self._active_by_client = {}
+        self._active = {}
+        self._cond = threading.Condition()
+        # Recent job durations, used to estimate Retry-After
+        self._durations = deque(maxlen=50)
+        # Recent time jobs spent queued before a worker picked them up
+        self._waits = deque(maxlen=50)
+        self._completed = 0
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f'{name}-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, task_id, fn, *args, block=False, client=None, weight=1.0):
+        """Queue `fn(*args)` for `task_id` and return its 1-based queue position.
+
+        When the queue (or the client's share of it) is full this raises
+        QueueFull, or with `block=True` waits for a slot (back-pressure
+        from one pool onto another).
+        """
+        with self._cond:
+            while True:
+                if self._queued >= self.max_queue:
+                    error = QueueFull(self._retry_after_locked())
+                elif self.client_max_queued and len(self._queues.get(client, ())) >= self.client_max_queued:
+                    error = ClientQueueFull(self._retry_after_locked())
+                else:
+                    break
+                if not block:
+                    raise error
+                self._cond.wait()
+            # Weighted fair queuing: a job is worth 1/weight of virtual time
+            finish = max(self._vtime, self._last_finish.get(client, 0.0)) + 1.0 / max(weight, 1e-6)
+            self._last_finish[client] = finish
+            self._queues.setdefault(client, deque()).append((finish, task_id, fn, args, time.monotonic()))
+            self._clients[task_id] = client
+            self._queued += 1
+            self._cond.notify_all()
+            return self._position_locked(task_id)
+
+    def position(self, task_id):
+        """1-based position of a queued task, or None if it is not waiting"""
+        with self._cond:
+            return self._position_locked(task_id)
+
+    def cancel(self, task_id):
+        """Drop a queued job; return False if it isn't queued (running, done or unknown)"""
+        with self._cond:
+            client = self._clients.get(task_id)
+            queue = self._queues.get(client)
+            for item in queue or ():
+                if item[1] == task_id:
+                    queue.remove(item)
+                    if not queue:
+                        del self._queues[client]
+                        self._last_finish.pop(client, None)
+                    del self._clients[task_id]
+                    self._queued -= 1
+                    # Wake submitters blocked on a full queue
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    def client_position(self, task_id):
+        """1-based position of a queued task among its client's jobs, or None"""
+        with self._cond:
+            for i, item in enumerate(self._queues.get(self._clients.get(task_id), ())):
+                if item[1] == task_id:
+                    return i + 1
+        return None
+
+    def _position_locked(self, task_id):
+        key = next(((item[0], item[4]) for item in self._queues.get(self._clients.get(task_id), ())
+                    if item[1] == task_id), None)
+        if key is None:
+            return None
+        # Jobs are served in (finish tag, arrival) order, client caps aside
+        return 1 + sum(1 for queue in self._queues.values() for item in queue if (item[0], item[4]) < key)
+
+    def _next_locked(self):
+        """Pop the queued job with the smallest finish tag among clients under their active cap"""
+        # None is a valid client (untagged jobs), so track the head separately
+        best = head = None
+        for client, queue in self._queues.items():
+            if not queue:
+                continue
+            if self.client_max_active and self._active_by_client.get(client, 0) >= self.client_max_active:
+                continue
+            if head is None or (queue[0][0], queue[0][4]) < head:
+                best, head = client, (queue[0][0], queue[0][4])
+        if head is None:
+            return None
+        item = self._queues[best].popleft()
+        if not self._queues[best]:
+            # An idle client restarts from the current virtual time anyway
+            del self._queues[best]
+            self._last_finish.pop(best, None)
+        self._queued -= 1
+        self._vtime = max(self._vtime, item[0])
+        return best, item
+
+    def retry_after(self):
+        with self._cond:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self):
+        avg = sum(self._durations) / len(self._durations) if self._durations else 30.0
+        # A queue slot frees up each time any worker finishes a job
+        wait = avg / self.workers
+        return int(min(300, max(1, math.ceil(wait))))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'active': len(self._active),
+                'queued': self._queued,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'avg_wait_secs': _mean(self._waits),
+                'avg_run_secs': _mean(self._durations),
+                'clients': {
+                    str(client): {'queued': len(self._queues.get(client, ())),
+                                  'active': self._active_by_client.get(client, 0)}
+                    for client in set(self._queues) | set(self._active_by_client) if client is not None
+                },
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    picked = self._next_locked()
+                    if picked is not None:
+                        break
+                    self._cond.wait()
+                client, (_, task_id, fn, args, queued_at) = picked
+                self._clients.pop(task_id, None)
+                now = time.monotonic()
+                self._waits.append(now - queued_at)
+                self._active[task_id] = now
+                self._active_by_client[client] = self._active_by_client.get(client, 0) + 1
+                # Wake submitters blocked on a full queue
+                self._cond.notify_all()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[{task_id}] Worker error: {type(e).__name__}: {e}")
+            finally:
+                with self._cond:
+                    started = self._active.pop(task_id, None)
+                    if started is not None:
+                        self._durations.append(time.monotonic() - started)
+                    self._completed += 1
+                    self._active_by_client[client] -= 1
+                    if not self._active_by_client[client]:
+                        del self._active_by_client[client]
+                    # A client under its active cap may have jobs to start now
+                    self._cond.notify_all()
@@ -1,8 +1,53 @@
-from pydantic import BaseModel, HttpUrl
-from typing import Literal
+from pydantic import BaseModel, HttpUrl, ValidationError, conint
+from typing import List, Literal, Optional
 
 
 class DownloadRequest(BaseModel):
     url: HttpUrl
     media_type: Literal['video', 'audio']
     quality: str
+    # Share of the download bandwidth when it is contended (see app.bandwidth)
+    priority: Literal['interactive', 'batch'] = 'interactive'
+
+
+class ProbeRequest(BaseModel):
+    url: HttpUrl
+
+
+class GroupRequest(BaseModel):
+    """Fields shared by requests that download many URLs as one batch"""
+    media_type: Literal['video', 'audio']
+    quality: str
+    priority: Literal['interactive', 'batch'] = 'batch'
+    # Items of this batch downloading at the same time
+    max_concurrency: Optional[conint(ge=1)] = None
+
+    def items(self, urls):
+        """One DownloadRequest per URL with this batch's media type and quality.
+
+        URLs from a listing are not checked by the request model; one that
+        isn't valid (no TLD, too long, ...) gets its ValidationError instead.
+        """
+        items = []
+        for url in urls:
+            try:
+                items.append(DownloadRequest(url=url, media_type=self.media_type, quality=self.quality,
+                                             priority=self.priority))
+            except ValidationError as e:
+                items.append(e)
+        return items
+
+
+class BatchDownloadRequest(GroupRequest):
+    """Several URLs and/or a playlist, all fetched as `media_type`/`quality`"""
+    urls: List[HttpUrl] = []
+    playlist_url: Optional[HttpUrl] = None
+    # Playlist entries to take, from the start
+    max_items: Optional[conint(ge=1)] = None
+
+
+class SyncRequest(GroupRequest):
+    """Channels/playlists to mirror; only entries not fetched before at `quality` are downloaded"""
+    urls: List[HttpUrl]
+    # Newest entries to look at per source; None lists everything
+    max_items: Optional[conint(ge=1)] = None
@@ -0,0 +1,235 @@
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import FileResponse, Response
+
+# More byte ranges than this in one request are answered with the full file
+MAX_RANGES = 16
+
+
+def make_etag(stat_result):
+    """Strong validator from size and nanosecond mtime"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """Parse a Range header into sorted, merged (start, end) pairs.
+
+    Returns None when the header is malformed (it must then be ignored) and
+    an empty list when it is valid but no range overlaps the file.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for part in header[len('bytes='):].split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+        else:
+            start = int(first)
+            if last and start > int(last):
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header, etag, weak):
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if weak and candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class RangeFileResponse(FileResponse):
+    """FileResponse with conditional requests and byte-range support.
+
+    Handles If-None-Match / If-Modified-Since (304), Range with If-Range
+    (206, multipart/byteranges for several ranges, 416 when unsatisfiable).
+    The body is sent in large chunks, each one positional read in a worker
+    thread (the first also opens the file), so a small file costs a single
+    threadpool hop. uvicorn has no sendfile path; for zero-copy sends put
+    nginx in front (accel_redirect_response).
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path, request_headers, stat_result, **kwargs):
+        self.request_headers = request_headers
+        super().__init__(path, stat_result=stat_result, **kwargs)
+
+    def set_stat_headers(self, stat_result):
+        self.headers['content-length'] = str(stat_result.st_size)
+        self.headers['last-modified'] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers['etag'] = make_etag(stat_result)
+        self.headers['accept-ranges'] = 'bytes'
+
+    def _plan(self):
+        """Return (status, ranges) for the request"""
+        headers = self.request_headers
+        st = self.stat_result
+        etag = self.headers['etag']
+        inm = headers.get('if-none-match')
+        if inm is not None:
+            if _etag_matches(inm, etag, weak=True):
+                return 304, None
+        elif headers.get('if-modified-since') and _not_modified_since(headers['if-modified-since'], st.st_mtime):
+            return 304, None
+
+        range_header = headers.get('range')
+        if not range_header:
+            return 200, None
+        if_range = headers.get('if-range')
+        if if_range:
+            if if_range.startswith('"') or if_range.startswith('W/'):
+                # If-Range needs a strong match
+                if if_range.strip() != etag:
+                    return 200, None
+            elif if_range.strip() != self.headers['last-modified']:
+                return 200, None
+        ranges = parse_range(range_header, st.st_size)
+        if ranges is None or len(ranges) > MAX_RANGES:
+            return 200, None
+        if not ranges:
+            return 416, None
+        return 206, ranges
+
+    async def __call__(self, scope, receive, send):
+        size = self.stat_result.st_size
+        status, ranges = self._plan()
+        parts = []
+
+        if status == 304:
+            for name in ('content-length', 'content-type', 'content-disposition', 'accept-ranges'):
+                if name in self.headers:
+                    del self.headers[name]
+        elif status == 416:
+            del self.headers['content-length']
+            self.headers['content-range'] = f'bytes */{size}'
+        elif status == 206 and len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers['content-range'] = f'bytes {start}-{end}/{size}'
+            self.headers['content-length'] = str(end - start + 1)
+            parts = [(b'', start, end)]
+        elif status == 206:
+            boundary = uuid.uuid4().hex
+            content_type = self.media_type or 'application/octet-stream'
+            length = 0
+            for start, end in ranges:
+                head = (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+                head = (b'\r\n' if parts else b'') + head
+                parts.append((head, start, end))
+                length += len(head) + end - start + 1
+            tail = f'\r\n--{boundary}--\r\n'.encode()
+            length += len(tail)
+            self.headers['content-type'] = f'multipart/byteranges; boundary={boundary}'
+            self.headers['content-length'] = str(length)
+            parts.append((tail, None, None))
+        else:
+            parts = [(b'', 0, size - 1)]
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': self.raw_headers})
+        if self.send_header_only or not parts or size == 0:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+
+        reader = _ChunkReader(self.path)
+        try:
+            await self._send_parts(send, parts, reader)
+        finally:
+            reader.close()
+
+    async def _send_parts(self, send, parts, file):
+        for index, (head, start, end) in enumerate(parts):
+            last_part = index == len(parts) - 1
+            if head:
+                await send({'type': 'http.response.body', 'body': head,
+                            'more_body': not (last_part and start is None)})
+            if start is None:
+                continue
+            offset = start
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(offset, min(self.chunk_size, remaining))
+                if not chunk:
+                    # File shrank underneath us; end the response early
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    return
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': remaining > 0 or not last_part})
+
+
+class _ChunkReader:
+    """pread() of a file in a worker thread; the file is opened by the first read"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def _read(self, offset, count):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        return os.pread(self.fd, count, offset)
+
+    async def read(self, offset, count):
+        return await anyio.to_thread.run_sync(self._read, offset, count)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def accel_redirect_response(path, root, prefix, filename, media_type):
+    """Hand the transfer to a fronting nginx via X-Accel-Redirect.
+
+    nginx then serves the file with sendfile(2), ranges and validators of
+    its own; `prefix` is the internal location that maps to `root`.
+    """
+    relative = os.path.relpath(path, root)
+    quoted = quote(filename)
+    disposition = (f"attachment; filename*=utf-8''{quoted}" if quoted != filename
+                   else f'attachment; filename="{filename}"')
+    return Response(headers={
+        'X-Accel-Redirect': prefix.rstrip('/') + '/' + quote(relative),
+        'Content-Type': media_type,
+        'Content-Disposition': disposition,
+    })
@@ -0,0 +1,220 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# States after which a task never changes again and may be expired
+FINISHED_STATES = ('SUCCESS', 'FAILURE', 'CANCELLED')
+
+
+class TaskStore:
+    """Interface for task records.
+
+    A record is a JSON-serializable dict that always carries a 'state'.
+    `put` replaces a record, `update` merges fields into it (a field set to
+    None is removed).
+    """
+
+    def get(self, task_id):
+        raise NotImplementedError
+
+    def put(self, task_id, record):
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        raise NotImplementedError
+
+    def list_ids(self, states):
+        """Ids of tasks in any of `states`, oldest first"""
+        raise NotImplementedError
+
+    def expire(self, ttl):
+        """Delete finished tasks not updated for `ttl` seconds; return how many"""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def start_sweeper(self, ttl, interval):
+        """Expire finished tasks in a background thread every `interval` seconds"""
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    removed = self.expire(ttl)
+                    if removed:
+                        print(f"[store] Expired {removed} finished tasks")
+                except Exception as e:
+                    print(f"[store] Sweep failed: {type(e).__name__}: {e}")
+
+        t = threading.Thread(target=sweep, name='task-store-sweeper', daemon=True)
+        t.start()
+        return t
+
+
+class MemoryTaskStore(TaskStore):
+    """Process-local store; contents are lost on restart"""
+
+    def __init__(self):
+        self._records = {}
+        self._meta = {}
+        self._lock = threading.Lock()
+
+    def get(self, task_id):
+        record = self._records.get(task_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def put(self, task_id, record):
+        now = time.time()
+        record = copy.deepcopy(record)
+        with self._lock:
+            created = self._meta.get(task_id, (now, now))[0]
+            self._records[task_id] = record
+            self._meta[task_id] = (created, now)
+
+    def update(self, task_id, **fields):
+        now = time.time()
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None:
+                return False
+            # Copy-on-write so concurrent readers never see a half-updated dict
+            record = dict(record)
+            for key, value in copy.deepcopy(fields).items():
+                if value is None:
+                    record.pop(key, None)
+                else:
+                    record[key] = value
+            self._records[task_id] = record
+            self._meta[task_id] = (self._meta[task_id][0], now)
+            return True
+
+    def delete(self, task_id):
+        with self._lock:
+            self._records.pop(task_id, None)
+            self._meta.pop(task_id, None)
+
+    def list_ids(self, states):
+        with self._lock:
+            ids = [tid for tid, rec in self._records.items() if rec.get('state') in states]
+            return sorted(ids, key=lambda tid: self._meta[tid][0])
+
+    def expire(self, ttl):
+        cutoff = time.time() - ttl
+        with self._lock:
+            stale = [tid for tid, rec in self._records.items()
+                     if rec.get('state') in FINISHED_STATES and self._meta[tid][1] < cutoff]
+            for tid in stale:
+                del self._records[tid]
+                del self._meta[tid]
+        return len(stale)
+
+    def count(self):
+        return len(self._records)
+
+
+class SQLiteTaskStore(TaskStore):
+    """Embedded SQLite store in WAL mode.
+
+    Every thread gets its own connection, so readers never wait on a Python
+    lock and WAL lets them proceed while a worker is writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, updated_at);
+            CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at);
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, task_id):
+        row = self._conn().execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, task_id, record):
+        now = time.time()
+        self._conn().execute(
+            'INSERT INTO tasks (id, state, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, data = excluded.data',
+            (task_id, record.get('state', 'PENDING'), now, now, json.dumps(record)),
+        )
+
+    def update(self, task_id, **fields):
+        # Top-level fields are replaced (like MemoryTaskStore, not merged as
+        # json_patch would) in a single statement, so concurrent updates to
+        # different fields of one task don't overwrite each other
+        data, params = 'data', []
+        sets = [(k, v) for k, v in fields.items() if v is not None]
+        removed = [k for k, v in fields.items() if v is None]
+        if sets:
+            data = f"json_set({data}, {', '.join(['?, json(?)'] * len(sets))})"
+            for key, value in sets:
+                params += [_path(key), json.dumps(value)]
+        if removed:
+            data = f"json_remove({data}, {', '.join(['?'] * len(removed))})"
+            params += [_path(key) for key in removed]
+        state = fields.get('state')
+        cur = self._conn().execute(
+            f"UPDATE tasks SET data = {data}, updated_at = ?, state = coalesce(?, state) WHERE id = ?",
+            params + [time.time(), state, task_id],
+        )
+        return cur.rowcount > 0
+
+    def delete(self, task_id):
+        self._conn().execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+    def list_ids(self, states):
+        marks = ','.join('?' * len(states))
+        rows = self._conn().execute(
+            f'SELECT id FROM tasks WHERE state IN ({marks}) ORDER BY created_at', tuple(states)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def expire(self, ttl):
+        marks = ','.join('?' * len(FINISHED_STATES))
+        cur = self._conn().execute(
+            f'DELETE FROM tasks WHERE state IN ({marks}) AND updated_at < ?',
+            FINISHED_STATES + (time.time() - ttl,),
+        )
+        return cur.rowcount
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+
+def _path(key):
+    """JSON path of a top-level field (keyword argument names need no escaping)"""
+    return f'$."{key}"'
+
+
+def open_store(kind, path=None):
+    """Create the task store selected by TASK_STORE ('sqlite' or 'memory')"""
+    if kind == 'memory':
+        return MemoryTaskStore()
+    if kind == 'sqlite':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteTaskStore(path)
+    raise ValueError(f'Unknown task store: {kind}')
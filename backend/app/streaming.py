@@ -0,0 +1,79 @@
+import asyncio
+
+# Only plain HTTP downloads grow the output file front to back; fragmented
+# protocols are remuxed afterwards and aria2c writes segments out of order.
+PROGRESSIVE_PROTOCOLS = ('http', 'https')
+
+
+class StreamTracker:
+    """Decides whether a download can be streamed while it is written.
+
+    `plan_pp()` returns a yt-dlp 'before_dl' postprocessor that inspects the
+    selected format; when the output is a single progressive file that no
+    postprocessor rewrites, the first progress event reports its temporary
+    path through `on_ready({'path': ..., 'size': ...})`. `rewrites_output`
+    is a bool or a callable taking the selected format's info dict.
+    """
+
+    def __init__(self, on_ready, rewrites_output=False):
+        self.on_ready = on_ready
+        self.rewrites_output = rewrites_output
+        self.streamable = False
+        self._published = False
+
+    def plan(self, info, params):
+        rewrites = self.rewrites_output(info) if callable(self.rewrites_output) else self.rewrites_output
+        self.streamable = (
+            not rewrites
+            and not info.get('requested_formats')
+            and info.get('protocol') in PROGRESSIVE_PROTOCOLS
+            and not params.get('external_downloader')
+        )
+        return self.streamable
+
+    def plan_pp(self):
+        from yt_dlp.postprocessor import PostProcessor
+
+        tracker = self
+
+        class StreamPlanPP(PostProcessor):
+            def run(self, info):
+                tracker.plan(info, self._downloader.params)
+                return [], info
+
+        return StreamPlanPP()
+
+    def progress_hook(self, d):
+        if not self.streamable or self._published or d.get('status') != 'downloading':
+            return
+        path = d.get('tmpfilename') or d.get('filename')
+        if path:
+            self._published = True
+            self.on_ready({'path': path, 'size': d.get('total_bytes')})
+
+
+async def follow_file(file, is_done, poll_interval=0.25, chunk_size=256 * 1024):
+    """Yield the contents of an open file that is still being written.
+
+    Reads to the current end, then waits for more data until `is_done()`
+    reports the writer has finished (True) or failed (False). Because the
+    file is already open, a rename from .part to the final name is harmless.
+    """
+    async with file:
+        while True:
+            chunk = await file.read(chunk_size)
+            if chunk:
+                yield chunk
+                continue
+            done = is_done()
+            if done is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            if done:
+                # Drain whatever was written after the last read
+                while True:
+                    chunk = await file.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            return
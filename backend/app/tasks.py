@@ -1,10 +1,14 @@
 import os
 import uuid
 from celery import Celery
-from yt_dlp import YoutubeDL
-import boto3
-from botocore.client import Config
-import botocore
+from celery.signals import worker_process_init
+import botocore.exceptions
+
+from app.output import OutputCollector, remove_workdir, task_workdir
+from app.postprocess import deferred_ydl, postprocess_stage
+from app.timeline import Timeline, span_exporter
+from app.upload import ParallelUploader, S3Target
+from app.clients import once, s3_client as shared_s3_client
 
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', './downloads')
@@ -15,28 +19,65 @@ S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY')
 S3_SECRET_KEY = os.getenv('S3_SECRET_KEY')
 S3_BUCKET = os.getenv('S3_BUCKET')
 S3_SECURE = os.getenv('S3_SECURE', 'false').lower() in ('1', 'true', 'yes')
+# Multipart upload tuning (part size in bytes, parts in flight)
+UPLOAD_PART_SIZE = int(os.getenv('UPLOAD_PART_SIZE', str(16 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '8'))
+# Stage timeline of each task, exported as OpenTelemetry spans with TRACING=otel
+TRACING = os.getenv('TRACING', '').lower()
+tracer = span_exporter(TRACING)
 
 celery_app = Celery('worker', broker=REDIS_URL, backend=REDIS_URL)
 
 
 def s3_client():
+    """The worker process's shared S3 client, or None when S3 isn't configured"""
     if not S3_ENDPOINT:
         return None
-    cfg = Config(signature_version='s3v4')
-    return boto3.client(
-        's3',
-        endpoint_url=S3_ENDPOINT,
-        aws_access_key_id=S3_ACCESS_KEY,
-        aws_secret_access_key=S3_SECRET_KEY,
-        config=cfg,
-        region_name=None,
-    )
+    return shared_s3_client(S3_ENDPOINT, S3_ACCESS_KEY, S3_SECRET_KEY, pool_size=UPLOAD_CONCURRENCY * 2)
+
+
+def ensure_bucket(client):
+    """Create S3_BUCKET if needed; checked once per worker process, not per task"""
+    def check():
+        try:
+            client.head_bucket(Bucket=S3_BUCKET)
+        except botocore.exceptions.ClientError:
+            client.create_bucket(Bucket=S3_BUCKET)
+    once('s3-bucket', check)
+
+
+@worker_process_init.connect
+def init_storage(**kwargs):
+    """Create the client and check the bucket when a worker process starts"""
+    client = s3_client()
+    if client and S3_BUCKET:
+        try:
+            ensure_bucket(client)
+        except Exception as e:
+            print(f"WARNING: S3 bucket {S3_BUCKET} check failed: {type(e).__name__}: {e}")
+
+
+def finish(task_id, timeline, result):
+    """Add the task's stage timeline to its result and export it to the tracer"""
+    result['timeline'] = timeline.as_list()
+    if tracer is not None:
+        try:
+            tracer.export(task_id, {'task.state': 'FAILURE' if 'error' in result else 'SUCCESS'}, result['timeline'])
+        except Exception as e:
+            print(f"[{task_id}] Trace export failed: {type(e).__name__}: {e}")
+    return result
 
 
 @celery_app.task(bind=True)
 def download_task(self, url, media_type, quality):
+    task_id = self.request.id or uuid.uuid4().hex
+    workdir = task_workdir(DOWNLOAD_DIR, task_id)
+    collector = OutputCollector()
+    timeline = Timeline()
     ydl_opts = {
-        'outtmpl': os.path.join(DOWNLOAD_DIR, '%(id)s.%(ext)s'),
+        'outtmpl': os.path.join(workdir, '%(id)s.%(ext)s'),
+        'post_hooks': [collector],
+        'postprocessor_hooks': [timeline.postprocessor_hook(postprocess_stage)],
         'noplaylist': True,
         'quiet': True,
         'no_warnings': True,
@@ -63,16 +104,32 @@ def download_task(self, url, media_type, quality):
             }
         ]
 
+    fetched = {'bytes': 0}
+    def meter(nbytes):
+        fetched['bytes'] += nbytes
+
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        # Postprocessing is deferred so each stage is timed on its own
+        ydl = deferred_ydl(ydl_opts, meter=meter)
+        try:
+            with timeline.stage('extract'):
+                info = ydl.extract_info(url, download=False, process=False)
+            with timeline.stage('fetch') as stage:
+                info = ydl.process_ie_result(info, download=True)
+                stage['bytes'] = fetched['bytes']
+            ydl.run_deferred()
+        except Exception as e:
+            # A failed postprocessor sends no 'finished' hook
+            timeline.close(e)
+            raise
+        finally:
+            ydl.close()
 
-        # return the newest file in DOWNLOAD_DIR
-        files = [os.path.join(DOWNLOAD_DIR, f) for f in os.listdir(DOWNLOAD_DIR)]
-        files = [f for f in files if os.path.isfile(f)]
-        if not files:
-            return {'error': 'no file produced'}
-        newest = max(files, key=os.path.getmtime)
+        # final artifact path as reported by yt-dlp
+        newest = collector.resolve(info)
+        if not newest:
+            remove_workdir(workdir)
+            return finish(task_id, timeline, {'error': 'no file produced'})
 
         result = {'file_path': newest, 'filename': os.path.basename(newest)}
 
@@ -80,22 +137,24 @@ def download_task(self, url, media_type, quality):
         client = s3_client()
         if client and S3_BUCKET:
             key = f"downloads/{uuid.uuid4().hex}_{os.path.basename(newest)}"
-            try:
-                # ensure bucket exists
+            with timeline.stage('upload', bytes=os.path.getsize(newest)):
                 try:
-                    client.head_bucket(Bucket=S3_BUCKET)
-                except botocore.exceptions.ClientError:
-                    client.create_bucket(Bucket=S3_BUCKET)
-
-                client.upload_file(newest, S3_BUCKET, key)
-                presigned = client.generate_presigned_url(
-                    'get_object', Params={'Bucket': S3_BUCKET, 'Key': key}, ExpiresIn=86400
-                )
-                result.update({'s3_key': key, 's3_url': presigned})
-            except Exception as e:
-                result.update({'s3_error': str(e)})
+                    ensure_bucket(client)
+                    uploader = ParallelUploader(S3Target(client, S3_BUCKET), UPLOAD_PART_SIZE, UPLOAD_CONCURRENCY)
+                    result['upload'] = uploader.upload(newest, key)
+                    presigned = client.generate_presigned_url(
+                        'get_object', Params={'Bucket': S3_BUCKET, 'Key': key}, ExpiresIn=86400
+                    )
+                    result.update({'s3_key': key, 's3_url': presigned})
+                    # The object store copy is what gets served; free the disk
+                    remove_workdir(workdir)
+                    del result['file_path']
+                except Exception as e:
+                    result.update({'s3_error': str(e)})
 
-        return result
+        return finish(task_id, timeline, result)
 
     except Exception as e:
-        return {'error': str(e)}
+        # Don't leave partial downloads behind
+        remove_workdir(workdir)
+        return finish(task_id, timeline, {'error': str(e)})
@@ -0,0 +1,172 @@
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages measuring child CPU time; RUSAGE_CHILDREN is per process, so a
+# stage that overlapped another measured one reports a shared figure
+_cpu_lock = threading.Lock()
+_cpu_active = 0
+_cpu_starts = 0
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Timeline:
+    """Stages of one task with timestamps, byte counts and subprocess time.
+
+    Each stage is a dict: name, start/end (epoch seconds), secs and any
+    extra fields (bytes, subprocess_cpu_secs, ...). `on_stage(stage)` is
+    called as each one ends, e.g. to persist the list or feed metrics.
+    """
+
+    def __init__(self, on_stage=None, stages=None):
+        # Stages of earlier attempts, e.g. before a restart
+        self.stages = list(stages or [])
+        self.on_stage = on_stage
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, **fields):
+        stage = {'name': name, 'start': round(start, 3), 'end': round(end, 3), 'secs': round(end - start, 3)}
+        stage.update((k, v) for k, v in fields.items() if v is not None)
+        with self._lock:
+            self.stages.append(stage)
+        if self.on_stage:
+            self.on_stage(stage)
+        return stage
+
+    @contextmanager
+    def stage(self, name, cpu=False, **fields):
+        """Record the enclosed block as a stage; the yielded dict takes extra fields.
+
+        With `cpu` the CPU time of child processes (ffmpeg, aria2c) that
+        exited during the block is recorded as subprocess_cpu_secs.
+        """
+        global _cpu_active, _cpu_starts
+        extra = dict(fields)
+        start = time.time()
+        if cpu:
+            with _cpu_lock:
+                shared = _cpu_active > 0
+                _cpu_active += 1
+                _cpu_starts += 1
+                starts = _cpu_starts
+                cpu_before = _children_cpu()
+        try:
+            yield extra
+        except BaseException as e:
+            extra.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            if cpu:
+                with _cpu_lock:
+                    _cpu_active -= 1
+                    extra['subprocess_cpu_secs'] = round(_children_cpu() - cpu_before, 3)
+                    if shared or _cpu_starts != starts:
+                        # Other jobs' subprocesses may be included
+                        extra['subprocess_cpu_shared'] = True
+            self.add(name, start, time.time(), **extra)
+
+    def start(self, name, key=None, cpu=False, **fields):
+        """Open a stage that ends with finish(key), e.g. in another thread"""
+        block = self.stage(name, cpu, **fields)
+        block.__enter__()
+        with self._lock:
+            self._open[key or name] = block
+
+    def finish(self, key):
+        with self._lock:
+            block = self._open.pop(key, None)
+        if block is not None:
+            block.__exit__(None, None, None)
+
+    def postprocessor_hook(self, stage_of):
+        """yt-dlp postprocessor hook recording postprocessors as stages.
+
+        `stage_of(postprocessor_name)` names the stage, or returns None to
+        leave a postprocessor out.
+        """
+        def hook(d):
+            name = d.get('postprocessor') or ''
+            stage = stage_of(name)
+            if stage is None:
+                return
+            if d.get('status') == 'started':
+                self.start(stage, key=('pp', name), cpu=True, postprocessor=name)
+            elif d.get('status') == 'finished':
+                self.finish(('pp', name))
+
+        return hook
+
+    def close(self, error=None):
+        """End the stages still open, e.g. a postprocessor that raised"""
+        with self._lock:
+            blocks, self._open = list(self._open.values()), {}
+        for block in blocks:
+            try:
+                if error is None:
+                    block.__exit__(None, None, None)
+                else:
+                    block.__exit__(type(error), error, error.__traceback__)
+            except BaseException:
+                pass
+
+    def as_list(self):
+        with self._lock:
+            return [dict(s) for s in self.stages]
+
+
+class SpanExporter:
+    """Receives each finished task as a root span with one child per stage"""
+
+    def export(self, task_id, attributes, stages):
+        raise NotImplementedError
+
+
+class OpenTelemetryExporter(SpanExporter):
+    """Spans through the OpenTelemetry API.
+
+    Uses the globally configured tracer provider (opentelemetry-sdk and an
+    exporter, set up e.g. by opentelemetry-instrument and OTEL_* variables);
+    without one the API's default is a no-op.
+    """
+
+    def __init__(self, name='downloader'):
+        from opentelemetry import trace
+        self.trace = trace
+        self.tracer = trace.get_tracer(name)
+
+    def export(self, task_id, attributes, stages):
+        if not stages:
+            return
+        ns = lambda t: int(t * 1e9)
+        root = self.tracer.start_span('download', start_time=ns(min(s['start'] for s in stages)),
+                                      attributes=_span_attributes(dict(attributes, **{'task.id': task_id})))
+        context = self.trace.set_span_in_context(root)
+        for stage in stages:
+            fields = {k: v for k, v in stage.items() if k not in ('name', 'start', 'end')}
+            span = self.tracer.start_span(stage['name'], context=context, start_time=ns(stage['start']),
+                                          attributes=_span_attributes(fields))
+            span.end(end_time=ns(stage['end']))
+        root.end(end_time=ns(max(s['end'] for s in stages)))
+
+
+def _span_attributes(fields):
+    return {k: v for k, v in fields.items() if isinstance(v, (str, bool, int, float))}
+
+
+def span_exporter(kind):
+    """Exporter for TRACING: '' (off), 'otel'; None when off or unavailable"""
+    if not kind:
+        return None
+    if kind == 'otel':
+        try:
+            return OpenTelemetryExporter()
+        except ImportError:
+            print("WARNING: TRACING=otel but opentelemetry-api is not installed; tracing is off")
+            return None
+    raise ValueError(f'Unknown TRACING exporter: {kind}')
@@ -0,0 +1,217 @@
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+# S3 rejects multipart parts below 5 MiB (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+# Most source objects GCS accepts in a single compose request
+GCS_MAX_COMPOSE = 32
+
+
+class UploadSourceFailed(Exception):
+    """The file being uploaded while it was written was never completed"""
+
+
+class S3Target:
+    """Multipart uploads through a boto3 S3 client"""
+
+    min_part_size = S3_MIN_PART_SIZE
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def begin(self, key):
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+    def put_part(self, key, upload_id, number, data):
+        resp = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data)
+        return {'PartNumber': number, 'ETag': resp['ETag']}
+
+    def complete(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])})
+
+    def abort(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+
+class GCSTarget:
+    """Parallel composite uploads into a google-cloud-storage bucket.
+
+    Parts are uploaded as temporary objects and composed into the final
+    object (GCS_MAX_COMPOSE sources per request, in rounds for more), then
+    deleted.
+    """
+
+    min_part_size = 0
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def put(self, key, data):
+        self.bucket.blob(key).upload_from_string(data)
+
+    def begin(self, key):
+        return f'{key}.parts-{uuid.uuid4().hex}/'
+
+    def put_part(self, key, upload_id, number, data):
+        name = f'{upload_id}{number:05d}'
+        self.bucket.blob(name).upload_from_string(data)
+        return {'PartNumber': number, 'name': name}
+
+    def complete(self, key, upload_id, parts):
+        names = [p['name'] for p in sorted(parts, key=lambda p: p['PartNumber'])]
+        temporary = list(names)
+        level = 0
+        while len(names) > GCS_MAX_COMPOSE:
+            composed = []
+            for i in range(0, len(names), GCS_MAX_COMPOSE):
+                name = f'{upload_id}c{level}-{i // GCS_MAX_COMPOSE:05d}'
+                self._compose(name, names[i:i + GCS_MAX_COMPOSE])
+                composed.append(name)
+            temporary.extend(composed)
+            names = composed
+            level += 1
+        self._compose(key, names)
+        self._delete(temporary)
+
+    def abort(self, key, upload_id):
+        self._delete([blob.name for blob in self.bucket.list_blobs(prefix=upload_id)])
+
+    def _compose(self, name, sources):
+        self.bucket.blob(name).compose([self.bucket.blob(s) for s in sources])
+
+    def _delete(self, names):
+        for name in names:
+            try:
+                self.bucket.blob(name).delete()
+            except Exception:
+                pass
+
+
+class ParallelUploader:
+    """Uploads a file as parts sent `concurrency` at a time.
+
+    Files up to one part are sent with a single request. With `is_done`
+    the file may still be growing: parts are sent as soon as they are
+    complete on disk, and `is_done()` returns None while the writer is
+    running, True when it finished and False when it failed.
+    """
+
+    def __init__(self, target, part_size=DEFAULT_PART_SIZE, concurrency=4, poll_interval=0.25):
+        self.target = target
+        self.part_size = max(part_size, target.min_part_size)
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+
+    def upload(self, path, key, is_done=None):
+        """Upload `path` to `key` and return {'bytes', 'parts', 'seconds'}"""
+        with open(path, 'rb') as f:
+            return self.upload_fileobj(f, key, is_done)
+
+    def upload_fileobj(self, f, key, is_done=None):
+        started = time.monotonic()
+        data = self._read_part(f, is_done)
+        if len(data) < self.part_size:
+            self.target.put(key, data)
+            return {'bytes': len(data), 'parts': 1, 'seconds': round(time.monotonic() - started, 3)}
+
+        upload_id = self.target.begin(key)
+        try:
+            total, parts = self._send_parts(f, key, upload_id, data, is_done)
+            self.target.complete(key, upload_id, parts)
+        except BaseException:
+            self.target.abort(key, upload_id)
+            raise
+        return {'bytes': total, 'parts': len(parts), 'seconds': round(time.monotonic() - started, 3)}
+
+    def _send_parts(self, f, key, upload_id, data, is_done):
+        parts = []
+        total = 0
+        number = 1
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='upload') as pool:
+            pending = set()
+            try:
+                while data:
+                    # At most `concurrency` parts are held in memory
+                    while len(pending) >= self.concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        parts.extend(fut.result() for fut in done)
+                    pending.add(pool.submit(self.target.put_part, key, upload_id, number, data))
+                    total += len(data)
+                    number += 1
+                    data = self._read_part(f, is_done)
+                parts.extend(fut.result() for fut in pending)
+            except BaseException:
+                for fut in pending:
+                    fut.cancel()
+                raise
+        return total, parts
+
+    def _read_part(self, f, is_done):
+        """Read the next full part, waiting for a growing file to provide it"""
+        buf = bytearray()
+        while len(buf) < self.part_size:
+            chunk = f.read(self.part_size - len(buf))
+            if chunk:
+                buf += chunk
+                continue
+            if is_done is None:
+                break
+            done = is_done()
+            if done is None:
+                time.sleep(self.poll_interval)
+                continue
+            if not done:
+                raise UploadSourceFailed('Source file was not completed')
+            # Finished: pick up anything written since the last read
+            chunk = f.read(self.part_size - len(buf))
+            if not chunk:
+                break
+            buf += chunk
+        return bytes(buf)
+
+
+class PipelinedUpload:
+    """Uploads a file in the background while it is still being written.
+
+    The file is opened right away, so the writer may rename it (e.g. from
+    .part to its final name) afterwards. `finish(ok)` tells the upload
+    whether the writer completed; `result()` then waits for it and returns
+    the upload stats, re-raising its error.
+    """
+
+    def __init__(self, uploader, path, key):
+        self.path = path
+        self.key = key
+        self._file = open(path, 'rb')
+        self._outcome = None
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, args=(uploader,), name='pipelined-upload', daemon=True)
+        self._thread.start()
+
+    def finish(self, ok):
+        self._outcome = bool(ok)
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _run(self, uploader):
+        try:
+            with self._file:
+                self._result = uploader.upload_fileobj(self._file, self.key, is_done=lambda: self._outcome)
+        except Exception as e:
+            self._error = e
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Load test of the API control plane: POST /download, GET /status/{id} and
+GET /file/{id}.
+
+Runs the real app (app.main under uvicorn, in a subprocess) with its
+download worker replaced by a zero-cost fake: it marks the task
+DOWNLOADING, writes --progress-updates progress snapshots to the task
+store as a real job's reporter does, hard-links a small finished file
+into the task's directory and completes the task. What is measured is
+the API layer, the task store and file serving, not yt-dlp.
+
+For each endpoint and --concurrency level, that many keep-alive clients
+send requests back to back for --duration seconds (after --warmup), and
+requests/s, errors, p50/p95/p99/max latency and server CPU time per
+request are reported. While /status and /file are measured, a background
+client submits --background-rate downloads per second, so the workers
+keep writing task state while the reads run.
+
+The load generator runs in this process on asyncio with raw HTTP/1.1, to
+stay cheap next to the server; with few CPUs they still compete, so only
+compare results from the same machine and settings.
+
+--json saves the report. benchmark_api_baseline.json is such a report,
+recorded with the defaults; with --baseline the run is compared to one
+(requests/s and p99 per endpoint and concurrency), and the exit status is
+1 if anything got worse than --tolerance.
+
+Usage: python benchmark_api.py [--endpoints status,file,submit] [--concurrency 1,16,128,1024]
+                               [--duration 5] [--warmup 1] [--tasks 2000] [--file-kb 64]
+                               [--progress-updates 20] [--background-rate 50] [--store sqlite]
+                               [--json out.json] [--baseline benchmark_api_baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+BACKEND = os.path.join(ROOT, 'backend')
+sys.path.insert(0, BACKEND)
+
+from benchmark_serve import cpu_seconds, free_port  # noqa: E402
+
+SUBMIT_BODY = '{"url": "https://media.example/watch?v=%d", "media_type": "audio", "quality": "good"}'
+
+
+# -- Server side --------------------------------------------------------------
+
+def serve(port):
+    """Run app.main with the fake downloader; configured by the environment"""
+    import uvicorn
+    from app import main
+    from app.output import task_workdir
+
+    payload = os.environ['BENCH_PAYLOAD']
+    size = os.path.getsize(payload)
+    updates = int(os.environ['BENCH_PROGRESS_UPDATES'])
+
+    def fake_worker(task_id, url, media_type, quality, priority='interactive'):
+        """Stands in for download_worker: the same task-state writes, no fetching"""
+        main.store.update(task_id, state='DOWNLOADING')
+        for i in range(updates):
+            main.store.update(task_id, progress={
+                'stage': 'downloading', 'downloaded_bytes': size * (i + 1) // updates, 'total_bytes': size})
+        path = os.path.join(task_workdir(main.DOWNLOAD_DIR, task_id), 'bench.mp3')
+        os.link(payload, path)
+        main.complete_task(task_id, {'state': 'SUCCESS', 'result': {
+            'file_path': path, 'filename': 'bench.mp3', 'size': size, 'quality': quality, 'type': media_type}})
+
+    main.download_worker = fake_worker
+    uvicorn.run(main.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+def start_server(args, workdir):
+    payload = os.path.join(workdir, 'payload.mp3')
+    with open(payload, 'wb') as f:
+        f.write(os.urandom(args.file_kb * 1024))
+    download_dir = os.path.join(workdir, 'downloads')
+    os.makedirs(download_dir)
+    port = free_port()
+    env = dict(os.environ, DOWNLOAD_DIR=download_dir, TASK_STORE=args.store, BENCH_PAYLOAD=payload,
+               BENCH_PROGRESS_UPDATES=str(args.progress_updates),
+               # One client address for everything: don't let fair queuing push back
+               MAX_QUEUE='1000000', CLIENT_MAX_QUEUED='1000000', TASK_TTL='86400')
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)], cwd=BACKEND, env=env,
+                            stdout=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            status, _ = asyncio.run(one_request(port, 'GET', '/api/formats'))
+            if status == 200:
+                return proc, port
+        except OSError:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+# -- Load generator -----------------------------------------------------------
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        head = f'{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(body)}\r\n'
+        if body:
+            head += 'Content-Type: application/json\r\n'
+        self.writer.write(head.encode() + b'\r\n' + body)
+        try:
+            response = await self.reader.readuntil(b'\r\n\r\n')
+            status = int(response[9:12])
+            headers = {}
+            for line in response.decode('latin-1').split('\r\n')[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if 'content-length' in headers:
+                data = await self.reader.readexactly(int(headers['content-length']))
+            elif headers.get('transfer-encoding') == 'chunked':
+                data = b''
+                while True:
+                    size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                    data += (await self.reader.readexactly(size + 2))[:-2]
+                    if not size:
+                        break
+            else:
+                data = await self.reader.read()
+            if headers.get('connection') == 'close':
+                self.close()
+            return status, data
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def one_request(port, method, path, body=b''):
+    conn = Connection(port)
+    try:
+        return await conn.request(method, path, body)
+    finally:
+        conn.close()
+
+
+class Workload:
+    """Requests for one endpoint; task ids come from the setup phase"""
+
+    def __init__(self, endpoint, task_ids, counter):
+        self.endpoint = endpoint
+        self.task_ids = task_ids
+        self.counter = counter
+
+    def next(self):
+        if self.endpoint == 'submit':
+            self.counter[0] += 1
+            return 'POST', '/download', (SUBMIT_BODY % self.counter[0]).encode()
+        return 'GET', f'/{self.endpoint}/{random.choice(self.task_ids)}', b''
+
+
+async def submit_many(port, count, counter, connections=32):
+    """Submit `count` downloads; returns their task ids"""
+    ids = []
+
+    async def worker(n):
+        conn = Connection(port)
+        try:
+            for _ in range(n):
+                counter[0] += 1
+                status, data = await conn.request('POST', '/download', (SUBMIT_BODY % counter[0]).encode())
+                if status == 200:
+                    ids.append(json.loads(data)['task_id'])
+        finally:
+            conn.close()
+
+    await asyncio.gather(*(worker(count // connections + (i < count % connections)) for i in range(connections)))
+    return ids
+
+
+async def wait_finished(port, task_ids):
+    """Until every task is SUCCESS, so /file has something to send"""
+    conn = Connection(port)
+    try:
+        for task_id in task_ids:
+            while True:
+                status, data = await conn.request('GET', f'/status/{task_id}')
+                if status == 200 and json.loads(data)['state'] == 'SUCCESS':
+                    break
+                await asyncio.sleep(0.05)
+    finally:
+        conn.close()
+
+
+async def background_submits(port, rate, counter, stop):
+    """Keep the workers writing task state at `rate` submissions/s"""
+    if not rate:
+        return
+    conn = Connection(port)
+    try:
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            counter[0] += 1
+            await conn.request('POST', '/download', (SUBMIT_BODY % counter[0]).encode())
+            next_at += 1 / rate
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+async def measure(port, server_pid, workload, concurrency, args, counter):
+    latencies = []
+    errors = [0]
+    statuses = {}
+    recording = [False]
+    stop = asyncio.Event()
+
+    async def client():
+        conn = Connection(port)
+        try:
+            while not stop.is_set():
+                method, path, body = workload.next()
+                started = time.perf_counter()
+                try:
+                    status, _ = await conn.request(method, path, body)
+                except (OSError, asyncio.IncompleteReadError):
+                    status = 0
+                if recording[0]:
+                    latencies.append(time.perf_counter() - started)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if not 200 <= status < 300:
+                        errors[0] += 1
+        finally:
+            conn.close()
+
+    background = asyncio.ensure_future(
+        background_submits(port, args.background_rate if workload.endpoint != 'submit' else 0, counter, stop))
+    clients = [asyncio.ensure_future(client()) for _ in range(concurrency)]
+    await asyncio.sleep(args.warmup)
+    recording[0] = True
+    cpu_before = cpu_seconds(server_pid)
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    recording[0] = False
+    secs = time.perf_counter() - started
+    cpu = cpu_seconds(server_pid) - cpu_before
+    stop.set()
+    await asyncio.gather(background, *clients, return_exceptions=True)
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'endpoint': workload.endpoint,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': errors[0],
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rps': round(count / secs, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'server_cpu_ms_per_request': round(cpu * 1000 / count, 3) if count else None,
+    }
+
+
+async def run(args, port, server_pid):
+    counter = [0]
+    print(f'Submitting {args.tasks} tasks...')
+    task_ids = await submit_many(port, args.tasks, counter)
+    await wait_finished(port, task_ids)
+    results = []
+    for endpoint in args.endpoints.split(','):
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            row = await measure(port, server_pid, Workload(endpoint, task_ids, counter), concurrency, args, counter)
+            results.append(row)
+            print_row(row)
+    return results
+
+
+def print_row(r):
+    print(f"{r['endpoint']:6s} x{r['concurrency']:>5} {r['rps']:9.1f} req/s  p50 {r['p50_ms']:8.2f}  "
+          f"p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f}  max {r['max_ms']:8.2f} ms  "
+          f"{r['errors']:>5} errors  cpu {r['server_cpu_ms_per_request']} ms/req")
+
+
+def environment():
+    import fastapi
+    import starlette
+    import uvicorn
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'fastapi': fastapi.__version__,
+        'starlette': starlette.__version__,
+        'uvicorn': uvicorn.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each cell against the baseline; return the regressions"""
+    before = {(r['endpoint'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'':13s} {'req/s before':>12s} {'after':>9s} {'change':>7s}   {'p99 before':>10s} {'after':>9s} {'change':>7s}")
+    for r in results:
+        old = before.get((r['endpoint'], r['concurrency']))
+        if old is None:
+            continue
+        rps = (r['rps'] - old['rps']) / old['rps'] if old['rps'] else 0.0
+        p99 = (r['p99_ms'] - old['p99_ms']) / old['p99_ms'] if old['p99_ms'] else 0.0
+        print(f"{r['endpoint']:6s} x{r['concurrency']:>5} {old['rps']:12.1f} {r['rps']:9.1f} {rps:+7.0%}   "
+              f"{old['p99_ms']:10.2f} {r['p99_ms']:9.2f} {p99:+7.0%}")
+        if rps < -tolerance or p99 > tolerance or r['errors'] > old['errors']:
+            regressions.append(f"{r['endpoint']} x{r['concurrency']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default='status,file,submit')
+    parser.add_argument('--concurrency', default='1,16,128,1024', help='clients (connections) per run')
+    parser.add_argument('--duration', type=float, default=5, help='seconds measured per run')
+    parser.add_argument('--warmup', type=float, default=1, help='seconds before measuring')
+    parser.add_argument('--tasks', type=int, default=2000, help='finished tasks that /status and /file pick from')
+    parser.add_argument('--file-kb', type=int, default=64, help='size of the file /file sends')
+    parser.add_argument('--progress-updates', type=int, default=20, help='progress writes per fake download')
+    parser.add_argument('--background-rate', type=float, default=50, help='submissions/s during status and file runs')
+    parser.add_argument('--store', default='sqlite', help='TASK_STORE of the server')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='earlier --json output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed drop in req/s or rise in p99')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve)
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, port = start_server(args, workdir)
+        try:
+            results = asyncio.run(run(args, port, proc.pid))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    report = {
+        'config': {k: getattr(args, k) for k in ('duration', 'warmup', 'tasks', 'file_kb', 'progress_updates',
+                                                 'background_rate', 'store')},
+        'environment': environment(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print('WARNING: baseline was run with different settings')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"REGRESSION in {', '.join(regressions)}")
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Offline, repeatable download benchmark against standin_server.py.
+
+Starts the stand-in with per-request latency, bandwidth caps and injected
+errors (503s and connections cut off mid-body, decided by --seed so every
+run sees the same failures), then downloads its ffmpeg-encoded test
+pattern once per scenario of the matrix:
+  - protocol: progressive MP4 (from a page with a <video> tag), HLS with
+    TS segments, HLS with fragmented MP4 segments (hls-fmp4), DASH
+  - media: audio (bestaudio, one MP3 encode as the backend does) or video
+    (the backend's 720p format string; DASH is merged by ffmpeg)
+  - fragment concurrency: concurrent_fragment_downloads (HLS/DASH only)
+  - aria2c: external downloader on/off (skipped when aria2c isn't installed)
+  - retries: retries and fragment_retries
+Downloads go through app.postprocess.deferred_ydl like the backend's, and
+each stage is timed with app.timeline, so fetch and postprocessing are
+reported apart along with bytes read, ffmpeg CPU time, requests and the
+errors injected. Scenarios run --repeat times; the median is reported.
+
+Results are written as JSON with --json. With --baseline, scenarios that
+got slower by more than --tolerance, or stopped completing, are listed
+and the exit status is 1, so it can gate changes.
+
+Usage: python benchmark_download.py [--protocols progressive,hls,hls-fmp4,dash] [--media audio,video]
+                                    [--concurrency 1,8] [--aria2c off,on] [--retries 0,5]
+                                    [--segments 20] [--segment-secs 2] [--kbps 800] [--latency-ms 20]
+                                    [--conn-mbps 4] [--host-mbps 0] [--fail-rate 0.02] [--reset-rate 0.02]
+                                    [--seed 1] [--repeat 3] [--json out.json] [--baseline old.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+from app.output import OutputCollector  # noqa: E402
+from app.postprocess import AUDIO_BITRATES, deferred_ydl, make_audio_pp, postprocess_stage  # noqa: E402
+from app.timeline import Timeline  # noqa: E402
+from benchmark_upload import free_port  # noqa: E402
+
+MB = 1024 * 1024
+ENTRY = {'progressive': 'watch.html', 'hls': 'hls/index.m3u8', 'hls-fmp4': 'hls-fmp4/index.m3u8',
+         'dash': 'dash/manifest.mpd'}
+# What the backend asks for at 720p / 'good'
+VIDEO_FORMAT = 'bestvideo[height<=720]+bestaudio/best[height<=720]'
+AUDIO_QUALITY = 'good'
+SCENARIO_KEYS = ('protocol', 'media', 'concurrency', 'aria2c', 'retries')
+
+
+def start_standin(args, media_dir):
+    port = free_port()
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'standin_server.py'), '--port', str(port),
+        '--latency-ms', str(args.latency_ms), '--conn-mbps', str(args.conn_mbps), '--host-mbps', str(args.host_mbps),
+        '--fail-rate', str(args.fail_rate), '--reset-rate', str(args.reset_rate), '--seed', str(args.seed),
+        '--media-dir', media_dir],
+        stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            standin(url, 'stats')
+            return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('stand-in did not start')
+
+
+def standin(url, action):
+    method = 'POST' if action == 'reset' else 'GET'
+    with urllib.request.urlopen(urllib.request.Request(f'{url}/_standin/{action}', method=method), timeout=2) as r:
+        body = r.read()
+    return json.loads(body) if body else None
+
+
+def scenarios(args):
+    """The option matrix; settings that don't apply to a protocol are collapsed"""
+    seen = set()
+    for protocol, media, concurrency, aria2c, retries in itertools.product(
+            args.protocols.split(','), args.media.split(','), [int(c) for c in args.concurrency.split(',')],
+            [a == 'on' for a in args.aria2c.split(',')], [int(r) for r in args.retries.split(',')]):
+        if protocol == 'progressive' or aria2c:
+            # A single file, or aria2c's own connections: fragment threads don't matter
+            concurrency = 1
+        scenario = {'protocol': protocol, 'media': media, 'concurrency': concurrency, 'aria2c': aria2c,
+                    'retries': retries}
+        key = tuple(scenario.values())
+        if key not in seen:
+            seen.add(key)
+            yield scenario
+
+
+class Log:
+    """yt-dlp logger counting fragments given up on"""
+
+    def __init__(self):
+        self.skipped = 0
+
+    def debug(self, msg):
+        # Reported through to_screen, which a logger receives as debug
+        if 'Skipping fragment' in msg:
+            self.skipped += 1
+
+    info = warning = debug
+
+    def error(self, msg):
+        pass
+
+
+def download(scenario, url, spec, workdir):
+    """One download of a scenario; returns its measurements"""
+    log = Log()
+    collector = OutputCollector()
+    timeline = Timeline()
+    fetched = {'bytes': 0}
+    def meter(nbytes):
+        fetched['bytes'] += nbytes
+    audio_report = {}
+    opts = {
+        'logger': log,
+        'quiet': True, 'no_warnings': False, 'noprogress': True,
+        'outtmpl': os.path.join(workdir, '%(id)s.%(ext)s'),
+        'post_hooks': [collector],
+        'postprocessor_hooks': [timeline.postprocessor_hook(postprocess_stage)],
+        'socket_timeout': 10,
+        'retries': scenario['retries'],
+        'fragment_retries': scenario['retries'],
+        'skip_unavailable_fragments': True,
+        'concurrent_fragment_downloads': scenario['concurrency'],
+    }
+    if scenario['media'] == 'video':
+        opts.update({'format': VIDEO_FORMAT, 'merge_output_format': 'mp4'})
+    else:
+        opts['format'] = 'bestaudio/best'
+    if scenario['aria2c']:
+        opts['external_downloader'] = 'aria2c'
+        opts['external_downloader_args'] = ['-x', '16', '-s', '16', '-k', '1M']
+
+    before = standin(url, 'stats')
+    started = time.perf_counter()
+    error = None
+    ydl = deferred_ydl(opts, meter=meter)
+    try:
+        if scenario['media'] == 'audio':
+            ydl.add_post_processor(make_audio_pp(AUDIO_BITRATES[AUDIO_QUALITY], audio_report), when='post_process')
+        with timeline.stage('extract'):
+            info = ydl.extract_info(f"{url}/media/encoded/{spec}/{ENTRY[scenario['protocol']]}",
+                                    download=False, process=False)
+        with timeline.stage('fetch', cpu=scenario['aria2c']) as stage:
+            info = ydl.process_ie_result(info, download=True)
+            stage['bytes'] = fetched['bytes']
+        ydl.run_deferred()
+    except Exception as e:
+        timeline.close(e)
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        ydl.close()
+    secs = time.perf_counter() - started
+    after = standin(url, 'stats')
+
+    output = None if error else collector.resolve(info)
+    stages = {}
+    cpu = 0.0
+    for s in timeline.as_list():
+        stages[s['name']] = stages.get(s['name'], 0.0) + s['secs']
+        cpu += s.get('subprocess_cpu_secs', 0.0)
+    fetch_secs = stages.get('fetch', 0.0)
+    return {
+        'ok': bool(output) and os.path.exists(output),
+        'error': error or (None if output else 'no output file'),
+        'secs': secs,
+        'extract_secs': stages.get('extract', 0.0),
+        'fetch_secs': fetch_secs,
+        'postprocess_secs': sum(v for k, v in stages.items() if k not in ('extract', 'fetch')),
+        'subprocess_cpu_secs': cpu,
+        'bytes': fetched['bytes'],
+        'mb_per_sec': fetched['bytes'] / MB / fetch_secs if fetch_secs else 0.0,
+        'output_bytes': os.path.getsize(output) if output and os.path.exists(output) else 0,
+        'fragments_skipped': log.skipped,
+        'requests': after['media_requests'] - before['media_requests'],
+        'injected_503': after['failed'] - before['failed'],
+        'injected_resets': after['resets'] - before['resets'],
+        'audio_plan': audio_report.get('plan'),
+    }
+
+
+def run(scenario, url, args, workdir):
+    """Run a scenario --repeat times; medians plus the raw wall times"""
+    if scenario['aria2c'] and not shutil.which('aria2c'):
+        return dict(scenario, skipped='aria2c not installed')
+    samples = []
+    for _ in range(args.repeat):
+        # Same injected errors for every repetition
+        standin(url, 'reset')
+        target = tempfile.mkdtemp(dir=workdir)
+        try:
+            samples.append(download(scenario, url, args.spec, target))
+        finally:
+            shutil.rmtree(target, ignore_errors=True)
+    row = dict(scenario)
+    for field in ('secs', 'extract_secs', 'fetch_secs', 'postprocess_secs', 'subprocess_cpu_secs', 'mb_per_sec'):
+        row[field] = round(statistics.median(s[field] for s in samples), 3)
+    for field in ('bytes', 'output_bytes', 'requests', 'injected_503', 'injected_resets', 'fragments_skipped'):
+        row[field] = statistics.median_low(s[field] for s in samples)
+    row['ok'] = all(s['ok'] for s in samples)
+    row['failures'] = sum(not s['ok'] for s in samples)
+    errors = [s['error'] for s in samples if s['error']]
+    if errors:
+        row['error'] = errors[0]
+    if samples[0]['audio_plan']:
+        row['audio_plan'] = samples[0]['audio_plan']
+    row['secs_samples'] = [round(s['secs'], 3) for s in samples]
+    return row
+
+
+def label(r):
+    return (f"{r['protocol']:11s} {r['media']:5s} conc {r['concurrency']:>2} "
+            f"aria2c {'on ' if r['aria2c'] else 'off'} retries {r['retries']:>2}")
+
+
+def print_row(r):
+    if 'skipped' in r:
+        print(f"{label(r)}  skipped: {r['skipped']}")
+        return
+    status = 'ok' if r['ok'] else f"FAILED {r['failures']}/{len(r['secs_samples'])}"
+    print(f"{label(r)} {r['secs']:7.2f}s (fetch {r['fetch_secs']:6.2f}s {r['mb_per_sec']:6.2f} MB/s, "
+          f"postprocess {r['postprocess_secs']:5.2f}s) {r['requests']:>4} req "
+          f"{r['injected_503'] + r['injected_resets']:>3} errors {r['fragments_skipped']:>2} skipped  {status}")
+
+
+def environment():
+    import yt_dlp
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'ffmpeg': ffmpeg,
+        'aria2c': bool(shutil.which('aria2c')),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Scenarios that regressed against a baseline report"""
+    before = {tuple(r[k] for k in SCENARIO_KEYS): r for r in baseline['results'] if 'skipped' not in r}
+    regressions = []
+    for r in results:
+        old = before.get(tuple(r[k] for k in SCENARIO_KEYS))
+        if old is None or 'skipped' in r:
+            continue
+        if old['ok'] and not r['ok']:
+            regressions.append(f"{label(r)}: no longer completes ({r.get('error')})")
+        elif r['ok'] and r['secs'] > old['secs'] * (1 + tolerance):
+            regressions.append(f"{label(r)}: {old['secs']:.2f}s -> {r['secs']:.2f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--protocols', default='progressive,hls,hls-fmp4,dash')
+    parser.add_argument('--media', default='audio,video')
+    parser.add_argument('--concurrency', default='1,8', help='fragment threads per download')
+    parser.add_argument('--aria2c', default='off,on')
+    parser.add_argument('--retries', default='0,5')
+    parser.add_argument('--segments', type=int, default=20)
+    parser.add_argument('--segment-secs', type=int, default=2)
+    parser.add_argument('--kbps', type=int, default=800, help='video bitrate of the test pattern')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--conn-mbps', type=float, default=4, help='stand-in cap per connection')
+    parser.add_argument('--host-mbps', type=float, default=0, help='stand-in cap for all connections')
+    parser.add_argument('--fail-rate', type=float, default=0.02, help='segment/file requests answered with 503')
+    parser.add_argument('--reset-rate', type=float, default=0.02, help='responses cut off halfway')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='earlier --json output to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against --baseline')
+    args = parser.parse_args()
+    args.spec = f'{args.segments}x{args.segment_secs}x{args.kbps}'
+
+    if not shutil.which('ffmpeg'):
+        sys.exit('ffmpeg is needed to encode the test media')
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, url = start_standin(args, os.path.join(workdir, 'media'))
+        try:
+            # Encode the media before anything is timed
+            for entry in ENTRY.values():
+                urllib.request.urlopen(f'{url}/media/encoded/{args.spec}/{entry}', timeout=300).read()
+            for scenario in scenarios(args):
+                results.append(run(scenario, url, args, workdir))
+                print_row(results[-1])
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    report = {
+        'config': {k: getattr(args, k) for k in ('segments', 'segment_secs', 'kbps', 'latency_ms', 'conn_mbps',
+                                                 'host_mbps', 'fail_rate', 'reset_rate', 'seed', 'repeat')},
+        'environment': environment(),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print('WARNING: baseline was run with different settings')
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark fragment concurrency offline against standin_server.py.
+
+Starts the stand-in with per-request latency, a per-connection and a host
+bandwidth cap, and CDN-style throttling (429 + Retry-After above
+--max-conns concurrent connections, and at --error-rate; 429s repeat
+until Retry-After has passed unless --no-penalty), then runs
+--jobs parallel yt-dlp downloads of the same synthetic HLS stream:
+  - fixed: concurrent_fragment_downloads=16 per download, no coordination
+    (the previous behaviour)
+  - adaptive: the per-host AIMD budget from app.hosts shared by all jobs,
+    with a ceiling of 32 fragment threads per download
+Reports wall time, aggregate throughput, 429s the server sent, and
+fragments lost (skipped after exhausting retries).
+
+Usage: python benchmark_fragments.py [--jobs 4,8] [--segments 60] [--segment-kb 256] [--latency-ms 30]
+                                     [--conn-mbps 2] [--host-mbps 40] [--max-conns 24] [--error-rate 0]
+                                     [--modes fixed,adaptive] [--no-penalty] [--json out.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+from app.hosts import HostBudget  # noqa: E402
+from app.postprocess import deferred_ydl  # noqa: E402
+from benchmark_upload import free_port  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def start_standin(args):
+    port = free_port()
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'standin_server.py'), '--port', str(port),
+        '--latency-ms', str(args.latency_ms), '--conn-mbps', str(args.conn_mbps),
+        '--host-mbps', str(args.host_mbps), '--max-conns', str(args.max_conns),
+        '--error-rate', str(args.error_rate), '--retry-after', str(args.retry_after), '--seed', '1']
+        + ([] if args.no_penalty else ['--penalty']),
+        stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            standin_stats(url)
+            return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('stand-in did not start')
+
+
+def standin_stats(url):
+    with urllib.request.urlopen(f'{url}/_standin/stats', timeout=2) as r:
+        return json.load(r)
+
+
+def run(mode, jobs, url, args, workdir):
+    hosts = HostBudget(args.host_connections, 1, args.host_max_connections, args.window) if mode == 'adaptive' else None
+    before = standin_stats(url)
+    errors = []
+
+    def job(i):
+        opts = {
+            'quiet': True, 'no_warnings': True, 'noprogress': True,
+            'outtmpl': os.path.join(workdir, f'{mode}-{jobs}-{i}.%(ext)s'),
+            'fixup': 'never',
+            'concurrent_fragment_downloads': 32 if hosts else 16,
+            'fragment_retries': 8,
+            'skip_unavailable_fragments': True,
+        }
+        try:
+            with deferred_ydl(opts, hosts) as ydl:
+                # A distinct query per job, like separate videos on one CDN
+                ydl.download([f'{url}/media/hls/{args.segments}x{args.segment_kb}/index.m3u8?job={i}'])
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    secs = time.perf_counter() - started
+
+    expected = args.segments * args.segment_kb * 1024
+    produced = 0
+    lost = 0
+    for name in os.listdir(workdir):
+        if not name.startswith(f'{mode}-{jobs}-'):
+            continue
+        path = os.path.join(workdir, name)
+        # Leftover .part/-FragN/.ytdl files belong to failed jobs
+        if '.part' not in name and not name.endswith('.ytdl'):
+            size = os.path.getsize(path)
+            produced += size
+            lost += (expected - size) // (args.segment_kb * 1024)
+        os.remove(path)
+    after = standin_stats(url)
+    row = {
+        'mode': mode,
+        'jobs': jobs,
+        'secs': round(secs, 2),
+        'mb_per_sec': round(produced / MB / secs, 1),
+        'requests': after['media_requests'] - before['media_requests'],
+        'throttled': after['throttled'] - before['throttled'],
+        'peak_conns': after['media_peak'],
+        'fragments_lost': lost,
+        'failed_jobs': len(errors),
+    }
+    if hosts:
+        host = next(iter(hosts.stats().values()), {})
+        row['final_limit'] = host.get('limit')
+    return row
+
+
+def print_row(r):
+    limit = f"limit {r['final_limit']:>2}" if 'final_limit' in r else ' ' * 8
+    print(f"{r['mode']:9s} jobs {r['jobs']:>3} {r['secs']:7.2f}s {r['mb_per_sec']:7.1f} MB/s "
+          f"{r['requests']:>6} req {r['throttled']:>5} x429 {r['fragments_lost']:>4} lost {limit}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', default='4,8')
+    parser.add_argument('--modes', default='fixed,adaptive')
+    parser.add_argument('--segments', type=int, default=60)
+    parser.add_argument('--segment-kb', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=30)
+    parser.add_argument('--conn-mbps', type=float, default=2, help='stand-in cap per connection')
+    parser.add_argument('--host-mbps', type=float, default=40, help='stand-in cap for all connections')
+    parser.add_argument('--max-conns', type=int, default=24, help='connections the stand-in serves before 429s')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 429 anyway')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--no-penalty', action='store_true', help='let requests through again right after a 429')
+    parser.add_argument('--host-connections', type=int, default=8, help='adaptive: initial per-host limit')
+    parser.add_argument('--host-max-connections', type=int, default=32, help='adaptive: per-host ceiling')
+    parser.add_argument('--window', type=float, default=1.0, help='adaptive: seconds between adjustments')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for jobs in [int(j) for j in args.jobs.split(',')]:
+            for mode in args.modes.split(','):
+                # A fresh stand-in per run so peak concurrency is per run
+                proc, url = start_standin(args)
+                try:
+                    results.append(run(mode, jobs, url, args, workdir))
+                finally:
+                    proc.terminate()
+                    proc.wait()
+                print_row(results[-1])
+
+    if args.json:
+        report = {k: getattr(args, k) for k in ('segments', 'segment_kb', 'latency_ms', 'conn_mbps', 'host_mbps',
+                                                'max_conns', 'error_rate', 'no_penalty')}
+        report['results'] = results
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark /file serving: throughput and server CPU per concurrent client.
+
+Starts the backend with uvicorn in a subprocess, registers a synthetic
+finished task pointing at a generated file, then downloads it from N
+concurrent clients (full transfers and random 1 MB range requests).
+Server CPU is read from /proc, so this runs on Linux only.
+
+Usage: python benchmark_serve.py [--size-mb 256] [--clients 1,4,16] [--json out.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+BACKEND = os.path.join(ROOT, 'backend')
+sys.path.insert(0, BACKEND)
+
+from app.store import SQLiteTaskStore  # noqa: E402
+
+TASK_ID = 'bench-serve'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+def make_file(path, size_mb):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def start_server(download_dir, port):
+    env = dict(os.environ, DOWNLOAD_DIR=download_dir, TASK_STORE='sqlite')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=BACKEND, env=env,
+    )
+    for _ in range(100):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+def fetch(port, headers, stats):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('GET', f'/file/{TASK_ID}', headers=headers)
+    resp = conn.getresponse()
+    total = 0
+    while True:
+        chunk = resp.read(1024 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+    conn.close()
+    stats.append((resp.status, total))
+
+
+def run_case(port, pid, clients, size, mode, requests_per_client):
+    stats = []
+
+    def client():
+        for _ in range(requests_per_client):
+            headers = {}
+            if mode == 'range':
+                start = random.randrange(0, max(1, size - 1024 * 1024))
+                headers['Range'] = f'bytes={start}-{start + 1024 * 1024 - 1}'
+            fetch(port, headers, stats)
+
+    cpu_before = cpu_seconds(pid)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds(pid) - cpu_before
+    total_bytes = sum(n for _, n in stats)
+    mb = total_bytes / (1024 * 1024)
+    return {
+        'mode': mode,
+        'clients': clients,
+        'requests': len(stats),
+        'statuses': sorted({s for s, _ in stats}),
+        'mb': round(mb, 1),
+        'secs': round(elapsed, 3),
+        'mb_per_sec': round(mb / elapsed, 1),
+        'server_cpu_secs': round(cpu, 3),
+        'server_cpu_pct': round(100.0 * cpu / elapsed, 1),
+        'cpu_ms_per_mb': round(1000.0 * cpu / mb, 3) if mb else None,
+        'cpu_pct_per_client': round(100.0 * cpu / elapsed / clients, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--clients', default='1,4,16')
+    parser.add_argument('--range-requests', type=int, default=50, help='range requests per client')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as download_dir:
+        path = os.path.join(download_dir, TASK_ID, 'bench.mp4')
+        os.makedirs(os.path.dirname(path))
+        make_file(path, args.size_mb)
+        size = os.path.getsize(path)
+        store = SQLiteTaskStore(os.path.join(download_dir, '.tasks.db'))
+        store.put(TASK_ID, {'state': 'SUCCESS', 'result': {
+            'file_path': path, 'filename': 'bench.mp4', 'size': size, 'quality': '1080p', 'type': 'video'}})
+
+        port = free_port()
+        proc = start_server(download_dir, port)
+        results = []
+        try:
+            for clients in [int(c) for c in args.clients.split(',')]:
+                for mode, per_client in (('full', 1), ('range', args.range_requests)):
+                    r = run_case(port, proc.pid, clients, size, mode, per_client)
+                    results.append(r)
+                    print(f"{mode:5s} x{clients:<3d} {r['mb']:8.1f} MB in {r['secs']:6.2f}s  "
+                          f"{r['mb_per_sec']:8.1f} MB/s  server CPU {r['server_cpu_pct']:5.1f}%  "
+                          f"({r['cpu_pct_per_client']:.1f}%/client, {r['cpu_ms_per_mb']} ms/MB)  statuses={r['statuses']}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    report = {'size_mb': args.size_mb, 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
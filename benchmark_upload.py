@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Benchmark object storage uploads offline against standin_server.py.
+
+Starts the stand-in (S3 + GCS JSON API) in a subprocess with per-request
+latency and a per-connection bandwidth cap, then uploads a generated file:
+  - legacy: the previous single call (boto3 upload_file / GCS
+    upload_from_filename)
+  - a matrix of part sizes x concurrency through app.upload.ParallelUploader
+  - download-then-upload vs pipelined: a writer produces the file at
+    --source-mbps and the upload either waits for it or follows it
+Every uploaded object is read back and checked against the source.
+
+Requires boto3 and/or google-cloud-storage.
+
+Usage: python benchmark_upload.py [--size-mb 128] [--backends s3,gcs] [--part-mb 8,16,32]
+                                  [--concurrency 1,4,8] [--latency-ms 20] [--conn-mbps 20] [--json out.json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+
+from app.upload import GCSTarget, ParallelUploader, PipelinedUpload, S3Target  # noqa: E402
+
+MB = 1024 * 1024
+BUCKET = 'bench'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_standin(latency_ms, conn_mbps):
+    port = free_port()
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, 'standin_server.py'), '--port', str(port),
+        '--latency-ms', str(latency_ms), '--conn-mbps', str(conn_mbps)], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return proc, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('stand-in did not start')
+
+
+def make_file(path, size_mb):
+    digest = hashlib.md5()
+    block = os.urandom(MB)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class S3Backend:
+    name = 's3'
+
+    def __init__(self, url):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.client import Config
+        self.transfer_config = TransferConfig
+        self.client = boto3.client(
+            's3', endpoint_url=url, aws_access_key_id='bench', aws_secret_access_key='bench',
+            region_name='us-east-1', config=Config(signature_version='s3v4', max_pool_connections=64))
+        self.client.create_bucket(Bucket=BUCKET)
+
+    def target(self):
+        return S3Target(self.client, BUCKET)
+
+    def legacy(self, path, key):
+        self.client.upload_file(path, BUCKET, key)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+class GCSBackend:
+    name = 'gcs'
+
+    def __init__(self, url):
+        os.environ['STORAGE_EMULATOR_HOST'] = url
+        from google.cloud import storage
+        self.bucket = storage.Client(project='bench').bucket(BUCKET)
+
+    def target(self):
+        return GCSTarget(self.bucket)
+
+    def legacy(self, path, key):
+        self.bucket.blob(key).upload_from_filename(path)
+
+    def read(self, key):
+        return self.bucket.blob(key).download_as_bytes()
+
+
+def verify(backend, key, md5):
+    return hashlib.md5(backend.read(key)).hexdigest() == md5
+
+
+def row(backend, case, size, secs, ok, **extra):
+    return dict(backend=backend.name, case=case, mb=round(size / MB, 1), secs=round(secs, 3),
+                mb_per_sec=round(size / MB / secs, 1), verified=ok, **extra)
+
+
+def write_slowly(src, dst, mbps, done):
+    """Copy `src` to `dst` at `mbps` MB/s, like a download in progress"""
+    started = time.monotonic()
+    written = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            block = fin.read(MB)
+            if not block:
+                break
+            fout.write(block)
+            fout.flush()
+            written += len(block)
+            ahead = written / (mbps * MB) - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    done.set()
+
+
+def run_backend(backend, path, size, md5, args, workdir):
+    results = []
+
+    started = time.perf_counter()
+    backend.legacy(path, 'legacy')
+    results.append(row(backend, 'legacy', size, time.perf_counter() - started, verify(backend, 'legacy', md5)))
+    print_row(results[-1])
+
+    for part_mb in [int(p) for p in args.part_mb.split(',')]:
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            key = f'matrix-{part_mb}-{concurrency}'
+            uploader = ParallelUploader(backend.target(), part_mb * MB, concurrency)
+            started = time.perf_counter()
+            stats = uploader.upload(path, key)
+            secs = time.perf_counter() - started
+            results.append(row(backend, 'parallel', size, secs, verify(backend, key, md5),
+                               part_mb=part_mb, concurrency=concurrency, parts=stats['parts']))
+            print_row(results[-1])
+
+    # End to end: a download producing the file at --source-mbps, then the upload
+    uploader = ParallelUploader(backend.target(), args.pipeline_part_mb * MB, args.pipeline_concurrency)
+    for mode in ('after-download', 'pipelined'):
+        growing = os.path.join(workdir, f'{backend.name}-{mode}.part')
+        done = threading.Event()
+        writer = threading.Thread(target=write_slowly, args=(path, growing, args.source_mbps, done))
+        started = time.perf_counter()
+        writer.start()
+        if mode == 'pipelined':
+            while not os.path.exists(growing):
+                time.sleep(0.001)
+            upload = PipelinedUpload(uploader, growing, mode)
+            done.wait()
+            upload.finish(True)
+            stats = upload.result()
+        else:
+            done.wait()
+            stats = uploader.upload(growing, mode)
+        secs = time.perf_counter() - started
+        writer.join()
+        os.remove(growing)
+        results.append(row(backend, mode, size, secs, verify(backend, mode, md5),
+                           part_mb=args.pipeline_part_mb, concurrency=args.pipeline_concurrency,
+                           parts=stats['parts'], source_mbps=args.source_mbps))
+        print_row(results[-1])
+    return results
+
+
+def print_row(r):
+    detail = f"part {r['part_mb']:>3} MB x{r['concurrency']:<3}" if 'part_mb' in r else ' ' * 16
+    print(f"{r['backend']:4s} {r['case']:15s} {detail} {r['mb']:8.1f} MB in {r['secs']:7.2f}s "
+          f"{r['mb_per_sec']:8.1f} MB/s  {'ok' if r['verified'] else 'MISMATCH'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--backends', default='s3,gcs')
+    parser.add_argument('--part-mb', default='8,16,32')
+    parser.add_argument('--concurrency', default='1,4,8')
+    parser.add_argument('--pipeline-part-mb', type=int, default=16)
+    parser.add_argument('--pipeline-concurrency', type=int, default=8)
+    parser.add_argument('--source-mbps', type=float, default=40, help='rate the simulated download writes at')
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--conn-mbps', type=float, default=20, help='stand-in bandwidth cap per connection')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    proc, url = start_standin(args.latency_ms, args.conn_mbps)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'source.bin')
+            md5 = make_file(path, args.size_mb)
+            size = os.path.getsize(path)
+            for name in args.backends.split(','):
+                backend = {'s3': S3Backend, 'gcs': GCSBackend}[name](url)
+                results.extend(run_backend(backend, path, size, md5, args, workdir))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    report = {
+        'size_mb': args.size_mb,
+        'latency_ms': args.latency_ms,
+        'conn_mbps': args.conn_mbps,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
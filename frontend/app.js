@@ -63,16 +63,22 @@ const downloadManager = {
     if (download && download.pollInterval) {
       clearInterval(download.pollInterval)
     }
+    if (download && (download.state === 'PENDING' || download.state === 'DOWNLOADING')) {
+      // Stop the server-side job too, so it doesn't keep a download slot
+      fetch(`${API}/task/${taskId}`, { method: 'DELETE' })
+        .catch(err => console.warn('Cancel failed:', taskId, err.message))
+    }
     this.downloads.delete(taskId)
     this.updateQueueUI()
   },
   
-  updateDownloadState(taskId, state, result = null, error = null) {
+  updateDownloadState(taskId, state, result = null, error = null, progress = null) {
     const download = this.downloads.get(taskId)
     if (download) {
       download.state = state
       if (result) download.result = result
       if (error) download.error = error
+      download.progress = progress
       console.log(`🔄 Updated ${taskId}: ${state}`, { result, error })
       this.updateQueueUI()
       this.updatePlayerIfNeeded()
@@ -96,6 +102,7 @@ const downloadManager = {
           <div class="queue-item-title">${mediaIcon} ${download.mediaType.toUpperCase()} - ${shortId}</div>
           <div class="queue-item-details">Quality: ${formats[download.mediaType][download.quality]}</div>
           ${download.result ? `<div class="queue-item-details">📄 ${download.result.filename}</div>` : ''}
+          ${download.progress && formatProgress(download.progress) ? `<div class="queue-item-details">${formatProgress(download.progress)}</div>` : ''}
         </div>
         <div class="queue-item-status ${statusBadge}">${this.getStatusText(download.state)}</div>
         <div class="queue-item-actions">
@@ -116,7 +123,8 @@ const downloadManager = {
       'PENDING': '⏳ Queued',
       'DOWNLOADING': '📥 Downloading',
       'SUCCESS': '✅ Ready',
-      'FAILURE': '❌ Failed'
+      'FAILURE': '❌ Failed',
+      'CANCELLED': '🚫 Cancelled'
     }
     return statusMap[state] || state
   },
@@ -126,7 +134,8 @@ const downloadManager = {
       'PENDING': 'status-pending',
       'DOWNLOADING': 'status-downloading',
       'SUCCESS': 'status-success-badge',
-      'FAILURE': 'status-error-badge'
+      'FAILURE': 'status-error-badge',
+      'CANCELLED': 'status-error-badge'
     }
     return badgeMap[state] || ''
   },
@@ -345,7 +354,7 @@ form.addEventListener('submit', async (e) => {
     // Clear form
     document.getElementById('url').value = ''
     
-    pollStatus(taskId, mediaType, quality)
+    statusStream.watch(taskId)
   } catch (err) {
     // Helpful hint when network-level failure occurs
     const hint = err.message && err.message.toLowerCase().includes('failed to fetch')
@@ -355,10 +364,100 @@ form.addEventListener('submit', async (e) => {
   }
 })
 
+function formatBytes(n) {
+  if (!n) return '0 B'
+  const units = ['B', 'KB', 'MB', 'GB']
+  let i = 0
+  while (n >= 1024 && i < units.length - 1) { n /= 1024; i++ }
+  return `${n.toFixed(i ? 1 : 0)} ${units[i]}`
+}
+
+function formatProgress(p) {
+  if (p.stage === 'postprocessing') return `⚙️ Processing (${p.postprocessor || 'ffmpeg'})`
+  if (p.stage === 'queued_postprocess') return '⏳ Waiting for a processing slot'
+  if (p.stage === 'queued_upload') return '⏳ Waiting for an upload slot'
+  if (p.stage === 'uploading') return '☁️ Uploading'
+  if (p.stage === 'extracting') return '🔎 Fetching media info'
+  if (p.queue_position) return `🕒 Position ${p.queue_position} in queue`
+  if (!p.downloaded_bytes) return ''
+  const pct = p.total_bytes ? ` (${Math.floor(p.downloaded_bytes * 100 / p.total_bytes)}%)` : ''
+  const speed = p.speed ? ` • ${formatBytes(p.speed)}/s` : ''
+  const eta = p.eta ? ` • ${p.eta}s left` : ''
+  return `${formatBytes(p.downloaded_bytes)}${pct}${speed}${eta}`
+}
+
+// Apply a status payload (from /events or /status) to the download manager.
+// Returns true once the task has reached a final state.
+function applyStatus(taskId, body) {
+  if (body.state === 'SUCCESS') {
+    downloadManager.updateDownloadState(taskId, 'SUCCESS', body.result || {})
+    console.log('✅ Download complete:', taskId, body.result)
+    return true
+  }
+  if (body.state === 'FAILURE' || body.state === 'UNKNOWN') {
+    downloadManager.updateDownloadState(taskId, 'FAILURE', null, body.error || 'Unknown error')
+    console.log('❌ Download failed:', taskId, body.error)
+    return true
+  }
+  if (body.state === 'CANCELLED') {
+    downloadManager.updateDownloadState(taskId, 'CANCELLED')
+    return true
+  }
+  if (body.state === 'DOWNLOADING') {
+    downloadManager.updateDownloadState(taskId, 'DOWNLOADING', null, null, body.progress || body)
+  } else {
+    downloadManager.updateDownloadState(taskId, 'PENDING', null, null, body)
+  }
+  return false
+}
+
+// One multiplexed Server-Sent Events connection for all active downloads.
+// Falls back to polling /status if the browser or a proxy can't do SSE.
+const statusStream = {
+  taskIds: new Set(),
+  source: null,
+
+  watch(taskId) {
+    if (!window.EventSource) {
+      pollStatus(taskId)
+      return
+    }
+    this.taskIds.add(taskId)
+    this.reconnect()
+  },
+
+  reconnect() {
+    if (this.source) this.source.close()
+    this.source = null
+    if (this.taskIds.size === 0) return
+    const ids = Array.from(this.taskIds).join(',')
+    const source = new EventSource(`${API}/events?ids=${encodeURIComponent(ids)}`)
+    source.onmessage = (msg) => {
+      const body = JSON.parse(msg.data)
+      if (!downloadManager.downloads.has(body.task_id)) return
+      if (applyStatus(body.task_id, body)) {
+        this.taskIds.delete(body.task_id)
+        if (this.taskIds.size === 0) {
+          source.close()
+          this.source = null
+        }
+      }
+    }
+    source.onerror = () => {
+      console.warn('Event stream unavailable, falling back to polling')
+      source.close()
+      this.source = null
+      const ids = Array.from(this.taskIds)
+      this.taskIds.clear()
+      ids.forEach(id => pollStatus(id))
+    }
+    this.source = source
+  }
+}
+
 let pollIntervals = new Map()
 
-async function pollStatus(taskId, mediaType, quality) {
-  downloadManager.updateDownloadState(taskId, 'PENDING')
+async function pollStatus(taskId) {
   
   let elapsed = 0
   let maxAttempts = 300  // 10 minutes with 2s interval
@@ -383,25 +482,9 @@ async function pollStatus(taskId, mediaType, quality) {
         return
       }
       
-      // Handle different states
-      if (body.state === 'PENDING' || body.state === 'QUEUED') {
-        downloadManager.updateDownloadState(taskId, 'PENDING')
-      } else if (body.state === 'DOWNLOADING') {
-        downloadManager.updateDownloadState(taskId, 'DOWNLOADING')
-      } else if (body.state === 'SUCCESS') {
-        clearInterval(pollInterval)
-        pollIntervals.delete(taskId)
-        // Extract result object - API returns result at top level
-        const result = body.result || {}
-        console.log('✅ Setting state to SUCCESS with result:', result)
-        downloadManager.updateDownloadState(taskId, 'SUCCESS', result)
-        console.log('✅ Download complete:', taskId, result)
-      } else if (body.state === 'FAILURE') {
+      if (applyStatus(taskId, body)) {
         clearInterval(pollInterval)
         pollIntervals.delete(taskId)
-        const error = body.error || 'Unknown error'
-        downloadManager.updateDownloadState(taskId, 'FAILURE', null, error)
-        console.log('❌ Download failed:', taskId, error)
       }
     } catch (err) {
       console.error('Poll error:', err.message)
@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the remote services the backend talks to, for offline
+tests and benchmarks. Everything is kept in memory.
+
+Object storage:
+  - S3-compatible API, path-style (/bucket/key): put/get/head/delete and
+    multipart uploads. Point boto3 at it with endpoint_url.
+  - The subset of the GCS JSON API used by google-cloud-storage for
+    uploads (multipart and resumable), compose, listing, reads and deletes.
+    Point the client at it with STORAGE_EMULATOR_HOST.
+
+Media (for download benchmarks):
+  - /media/hls/<segments>x<kb>/index.m3u8 and seg<N>.ts: a VOD HLS stream
+    of synthetic segments with deterministic content
+  - /media/encoded/<segments>x<secs>x<kbps>/...: a test pattern with a tone,
+    encoded by ffmpeg on first request (H.264 at <kbps> + AAC, 640x360,
+    <segments> segments of <secs> seconds) so postprocessing works on it:
+      watch.html        page with a <video> tag for the progressive video.mp4
+      hls/index.m3u8    HLS master playlist (muxed TS segments)
+      hls-fmp4/index.m3u8 the same with fragmented MP4 segments
+      dash/manifest.mpd DASH with separate video and audio representations
+  - /_standin/stats: request counters, 429s sent, injected errors and peak
+    concurrency; POST /_standin/reset zeroes them
+
+Every request can be delayed by a fixed latency, and request/response
+bodies are paced to a per-connection bandwidth cap (and optionally a cap
+for the whole host), so parallel transfers behave like they do against a
+real endpoint. Media requests can be throttled like a CDN: 429 with
+Retry-After above a number of concurrent connections, and at random;
+with --penalty every media request keeps getting 429 until that
+Retry-After has passed, like a rate limiter's penalty box. Segment and
+file requests can also fail with 503 (--fail-rate) or have their
+connection dropped halfway through the body (--reset-rate); which
+attempts fail is decided by a hash of the seed, the URL and the attempt
+number, so a run can be repeated exactly whatever order requests arrive in.
+
+Usage: python standin_server.py [--port 9000] [--latency-ms 20] [--conn-mbps 50] [--host-mbps 200]
+                                [--max-conns 24] [--error-rate 0.01] [--retry-after 1] [--penalty]
+                                [--fail-rate 0.02] [--reset-rate 0.02] [--seed 1] [--media-dir DIR]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.etree import ElementTree
+
+try:
+    import google_crc32c
+except ImportError:  # only needed to report crc32c to the GCS client
+    google_crc32c = None
+
+READ_CHUNK = 64 * 1024
+# Requests that error injection applies to; playlists and pages are spared
+MEDIA_FILES = ('.ts', '.m4s', '.mp4')
+
+
+class StandinServer:
+    """Threaded HTTP server holding the stand-in state.
+
+    `latency` is in seconds, `conn_bytes_per_sec` caps each connection's
+    transfer rate and `host_bytes_per_sec` all of them together (0 for
+    unlimited). Media requests beyond `max_conns` at once, plus a random
+    `error_rate` of them, get 429 with `retry_after`; with `penalty` so
+    does every media request until that time has passed. `fail_rate` and
+    `reset_rate` of segment/file requests get a 503 or a truncated body.
+    Encoded media is rendered into `media_dir` (a temporary directory by
+    default) and reused from there. `objects` maps (bucket, key) to bytes.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, conn_bytes_per_sec=0,
+                 host_bytes_per_sec=0, max_conns=0, error_rate=0.0, retry_after=1, seed=None,
+                 penalty=False, fail_rate=0.0, reset_rate=0.0, media_dir=None):
+        self.latency = latency
+        self.conn_bytes_per_sec = conn_bytes_per_sec
+        self.host_bytes_per_sec = host_bytes_per_sec
+        self.max_conns = max_conns
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.penalty = penalty
+        self.penalty_until = 0.0
+        self.random = random.Random(seed)
+        self.seed = seed or 0
+        self.fail_rate = fail_rate
+        self.reset_rate = reset_rate
+        self.media = MediaLibrary(media_dir)
+        self.attempts = {}
+        self.media_active = 0
+        self.media_peak = 0
+        self.media_requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.resets = 0
+        self._host_next_send = 0.0
+        self.objects = {}
+        self.buckets = set()
+        self.multipart = {}
+        self.resumable = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        handler = type('Handler', (StandinHandler,), {'standin': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.media.close()
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.media.close()
+
+    def host_pace(self, nbytes):
+        """Delay a chunk so all connections together stay under host_bytes_per_sec"""
+        if not self.host_bytes_per_sec:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_send)
+            self._host_next_send = start + nbytes / self.host_bytes_per_sec
+        if start > now:
+            time.sleep(start - now)
+
+    def inject(self, path):
+        """'fail', 'reset' or None for this attempt at `path`, the same on every run"""
+        if not (self.fail_rate or self.reset_rate):
+            return None
+        with self.lock:
+            attempt = self.attempts[path] = self.attempts.get(path, 0) + 1
+        digest = hashlib.sha256(f'{self.seed}:{path}:{attempt}'.encode()).digest()
+        draw = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        if draw < self.fail_rate:
+            return 'fail'
+        if draw < self.fail_rate + self.reset_rate:
+            return 'reset'
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'media_requests': self.media_requests,
+                'media_active': self.media_active,
+                'media_peak': self.media_peak,
+                'throttled': self.throttled,
+                'failed': self.failed,
+                'resets': self.resets,
+            }
+
+    def reset(self):
+        """Zero the counters and attempt numbers, e.g. between benchmark runs"""
+        with self.lock:
+            self.requests = self.media_requests = self.media_peak = 0
+            self.throttled = self.failed = self.resets = 0
+            self.attempts.clear()
+            self.penalty_until = 0.0
+
+
+def segment_bytes(index, size):
+    """Deterministic content of HLS segment `index`, so downloads can be verified"""
+    seed = hashlib.sha256(f'segment-{index}'.encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class MediaLibrary:
+    """Encoded test media, rendered with ffmpeg once per spec and kept on disk"""
+
+    def __init__(self, root=None):
+        # Without a root, a temporary one is made on first use and removed by close()
+        self.root = root
+        self.owned = None
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        if self.owned:
+            shutil.rmtree(self.owned, ignore_errors=True)
+
+    def render(self, segments, secs, kbps):
+        """Directory holding the media for this spec, encoding it first if needed"""
+        with self._lock:
+            if self.root is None:
+                self.root = self.owned = tempfile.mkdtemp(prefix='standin-media-')
+            path = os.path.join(self.root, f'{segments}x{secs}x{kbps}')
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            if not os.path.exists(os.path.join(path, 'done')):
+                shutil.rmtree(path, ignore_errors=True)
+                encode_media(path, segments, secs, kbps)
+                open(os.path.join(path, 'done'), 'w').close()
+        return path
+
+
+def encode_media(path, segments, secs, kbps):
+    """Write video.mp4, watch.html, hls/, hls-fmp4/ and dash/ for a test pattern into `path`"""
+    for name in ('hls', 'hls-fmp4', 'dash'):
+        os.makedirs(os.path.join(path, name))
+    ffmpeg = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y']
+    fps = 25
+    subprocess.run(ffmpeg + [
+        '-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=%d' % fps,
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(segments * secs),
+        # Constant bitrate and a keyframe at every segment boundary
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{kbps}k', '-minrate', f'{kbps}k',
+        '-maxrate', f'{kbps}k', '-bufsize', f'{kbps}k', '-x264-params', 'nal-hrd=cbr',
+        '-g', str(fps * secs), '-keyint_min', str(fps * secs), '-sc_threshold', '0',
+        '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart', os.path.join(path, 'video.mp4'),
+    ], check=True)
+    for name, segment_args in (('hls', ['-hls_segment_filename', os.path.join(path, 'hls', 'seg%d.ts')]),
+                               ('hls-fmp4', ['-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                                             '-hls_segment_filename', os.path.join(path, 'hls-fmp4', 'seg%d.m4s')])):
+        subprocess.run(ffmpeg + [
+            '-i', os.path.join(path, 'video.mp4'), '-c', 'copy', '-f', 'hls', '-hls_time', str(secs),
+            '-hls_playlist_type', 'vod'] + segment_args + [os.path.join(path, name, 'media.m3u8'),
+        ], check=True)
+    subprocess.run(ffmpeg + [
+        '-i', os.path.join(path, 'video.mp4'), '-map', '0:v', '-map', '0:a', '-c', 'copy', '-f', 'dash',
+        '-seg_duration', str(secs), '-use_template', '1', '-use_timeline', '0',
+        '-adaptation_sets', 'id=0,streams=v id=1,streams=a', os.path.join(path, 'dash', 'manifest.mpd'),
+    ], check=True)
+    # Master playlists, so yt-dlp knows the height and can select by it
+    for name in ('hls', 'hls-fmp4'):
+        with open(os.path.join(path, name, 'index.m3u8'), 'w') as f:
+            f.write('#EXTM3U\n#EXT-X-VERSION:3\n'
+                    f'#EXT-X-STREAM-INF:BANDWIDTH={(kbps + 128) * 1000},RESOLUTION=640x360,CODECS="avc1.42c01e,mp4a.40.2"\n'
+                    'media.m3u8\n')
+    with open(os.path.join(path, 'watch.html'), 'w') as f:
+        f.write('<!DOCTYPE html><html><head><title>Test pattern</title></head><body>'
+                '<video controls><source src="video.mp4" type="video/mp4" res="360" label="360p"></video>'
+                '</body></html>\n')
+
+
+def gcs_resource(bucket, name, data):
+    resource = {
+        'kind': 'storage#object',
+        'id': f'{bucket}/{name}/1',
+        'bucket': bucket,
+        'name': name,
+        'generation': '1',
+        'metageneration': '1',
+        'size': str(len(data)),
+        'md5Hash': base64.b64encode(hashlib.md5(data).digest()).decode(),
+    }
+    if google_crc32c is not None:
+        resource['crc32c'] = base64.b64encode(google_crc32c.value(data).to_bytes(4, 'big')).decode()
+    return resource
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    standin = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # Client dropped a kept-alive connection
+            pass
+
+    # -- plumbing -------------------------------------------------------
+
+    def _begin(self):
+        with self.standin.lock:
+            self.standin.requests += 1
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+        parts = urlsplit(self.path)
+        self.route = unquote(parts.path)
+        self.raw_route = parts.path
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+
+    def _pace(self, nbytes, started):
+        rate = self.standin.conn_bytes_per_sec
+        if rate:
+            ahead = nbytes / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        buf = bytearray()
+        started = time.monotonic()
+        while len(buf) < length:
+            chunk = self.rfile.read(min(READ_CHUNK, length - len(buf)))
+            if not chunk:
+                break
+            buf += chunk
+            self._pace(len(buf), started)
+        body = bytes(buf)
+        if 'aws-chunked' in (self.headers.get('Content-Encoding') or ''):
+            body = decode_aws_chunked(body)
+        return body
+
+    def _send(self, status, body=b'', content_type='application/octet-stream', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or status not in (204, 304):
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'HEAD' or not body:
+            return
+        started = time.monotonic()
+        sent = 0
+        while sent < len(body):
+            chunk = body[sent:sent + READ_CHUNK]
+            self.standin.host_pace(len(chunk))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            self._pace(sent, started)
+
+    def _json(self, status, obj, headers=None):
+        self._send(status, json.dumps(obj).encode(), 'application/json', headers)
+
+    def _xml(self, status, text):
+        self._send(status, text.encode(), 'application/xml')
+
+    def _dispatch(self):
+        self._begin()
+        route = self.route
+        try:
+            if route == '/_standin/stats':
+                return self._json(200, self.standin.stats())
+            if route == '/_standin/reset' and self.command == 'POST':
+                self.standin.reset()
+                return self._send(204)
+            if route.startswith('/media/'):
+                return self.media()
+            if route.startswith('/upload/storage/v1/b/'):
+                return self.gcs_upload()
+            if route.startswith('/download/storage/v1/b/'):
+                return self.gcs_object(download=True)
+            if route.startswith('/storage/v1/b/'):
+                return self.gcs_object()
+            return self.s3()
+        except ConnectionError:
+            # Client gave up mid-transfer
+            pass
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _dispatch
+
+    # -- S3 ---------------------------------------------------------------
+
+    def s3(self):
+        store = self.standin
+        bucket, _, key = self.route.lstrip('/').partition('/')
+        method = self.command
+        if not key:
+            if method == 'PUT':
+                self._read_body()
+                store.buckets.add(bucket)
+                return self._send(200)
+            if method == 'HEAD':
+                return self._send(200 if bucket in store.buckets else 404)
+            return self._send(405)
+
+        if method == 'POST' and 'uploads' in self.query:
+            self._read_body()
+            upload_id = uuid.uuid4().hex
+            with store.lock:
+                store.multipart[upload_id] = {}
+            return self._xml(200, (
+                '<InitiateMultipartUploadResult>'
+                f'<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>'
+                '</InitiateMultipartUploadResult>'))
+
+        upload_id = self.query.get('uploadId')
+        if method == 'PUT' and upload_id:
+            data = self._read_body()
+            parts = store.multipart.get(upload_id)
+            if parts is None:
+                return self._xml(404, '<Error><Code>NoSuchUpload</Code></Error>')
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            with store.lock:
+                parts[int(self.query['partNumber'])] = (etag, data)
+            return self._send(200, headers={'ETag': etag})
+
+        if method == 'POST' and upload_id:
+            body = self._read_body()
+            with store.lock:
+                parts = store.multipart.pop(upload_id, None)
+            if parts is None:
+                return self._xml(404, '<Error><Code>NoSuchUpload</Code></Error>')
+            numbers = [int(el.text) for el in ElementTree.fromstring(body).iter()
+                       if el.tag.rsplit('}', 1)[-1] == 'PartNumber']
+            data = b''.join(parts[n][1] for n in numbers)
+            with store.lock:
+                store.buckets.add(bucket)
+                store.objects[(bucket, key)] = data
+            return self._xml(200, (
+                '<CompleteMultipartUploadResult>'
+                f'<Bucket>{bucket}</Bucket><Key>{key}</Key>'
+                f'<ETag>"{hashlib.md5(data).hexdigest()}-{len(numbers)}"</ETag>'
+                '</CompleteMultipartUploadResult>'))
+
+        if method == 'DELETE' and upload_id:
+            with store.lock:
+                store.multipart.pop(upload_id, None)
+            return self._send(204)
+
+        if method == 'PUT':
+            data = self._read_body()
+            with store.lock:
+                store.buckets.add(bucket)
+                store.objects[(bucket, key)] = data
+            return self._send(200, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+        data = store.objects.get((bucket, key))
+        if method == 'DELETE':
+            with store.lock:
+                store.objects.pop((bucket, key), None)
+            return self._send(204)
+        if data is None:
+            return self._xml(404, '<Error><Code>NoSuchKey</Code></Error>')
+        return self._send(200, data, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+    # -- Media ------------------------------------------------------------
+
+    def media(self):
+        store = self.standin
+        with store.lock:
+            store.media_requests += 1
+            now = time.monotonic()
+            throttle = ((store.max_conns and store.media_active >= store.max_conns)
+                        or (store.error_rate and store.random.random() < store.error_rate)
+                        or now < store.penalty_until)
+            if throttle:
+                store.throttled += 1
+                if store.penalty and now >= store.penalty_until:
+                    store.penalty_until = now + store.retry_after
+            else:
+                store.media_active += 1
+                store.media_peak = max(store.media_peak, store.media_active)
+        if throttle:
+            return self._send(429, b'Too Many Requests', 'text/plain', {'Retry-After': str(store.retry_after)})
+        try:
+            self._media()
+        finally:
+            with store.lock:
+                store.media_active -= 1
+
+    def _media(self):
+        kind, _, rest = self.route[len('/media/'):].partition('/')
+        spec, _, name = rest.partition('/')
+        if kind == 'encoded':
+            return self._encoded(spec, name)
+        if kind != 'hls':
+            return self._send(404)
+        try:
+            segments, kb = (int(n) for n in spec.split('x'))
+        except ValueError:
+            return self._send(404)
+        if name == 'index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0',
+                     '#EXT-X-PLAYLIST-TYPE:VOD']
+            for i in range(segments):
+                lines += ['#EXTINF:4.000,', f'seg{i}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            return self._send(200, ('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl')
+        if name.startswith('seg') and name.endswith('.ts') and name[3:-3].isdigit() and int(name[3:-3]) < segments:
+            return self._send_media(segment_bytes(int(name[3:-3]), kb * 1024), 'video/mp2t')
+        return self._send(404)
+
+    def _encoded(self, spec, name):
+        try:
+            segments, secs, kbps = (int(n) for n in spec.split('x'))
+        except ValueError:
+            return self._send(404)
+        types = {'.html': 'text/html', '.m3u8': 'application/vnd.apple.mpegurl', '.mpd': 'application/dash+xml',
+                 '.ts': 'video/mp2t', '.m4s': 'video/iso.segment', '.mp4': 'video/mp4'}
+        content_type = types.get(os.path.splitext(name)[1])
+        if content_type is None or '..' in name.split('/'):
+            return self._send(404)
+        try:
+            root = self.standin.media.render(segments, secs, kbps)
+        except (OSError, subprocess.CalledProcessError) as e:
+            return self._send(500, f'encoding failed: {e}'.encode(), 'text/plain')
+        try:
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return self._send(404)
+        return self._send_media(data, content_type)
+
+    def _send_media(self, data, content_type):
+        """Send a segment or file with Range support and error injection"""
+        store = self.standin
+        if self.route.endswith(MEDIA_FILES):
+            fault = store.inject(self.path)
+            if fault == 'fail':
+                with store.lock:
+                    store.failed += 1
+                return self._send(503, b'Service Unavailable', 'text/plain', {'Retry-After': '0'})
+        else:
+            fault = None
+        status, headers = 200, {'Accept-Ranges': 'bytes'}
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and ',' not in byte_range:
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            if first:
+                start = int(first)
+                end = min(int(last), len(data) - 1) if last else len(data) - 1
+            else:
+                # Suffix range: the last N bytes
+                start, end = max(0, len(data) - int(last)), len(data) - 1
+            if start >= len(data):
+                return self._send(416, headers={'Content-Range': f'bytes */{len(data)}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            data = data[start:end + 1]
+        if fault == 'reset':
+            with store.lock:
+                store.resets += 1
+            # Promise the whole body, send half of it, then drop the connection
+            self.send_response(status)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        return self._send(status, data, content_type, headers)
+
+    # -- GCS JSON API -----------------------------------------------------
+
+    def gcs_upload(self):
+        store = self.standin
+        bucket = self.route[len('/upload/storage/v1/b/'):].split('/', 1)[0]
+        upload_type = self.query.get('uploadType')
+        body = self._read_body()
+
+        if upload_type == 'multipart':
+            metadata, data = parse_related(body, self.headers.get('Content-Type', ''))
+            return self._store_gcs(bucket, metadata.get('name') or self.query.get('name'), data)
+        if upload_type == 'media':
+            return self._store_gcs(bucket, self.query.get('name'), body)
+        if upload_type != 'resumable':
+            return self._json(400, {'error': {'message': f'unsupported uploadType {upload_type}'}})
+
+        upload_id = self.query.get('upload_id')
+        if self.command == 'POST' and not upload_id:
+            metadata = json.loads(body or b'{}')
+            upload_id = uuid.uuid4().hex
+            with store.lock:
+                store.resumable[upload_id] = {
+                    'bucket': bucket, 'name': metadata.get('name') or self.query.get('name'), 'data': bytearray()}
+            location = (f'{store.url}/upload/storage/v1/b/{quote(bucket, safe="")}/o'
+                        f'?uploadType=resumable&upload_id={upload_id}')
+            return self._send(200, headers={'Location': location})
+
+        session = store.resumable.get(upload_id)
+        if session is None:
+            return self._json(404, {'error': {'message': 'no such upload'}})
+        total = None
+        content_range = self.headers.get('Content-Range', '')
+        if content_range.startswith('bytes '):
+            span, _, size = content_range[len('bytes '):].partition('/')
+            if size != '*':
+                total = int(size)
+            if span != '*':
+                start = int(span.split('-')[0])
+                del session['data'][start:]
+        session['data'] += body
+        if total is not None and len(session['data']) >= total:
+            with store.lock:
+                store.resumable.pop(upload_id, None)
+            return self._store_gcs(session['bucket'], session['name'], bytes(session['data']))
+        headers = {'Range': f'bytes=0-{len(session["data"]) - 1}'} if session['data'] else {}
+        return self._send(308, headers=headers)
+
+    def _store_gcs(self, bucket, name, data):
+        with self.standin.lock:
+            self.standin.objects[(bucket, name)] = data
+        return self._json(200, gcs_resource(bucket, name, data))
+
+    def gcs_object(self, download=False):
+        store = self.standin
+        prefix = '/download/storage/v1/b/' if download else '/storage/v1/b/'
+        # Object names are percent-encoded as a single path segment
+        raw = self.raw_route[len(prefix):]
+        bucket, _, rest = raw.partition('/')
+        bucket = unquote(bucket)
+        if not rest.startswith('o'):
+            if self.command == 'GET' and not rest:
+                return self._json(200, {'kind': 'storage#bucket', 'name': bucket, 'id': bucket})
+            return self._json(404, {'error': {'message': 'not found'}})
+        rest = rest[1:].lstrip('/')
+
+        if not rest:
+            # Listing
+            prefix_filter = self.query.get('prefix', '')
+            items = [gcs_resource(b, name, data) for (b, name), data in sorted(store.objects.items())
+                     if b == bucket and name.startswith(prefix_filter)]
+            return self._json(200, {'kind': 'storage#objects', 'items': items})
+
+        segment, _, action = rest.partition('/')
+        name = unquote(segment)
+        if action == 'compose' and self.command == 'POST':
+            request = json.loads(self._read_body() or b'{}')
+            try:
+                data = b''.join(store.objects[(bucket, src['name'])] for src in request.get('sourceObjects', []))
+            except KeyError:
+                return self._json(404, {'error': {'message': 'source object not found'}})
+            return self._store_gcs(bucket, name, data)
+
+        data = store.objects.get((bucket, name))
+        if self.command == 'DELETE':
+            if data is None:
+                return self._json(404, {'error': {'message': 'not found'}})
+            with store.lock:
+                store.objects.pop((bucket, name), None)
+            return self._send(204)
+        if data is None:
+            return self._json(404, {'error': {'message': 'not found'}})
+        if download or self.query.get('alt') == 'media':
+            return self._send(200, data)
+        return self._json(200, gcs_resource(bucket, name, data))
+
+
+def parse_related(body, content_type):
+    """Split a multipart/related upload into (metadata dict, media bytes)"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    sections = body.split(b'--' + boundary)
+    payloads = []
+    for section in sections[1:]:
+        if section.startswith(b'--'):
+            break
+        _, _, payload = section.partition(b'\r\n\r\n')
+        payloads.append(payload[:-2] if payload.endswith(b'\r\n') else payload)
+    return json.loads(payloads[0] or b'{}'), payloads[1] if len(payloads) > 1 else b''
+
+
+def decode_aws_chunked(body):
+    """Strip aws-chunked framing (size;chunk-signature=...\\r\\n data \\r\\n ...)"""
+    out = bytearray()
+    pos = 0
+    while pos < len(body):
+        line_end = body.index(b'\r\n', pos)
+        size = int(body[pos:line_end].split(b';', 1)[0], 16)
+        pos = line_end + 2
+        if size == 0:
+            break
+        out += body[pos:pos + size]
+        pos += size + 2
+    return bytes(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every request')
+    parser.add_argument('--conn-mbps', type=float, default=0, help='per-connection cap in MB/s (0: unlimited)')
+    parser.add_argument('--host-mbps', type=float, default=0, help='cap for all connections together in MB/s')
+    parser.add_argument('--max-conns', type=int, default=0, help='media connections served at once before 429s')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of media requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--seed', type=int, help='random seed for --error-rate, --fail-rate and --reset-rate')
+    parser.add_argument('--penalty', action='store_true', help='keep answering 429 until Retry-After has passed')
+    parser.add_argument('--fail-rate', type=float, default=0, help='fraction of segment/file requests answered with 503')
+    parser.add_argument('--reset-rate', type=float, default=0,
+                        help='fraction of segment/file responses cut off halfway through the body')
+    parser.add_argument('--media-dir', help='keep encoded media here between runs (default: a temporary directory)')
+    args = parser.parse_args()
+
+    server = StandinServer(args.host, args.port, args.latency_ms / 1000.0, int(args.conn_mbps * 1024 * 1024),
+                           int(args.host_mbps * 1024 * 1024), args.max_conns, args.error_rate, args.retry_after,
+                           args.seed, args.penalty, args.fail_rate, args.reset_rate, args.media_dir)
+    print(f'Stand-in listening on {server.url}')
+    print(f'  S3:  endpoint_url={server.url}')
+    print(f'  GCS: STORAGE_EMULATOR_HOST={server.url}')
+    print(f'  HLS: {server.url}/media/hls/200x256/index.m3u8')
+    print(f'  Encoded (needs ffmpeg): {server.url}/media/encoded/20x2x800/{{watch.html,hls/index.m3u8,hls-fmp4/index.m3u8,dash/manifest.mpd}}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()